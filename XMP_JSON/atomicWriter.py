@@ -0,0 +1,196 @@
+#! /usr/bin/python
+
+# Crash-safe output for converted presets.
+#
+# Files are written to a temporary file in the destination directory and renamed over the final name once the data is
+# on disk, so a reader (or a restarted job) only ever sees the old file or the complete new one, never truncated JSON.
+#
+# fsync is what makes this durable, but an fsync per file makes bulk runs crawl. AtomicWriter therefore groups files:
+# temp files are written straight away, and every syncEvery files the whole group is fsync'ed, renamed, and each
+# affected directory is fsync'ed once. If the process dies before a group is committed, the final files are untouched
+# and only temp files are left behind; recover() removes those on restart.
+
+import os, os.path
+import errno
+import json
+import threading
+
+
+# marker used in the names of temporary files: .<name>.tmp-<pid>-<n>
+TEMP_MARKER = ".tmp-"
+
+
+# ----------------------------
+
+
+def mkdir_p(path):
+    try:
+        os.makedirs(path)
+    except OSError as exc:
+        if exc.errno == errno.EEXIST and os.path.isdir(path):
+            pass
+        else:
+            raise
+
+
+def tempName(path, n):
+    head, tail = os.path.split(path)
+    return os.path.join(head, "." + tail + TEMP_MARKER + str(os.getpid()) + "-" + str(n))
+
+
+def isTempName(name):
+    return name.startswith(".") and (TEMP_MARKER in name)
+
+
+def syncDirectory(path):
+    # make a rename durable. Not supported on all platforms (e.g. Windows), in which case it is skipped
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path if len(path) > 0 else ".", os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# ----------------------------
+
+
+# write a single file atomically (temp file + rename). If sync is set, the data and the rename are fsync'ed
+
+
+def writeAtomic(path, text, sync=True):
+    directory = os.path.dirname(path)
+    if len(directory) > 0:
+        mkdir_p(directory)
+
+    tmp = tempName(path, 0)
+    try:
+        with open(tmp, 'w') as outf:
+            outf.write(text)
+            outf.flush()
+            if sync:
+                os.fsync(outf.fileno())
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    if sync:
+        syncDirectory(directory)
+
+
+# ----------------------------
+
+
+class AtomicWriter(object):
+    '''
+        Writes files atomically, batching the fsyncs. Files become visible (renamed) when their group is committed,
+        i.e. every syncEvery files and on close(). Safe to use from several threads.
+        syncEvery=0 disables fsync (files are still renamed atomically, straight away).
+        If supplied, onCommit(tags) is called with the tags passed to write() for each group of committed files
+    '''
+
+    def __init__(self, syncEvery=64, onCommit=None):
+        self.syncEvery = max(0, int(syncEvery))
+        self.onCommit = onCommit
+        self.lock = threading.Lock()
+        self.pending = []  # list of (open temp file, temp name, final name, tag)
+        self.count = 0     # used to make temp names unique
+        self.written = 0
+        self.syncs = 0     # number of group commits
+
+    def write(self, path, text, tag=None):
+        directory = os.path.dirname(path)
+        if len(directory) > 0:
+            mkdir_p(directory)
+
+        with self.lock:
+            self.count += 1
+            tmp = tempName(path, self.count)
+
+        outf = open(tmp, 'w')
+        try:
+            outf.write(text)
+            outf.flush()
+        except Exception:
+            outf.close()
+            os.remove(tmp)
+            raise
+
+        if self.syncEvery == 0:
+            outf.close()
+            os.replace(tmp, path)
+            with self.lock:
+                self.written += 1
+            if self.onCommit is not None:
+                self.onCommit([tag])
+            return
+
+        group = None
+        with self.lock:
+            self.pending.append((outf, tmp, path, tag))
+            if len(self.pending) >= self.syncEvery:
+                group = self.pending
+                self.pending = []
+        if group is not None:
+            self.commit(group)
+
+    def writeJSON(self, path, obj, tag=None, **kwargs):
+        self.write(path, json.dumps(obj, **kwargs), tag)
+
+    def commit(self, group):
+        # data first, then the renames, then the directories (once each)
+        for outf, tmp, path, tag in group:
+            os.fsync(outf.fileno())
+            outf.close()
+        directories = set()
+        for outf, tmp, path, tag in group:
+            os.replace(tmp, path)
+            directories.add(os.path.dirname(path))
+        for directory in directories:
+            syncDirectory(directory)
+        with self.lock:
+            self.written += len(group)
+            self.syncs += 1
+        if self.onCommit is not None:
+            self.onCommit([tag for outf, tmp, path, tag in group])
+
+    def flush(self):
+        with self.lock:
+            group = self.pending
+            self.pending = []
+        if len(group) > 0:
+            self.commit(group)
+
+    def close(self):
+        self.flush()
+
+
+# ----------------------------
+
+
+# clean up after a crash: remove temp files left in the output tree (they were never committed, so the final file is
+# either the previous complete version or missing). If verify is set, the final JSON files are also checked, and any
+# that cannot be parsed (e.g. written by an older, non-atomic run) are removed so that they get regenerated.
+# Returns (list of removed temp files, list of removed invalid files)
+
+
+def recover(outdir, verify=False):
+    temps = []
+    invalid = []
+    for root, dirs, files in os.walk(outdir):
+        for name in files:
+            path = os.path.join(root, name)
+            if isTempName(name):
+                os.remove(path)
+                temps.append(path)
+            elif verify and name.lower().endswith(".json"):
+                try:
+                    with open(path, 'r') as inf:
+                        json.load(inf)
+                except ValueError:
+                    os.remove(path)
+                    invalid.append(path)
+    return temps, invalid
@@ -0,0 +1,541 @@
+#! /usr/bin/python
+
+# Script to convert a directory (tree) of XMP presets into JSON presets. See convertXMPToJson.py for the conversion itself.
+#
+# Conversion runs as a pipeline of 3 stages connected by bounded queues, so that reading, converting and writing overlap:
+#   read:    read the XMP file (I/O)
+#   convert: parse and convert to a preset (CPU, serialised - the converter uses global state)
+#   write:   write the JSON preset (I/O)
+# The number of workers of each stage can be set, which is mostly useful for the I/O stages on network storage.
+#
+# Output is crash-safe: files are written to temp files and renamed into place, with the fsyncs grouped every
+# --sync-every files (see atomicWriter.py). Leftovers from a crashed run are cleaned up when the next run starts.
+#
+# Progress is recorded in a journal (see jobJournal.py, default: <output dir>/.batch-journal.jsonl). Re-running the same
+# command after a crash skips the inputs that were finished, and retries the failed or in-flight ones (--max-attempts).
+# The journal also records which converter stages each input depends on, so after a change to the converter only the
+# inputs that use a changed stage are reconverted, the outputs of the others are reused (see stageTracker.py).
+#
+# With --shard i/N only a deterministic subset of the inputs is converted, into <output>/shard-i-of-N/, so that a batch
+# can be split across processes or machines. Use mergeShards.py to combine the shards (see sharding.py).
+#
+# With --processes N the conversions run in N worker processes instead (the converter uses global state, so it only
+# runs one conversion at a time per process). The inputs are then estimated for cost and dispatched most expensive
+# first, a window of inputs at a time (--schedule, --schedule-window, see scheduler.py), and the makespan and idle time
+# of each worker are reported.
+# The workers are supervised (see workerPool.py): a conversion that crashes or hangs its worker (--task-timeout) is
+# retried once on a new worker, then quarantined. Quarantined inputs are recorded (default: <output>/.quarantine.jsonl)
+# and skipped by later runs, unless --retry-quarantined is given. Workers are recycled after --recycle-after tasks or
+# once they use more than --recycle-rss MB.
+#
+# The input directory is scanned by several threads (--scan-threads), and the files are converted as they are found
+# rather than after the whole tree has been listed. Directory listings are cached between runs
+# (<output>/.discovery-cache.jsonl), so that unchanged directories are not listed again (see discovery.py).
+# Sidecars with no Camera Raw settings, or only ones the converter ignores, are found from the raw bytes before parsing
+# (--prefilter, see prefilter.py): they are converted with the info stage only (fast, the default) or skipped (skip,
+# recorded as "filtered" in the journal and in the shard manifest).
+#
+# The input can also be a Lightroom catalog (.lrcat): the develop settings of its images are read in batches and
+# converted directly, without exporting sidecars (see catalogReader.py).
+#
+# Progress can be monitored while the batch runs (see metrics.py): --metrics-port serves Prometheus metrics on localhost,
+# --metrics-json rewrites a JSON file every --metrics-interval seconds.
+#
+# Usage: python batchConvert.py <input dir> <output dir> [--readers N] [--writers N] ...
+
+import os, os.path
+import sys
+import argparse
+import hashlib
+import json
+import time
+
+import convertXMPToJson as converter
+import pipeline
+import atomicWriter
+import jobJournal
+import sharding
+import canonicalJson
+import metrics
+import scheduler
+import workerPool
+import catalogReader
+import costModel
+import discovery
+import prefilter
+
+
+# the writer used by the write stage
+outputWriter = None
+
+# the journal recording the progress of the batch (optional)
+journal = None
+
+# the shard being converted: (index, count, key type, input directory), or None to convert everything
+shard = None
+
+# number of inputs found (before any are skipped)
+inputsSeen = 0
+
+# the inputs quarantined by earlier runs (--processes), which are skipped (counted as seen, see runBatch)
+quarantinedInputs = set()
+
+# set if the input is a Lightroom catalog, the items then carry the settings text rather than naming a file
+catalogInput = False
+
+# the scan of the input directory (see discovery.py), and the (size, mtime) of the files it found, for the journal
+inputScan = None
+fileFingerprints = None
+
+# the prefilter for inputs with nothing to convert (see prefilter.py), or None, and what to do with the rejected
+# inputs: "fast" (convert them with the fast path) or "skip" (don't write any output)
+inputFilter = None
+prefilterMode = "off"
+
+# the worker processes that run the conversions (--processes), or None to convert in this process
+processPool = None
+
+# busy periods of the worker processes, and the ordering of the inputs, with the estimated makespans (ms) of the
+# orders (see scheduler.py)
+timeline = None
+ordering = None
+
+# metrics of the pipeline stages (the converter records its own, see convertXMPToJson.py)
+batchItems = metrics.registry.counter("xmp_batch_items_total", "Items processed by each pipeline stage", ["stage"])
+batchErrors = metrics.registry.counter("xmp_batch_errors_total", "Failed items, by pipeline stage", ["stage"])
+batchSeconds = metrics.registry.histogram("xmp_batch_stage_seconds", "Time spent on an item by each pipeline stage", ["stage"])
+
+
+# ----------------------------
+
+
+def main():
+
+    # parse the command line args
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="the directory containing the XMP files (searched recursively), or a Lightroom catalog (.lrcat)")
+    parser.add_argument("output", help="the directory for the JSON files")
+    parser.add_argument("--stream", action="store_true", help="stream the input and only keep the Camera Raw settings (for large sidecars)")
+    parser.add_argument("--readers", type=int, default=4, help="number of reader threads")
+    parser.add_argument("--converters", type=int, default=1, help="number of converter threads")
+    parser.add_argument("--writers", type=int, default=4, help="number of writer threads")
+    parser.add_argument("--processes", type=int, default=0, help="convert in N worker processes (0: in this process, see --converters)")
+    parser.add_argument("--schedule", choices=scheduler.ORDERS, default="largest-first",
+                        help="order in which the inputs are dispatched to the worker processes")
+    parser.add_argument("--schedule-window", type=int, default=scheduler.defaultWindow,
+                        help="number of inputs estimated and ordered together (as they are found)")
+    parser.add_argument("--task-timeout", type=float, default=60.0, help="worker processes: max. time (secs) for a conversion")
+    parser.add_argument("--recycle-after", type=int, default=1000, help="worker processes: replace a worker after N conversions")
+    parser.add_argument("--recycle-rss", type=float, default=1024.0, help="worker processes: replace a worker once it uses more than N MB")
+    parser.add_argument("--quarantine", help="file listing the inputs that crashed or hung a worker (default: <output>/.quarantine.jsonl)")
+    parser.add_argument("--retry-quarantined", action="store_true", help="convert the quarantined inputs again")
+    parser.add_argument("--scan-threads", type=int, default=8, help="number of threads scanning the input directories")
+    parser.add_argument("--discovery-cache", help="cache of the input directory listings (default: <output>/.discovery-cache.jsonl)")
+    parser.add_argument("--no-discovery-cache", action="store_true", help="don't cache the input directory listings")
+    parser.add_argument("--rescan", action="store_true", help="ignore the cached directory listings (e.g. on storage that does not update directory mtimes)")
+    parser.add_argument("--prefilter", choices=["fast", "skip", "off"], default="fast",
+                        help="inputs with no Camera Raw settings that the converter uses: convert them with the fast path (same output), "
+                             "skip them (no output), or convert them in full")
+    parser.add_argument("--catalog-batch", type=int, default=catalogReader.batchSize, help="catalog input: rows read per query")
+    parser.add_argument("--queue-size", type=int, default=32, help="size of the queue in front of each stage")
+    parser.add_argument("--sync-every", type=int, default=64, help="fsync the output every N files (0: no fsync)")
+    parser.add_argument("--verify", action="store_true", help="on startup, check existing output files and remove any incomplete ones")
+    parser.add_argument("--journal", help="the journal file used to resume the batch (default: <output>/.batch-journal.jsonl)")
+    parser.add_argument("--no-journal", action="store_true", help="don't record progress (always convert everything)")
+    parser.add_argument("--max-attempts", type=int, default=3, help="number of times a failing input is attempted (across runs)")
+    parser.add_argument("--shard", help="only convert shard i of N (i/N, 0 <= i < N), into <output>/shard-i-of-N")
+    parser.add_argument("--shard-key", choices=["content", "path"], default="content",
+                        help="assign inputs to shards by content hash (every shard reads every input) or by relative path")
+    parser.add_argument("--canonical", action="store_true", help="write canonical (sorted, rounded, compact) JSON and an ETag file for each preset")
+    parser.add_argument("--precision", type=int, default=converter.floatPrecision, help="canonical output: number of decimal places kept")
+    parser.add_argument("--omit-defaults", action="store_true", help="canonical output: leave out parameters at their default value")
+    parser.add_argument("--cost-budget", type=float, help="annotate each preset with its estimated device cost, and flag it if over this budget")
+    parser.add_argument("--preview-lite", action="store_true", help="also write a preview-lite variant (<name>.lite.json) of presets over the cost budget")
+    parser.add_argument("--lifecycle", choices=["fresh", "pooled"], default=converter.lifecycle,
+                        help="create new metadata/state objects for each preset, or reset and reuse them")
+    parser.add_argument("--verbose", action="store_true", help="show the converter output")
+    parser.add_argument("--metrics-port", type=int, help="serve metrics (Prometheus text format) at http://localhost:<port>/metrics")
+    parser.add_argument("--metrics-json", help="write the metrics to this JSON file while the batch runs")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="seconds between writes of --metrics-json")
+    args = parser.parse_args()
+
+    global shard
+
+    converter.streamInput = args.stream
+    converter.lifecycle = args.lifecycle
+    converter.canonicalOutput = args.canonical
+    converter.floatPrecision = args.precision
+    converter.omitDefaults = args.omit_defaults
+    converter.costBudget = args.cost_budget
+    converter.previewLite = args.preview_lite
+    if args.preview_lite and args.cost_budget is None:
+        converter.costBudget = costModel.defaultBudget
+
+    outdir = args.output
+    if args.shard is not None:
+        index, count = sharding.parseShard(args.shard)
+        if args.no_journal:
+            parser.error("--shard needs the journal (it is used to build the shard manifest)")
+        shard = (index, count, args.shard_key, args.input)
+        outdir = sharding.shardDirectory(args.output, index, count)
+
+    # clean up after any previous (crashed) run
+    temps, invalid = atomicWriter.recover(outdir, args.verify)
+    if len(temps) > 0 or len(invalid) > 0:
+        print("Recovered output: removed " + str(len(temps)) + " temp files and " + str(len(invalid)) + " incomplete files")
+
+    batchJournal = None
+    if not args.no_journal:
+        path = args.journal
+        if path is None:
+            path = os.path.join(outdir, ".batch-journal.jsonl")
+        batchJournal = jobJournal.JobJournal(path, args.max_attempts, converter.stageVersions())
+
+    metricsServer = None
+    if args.metrics_port is not None:
+        metricsServer = metrics.serve(args.metrics_port)
+        print("Serving metrics at: http://localhost:" + str(args.metrics_port) + "/metrics")
+    metricsDump = None
+    if args.metrics_json is not None:
+        metricsDump = metrics.PeriodicDump(args.metrics_json, args.metrics_interval)
+
+    global processPool, catalogInput, inputScan, fileFingerprints, inputFilter, prefilterMode, quarantinedInputs
+    converters = args.converters
+    order = None
+    catalogInput = args.input.lower().endswith(".lrcat")
+    if catalogInput:
+        inputs = catalogReader.findInputs(args.input, outdir, args.catalog_batch)
+    else:
+        cache = None
+        if not args.no_discovery_cache:
+            cache = args.discovery_cache if args.discovery_cache is not None else os.path.join(outdir, ".discovery-cache.jsonl")
+        inputScan = discovery.Discovery(args.input, ".xmp", args.scan_threads, cache, args.rescan)
+        if batchJournal is not None:
+            fileFingerprints = {}
+        inputs = findInputs(inputScan, args.input, outdir, fileFingerprints)
+        prefilterMode = args.prefilter
+    if args.processes > 0:
+        processPool = workerPool.WorkerPool(convertInWorker, args.processes, initWorker,
+                                            (args.stream, args.lifecycle, args.verbose, catalogInput),
+                                            args.task_timeout, args.recycle_after, args.recycle_rss)
+        # one converter thread per process, each waits for its conversion to finish
+        converters = args.processes
+        order = args.schedule
+
+        quarantineFile = args.quarantine
+        if quarantineFile is None:
+            quarantineFile = os.path.join(outdir, ".quarantine.jsonl")
+        quarantined = loadQuarantine(quarantineFile)
+        if len(quarantined) > 0 and not args.retry_quarantined:
+            print("Skipping " + str(len(quarantined)) + " quarantined inputs (see " + quarantineFile + ", or use --retry-quarantined)")
+            quarantinedInputs = quarantined
+
+    # the converter is very chatty, only show its output if asked to
+    console = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, 'w')
+    try:
+        if prefilterMode != "off":
+            # the converter runs its stages to find the keys they use, and prints while doing so
+            inputFilter = prefilter.fromConverter(converter)
+            if inputFilter is not None and batchJournal is not None:
+                # the inputs filtered (or converted by the fast path) with other keys are reconverted
+                batchJournal.stageVersions["prefilter"] = inputFilter.version
+        report, errors = runBatch(inputs, args.readers, converters, args.writers, args.queue_size,
+                                  args.sync_every, batchJournal, order, args.schedule_window)
+    finally:
+        if sys.stdout is not console:
+            sys.stdout.close()
+            sys.stdout = console
+        if processPool is not None:
+            processPool.shutdown()
+        if metricsDump is not None:
+            metricsDump.stop()
+        if metricsServer is not None:
+            metricsServer.shutdown()
+
+    pipeline.printReport(report)
+    if inputScan is not None:
+        discovery.printReport(inputScan.summary())
+        for directory, e in inputScan.errors:
+            print("UNREADABLE: " + directory + ": " + e)
+    if inputFilter is not None:
+        print("Prefilter: " + prefilter.describe(prefilter.summary()) + (" (skipped)" if prefilterMode == "skip" else " (fast path)"))
+    if processPool is not None:
+        print("Estimated makespan: " + ", ".join(o + " " + ("%.3f" % (ordering.estimates[o] / 1000.0)) + "s" for o in scheduler.ORDERS))
+        scheduler.printReport(timeline.report(), order)
+        supervisor = processPool.summary()
+        print("Workers: " + str(supervisor["crashes"]) + " crashes, " + str(supervisor["timeouts"]) + " timeouts, " +
+              str(supervisor["restarts"]) + " restarts, " + str(supervisor["recycled"]) + " recycled")
+        saveQuarantine(quarantineFile, processPool.quarantine)
+        for infile, reason in processPool.quarantine:
+            print("QUARANTINED: " + infile + ": " + reason)
+    for stage, item, e in errors:
+        print("ERROR (" + stage + "): " + str(item[0]) + ": " + str(e))
+    if converter.costBudget is not None:
+        print("Over the cost budget of " + str(converter.costBudget) + ": " + str(converter.overBudget.snapshot()) + " presets" +
+              (" (preview-lite variants written)" if converter.previewLite else "") + ", see costModel.py for a report")
+
+    if batchJournal is not None:
+        batchJournal.close()
+        summary = batchJournal.summary()
+        print("Journal: skipped " + str(summary["skipped"]) + " finished inputs, gave up on " + str(summary["givenUp"]) +
+              " inputs. Totals: done " + str(summary["done"]) + ", failed " + str(summary["failed"]) +
+              (", filtered " + str(summary["filtered"]) if summary["filtered"] > 0 else ""))
+        if summary["outdated"] > 0:
+            print("Reconverted " + str(summary["outdated"]) + " finished inputs affected by changes to: " +
+                  ", ".join(sorted(batchJournal.changedStages)))
+        if summary["missing"] > 0:
+            print("Reconverted " + str(summary["missing"]) + " finished inputs whose output is missing")
+        for infile in batchJournal.givenUp:
+            print("GAVE UP: " + infile)
+
+    if shard is not None:
+        quarantined = set(quarantinedInputs)
+        if processPool is not None:
+            quarantined.update(infile for infile, reason in processPool.quarantine)
+        manifest = sharding.writeManifest(outdir, shard[0], shard[1], shard[2], args.input, inputsSeen, batchJournal, quarantined)
+        print("Shard " + str(shard[0]) + "/" + str(shard[1]) + ": " + str(len(manifest["converted"])) + " converted, " +
+              str(len(manifest["failed"])) + " failed, " + str(len(manifest["quarantined"])) + " quarantined, of " +
+              str(inputsSeen) + " inputs")
+
+    if len(errors) > 0:
+        sys.exit(1)
+
+
+# ----------------------------
+
+
+# generate (input file, output file) pairs for the XMP files found by the scan of the input directory, as they are
+# found. The output tree mirrors the input tree. The (size, mtime) of each file is added to fingerprints (if given)
+
+
+def findInputs(scan, indir, outdir, fingerprints=None):
+    for infile, size, mtime in scan.scan():
+        if fingerprints is not None:
+            fingerprints[infile] = (size, mtime)
+        rel = os.path.relpath(infile, indir)
+        yield (infile, os.path.join(outdir, os.path.splitext(rel)[0] + ".json"))
+
+
+# ----------------------------
+
+
+# run the conversion pipeline over the (input file, output file) pairs. Returns the pipeline report and the errors
+
+
+def runBatch(items, readers=4, converters=1, writers=4, queueSize=32, syncEvery=64, batchJournal=None, order=None,
+             window=scheduler.defaultWindow):
+    global outputWriter, journal, inputsSeen, timeline, ordering
+
+    journal = batchJournal
+    inputsSeen = 0
+    items = counted(items)
+    if len(quarantinedInputs) > 0:
+        # after counting them, so that every shard sees the same number of inputs
+        items = (item for item in items if not isQuarantined(item))
+    if shard is not None and shard[2] == "path":
+        # the path is known up front, so the other shards' inputs are never read
+        items = (item for item in items if inPathShard(item))
+    if journal is not None:
+        # skip whatever was finished by a previous run
+        items = (item for item in items if journal.check(item[0], inputFingerprint(item)))
+    if order is not None:
+        # the inputs are estimated and ordered a window at a time, as they are found
+        ordering = scheduler.WindowedOrder(order, converters, inputCost, window)
+        items = ordering.items(items)
+        timeline = scheduler.Timeline()
+
+    outputWriter = atomicWriter.AtomicWriter(syncEvery, onCommit=committed)
+    stages = [ pipeline.Stage("read", journaled("read", readStage), readers, queueSize),
+               pipeline.Stage("convert", journaled("convert", convertStage), converters, queueSize),
+               pipeline.Stage("write", journaled("write", writeStage), writers, queueSize) ]
+    p = pipeline.Pipeline(stages)
+    report = p.run(items)
+    # commit whatever is left in the last (partial) group
+    outputWriter.close()
+    return report, p.errors()
+
+
+def counted(items):
+    global inputsSeen
+    for item in items:
+        inputsSeen += 1
+        yield item
+
+
+# catalog inputs are (source, output file, settings text), files are (input file, output file)
+
+
+def inputFingerprint(item):
+    if len(item) > 2:
+        return catalogReader.fingerprint(item[2])
+    # found by the scan (None: the journal stats the file)
+    return fileFingerprints.pop(item[0], None) if fileFingerprints is not None else None
+
+
+def inPathShard(item):
+    if sharding.shardOf(sharding.pathHash(item[0], shard[3]), shard[1]) == shard[0]:
+        return True
+    if fileFingerprints is not None:
+        fileFingerprints.pop(item[0], None)
+    return False
+
+
+def isQuarantined(item):
+    if item[0] not in quarantinedInputs:
+        return False
+    if fileFingerprints is not None:
+        fileFingerprints.pop(item[0], None)
+    return True
+
+
+def inputCost(item):
+    return scheduler.costOf(item[2].encode('utf-8')) if len(item) > 2 else scheduler.estimateCost(item[0])
+
+
+def readStage(item):
+    infile, outfile = item[0], item[1]
+    # when sharding by content, the shard is only known once the file has been read
+    contentShard = (shard is not None and shard[2] == "content")
+    if journal is not None and not contentShard:
+        journal.started(infile)
+    if len(item) > 2:
+        data = item[2].encode('utf-8')
+    else:
+        with open(infile, 'rb') as inf:
+            data = inf.read()
+    hash = hashlib.sha1(data).hexdigest()
+    if contentShard:
+        if sharding.shardOf(hash, shard[1]) != shard[0]:
+            if journal is not None:
+                journal.forget(infile)
+            return None
+        if journal is not None:
+            journal.started(infile)
+    return (infile, outfile, data, hash)
+
+
+def convertStage(item):
+    infile, outfile, data, hash = item
+    reason = inputFilter.check(data) if inputFilter is not None else None
+    if reason is not None:
+        # nothing to convert: the preset would have no filters
+        if prefilterMode == "skip":
+            if journal is not None:
+                journal.filtered(infile, hash, { "stages": { "prefilter": inputFilter.version }, "keys": {} }, reason)
+            return None
+        preset, dependencies = converter.convertInfoOnly(data, infile, outfile)
+        dependencies["stages"]["prefilter"] = inputFilter.version
+    elif processPool is not None:
+        preset, dependencies, worker, start, end = processPool.run(data, infile, outfile, key=infile)
+        timeline.record(worker, start, end)
+    else:
+        preset, dependencies = convertData(data, infile, outfile)
+    return (infile, outfile, preset, (hash, dependencies))
+
+
+# convert the data of an input: an XMP file, or the settings text of a catalog image (named after the output file)
+
+
+def convertData(data, infile, outfile):
+    if catalogInput:
+        settings = catalogReader.parseSettings(data.decode('utf-8'))
+        meta = catalogReader.toMetadata(settings, os.path.splitext(os.path.basename(outfile))[0])
+        return converter.convertPresetMetadata(meta, infile, outfile)
+    return converter.convertPresetDependencies(data, infile, outfile)
+
+
+def writeStage(item):
+    infile, outfile, preset, (hash, dependencies) = item
+    # any preview-lite variant comes first, so that it is committed no later than the preset
+    for path, variant in converter.costVariants(preset, outfile):
+        text = converter.formatPreset(variant)
+        if converter.canonicalOutput:
+            # written first, so that it is committed no later than the preset
+            outputWriter.write(canonicalJson.hashFile(path), converter.presetHashes(text))
+        outputWriter.write(path, text, (infile, outfile, hash, dependencies) if path == outfile else None)
+    return (infile, outfile)
+
+
+# set up a worker process (--processes) with the converter settings
+
+
+def initWorker(stream, lifecycle, verbose, catalog):
+    global catalogInput
+    converter.streamInput = stream
+    converter.lifecycle = lifecycle
+    catalogInput = catalog
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+
+
+# convert in a worker process. Returns (preset, dependencies, worker slot, start time, end time)
+
+
+def convertInWorker(data, infile, outfile):
+    start = time.time()
+    preset, dependencies = convertData(data, infile, outfile)
+    return (preset, dependencies, workerPool.workerSlot, start, time.time())
+
+
+# the quarantine list: one JSON object per line, { "input": ..., "reason": ... }. Returns the set of quarantined inputs
+
+
+def loadQuarantine(path):
+    quarantined = set()
+    if os.path.exists(path):
+        with open(path, 'r') as inf:
+            for line in inf:
+                line = line.strip()
+                if len(line) > 0:
+                    quarantined.add(json.loads(line)["input"])
+    return quarantined
+
+
+def saveQuarantine(path, entries):
+    if len(entries) == 0:
+        return
+    text = "".join(json.dumps({ "input": infile, "reason": reason }) + "\n" for infile, reason in entries)
+    atomicWriter.mkdir_p(os.path.dirname(path) or ".")
+    with open(path, 'a') as outf:
+        outf.write(text)
+
+
+# called by the writer once a group of outputs is on disk, only then are the inputs recorded as done
+
+
+def committed(tags):
+    if journal is not None:
+        for tag in tags:
+            if tag is not None:
+                infile, outfile, hash, dependencies = tag
+                journal.done(infile, hash, dependencies, outfile)
+        journal.sync()
+
+
+# wraps a stage function so that failures are recorded in the journal (and the stage's metrics)
+
+
+def journaled(name, func):
+    def stage(item):
+        start = time.time()
+        try:
+            return func(item)
+        except Exception as e:
+            batchErrors.inc(stage=name)
+            if journal is not None:
+                journal.failed(item[0], e)
+            raise
+        finally:
+            batchItems.inc(stage=name)
+            batchSeconds.observe(time.time() - start, stage=name)
+    return stage
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#! /usr/bin/python
+
+# Canonical JSON output for converted presets.
+#
+# The default output (json.dumps with indent=2) is readable, but not stable or small: floats carry conversion noise
+# (e.g. 0.30000000000000004), parameters that are at their default value are included, and the indentation is a large
+# part of the file. In canonical form:
+#   - keys are sorted (lists, e.g. the filter chain, keep their order)
+#   - floats are rounded to a fixed number of decimal places (-0.0 becomes 0.0)
+#   - optionally, parameters that are at the filter's default value are left out
+#   - there is no whitespace
+# so presets that describe the same look produce the same bytes, and can be hashed, diffed and cached cheaply.
+#
+# hashes() gives the ETag of the output (hash of the bytes) and a hash of the look alone (the filter chain, without
+# the key and info), which is the same for identical looks in different files.
+
+import hashlib
+import json
+
+
+# default number of decimal places kept
+defaultPrecision = 6
+
+# parameter values that filters use when the parameter is not supplied (Core Image defaults). Only used to leave out
+# parameters, so only list filters whose defaults are known to be applied by the app
+filterDefaults = { "CIExposureAdjust":        { "inputEV": 0.0 },
+                   "CIVibrance":              { "inputAmount": 0.0 },
+                   "CIHighlightShadowAdjust": { "inputShadowAmount": 0.0, "inputHighlightAmount": 1.0 },
+                   "CISharpenLuminance":      { "inputSharpness": 0.4 },
+                   "CINoiseReduction":        { "inputNoiseLevel": 0.02, "inputSharpness": 0.4 },
+                   "CIToneCurve":             { "inputPoint0": [0.0, 0.0], "inputPoint1": [0.25, 0.25], "inputPoint2": [0.5, 0.5],
+                                                "inputPoint3": [0.75, 0.75], "inputPoint4": [1.0, 1.0] } }
+
+
+# ----------------------------
+
+
+# round all the floats in a (JSON) object
+
+
+def quantize(obj, precision=defaultPrecision):
+    if isinstance(obj, float):
+        value = round(obj, precision)
+        return 0.0 if value == 0.0 else value
+    if isinstance(obj, dict):
+        return dict((k, quantize(v, precision)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return [quantize(v, precision) for v in obj]
+    return obj
+
+
+# remove the parameters that are at their default value (compared after rounding)
+
+
+def omitDefaults(preset, precision=defaultPrecision):
+    filters = []
+    for f in preset.get("filters", []):
+        defaults = filterDefaults.get(f.get("key"))
+        if defaults is not None:
+            f = dict(f)
+            f["parameters"] = [ p for p in f["parameters"]
+                                if p["key"] not in defaults or quantize(p["val"], precision) != quantize(defaults[p["key"]], precision) ]
+        filters.append(f)
+    preset = dict(preset)
+    preset["filters"] = filters
+    return preset
+
+
+# ----------------------------
+
+
+# the canonical form of a preset (a new object, the preset is not modified)
+
+
+def canonicalize(preset, precision=defaultPrecision, omit=False):
+    if omit:
+        preset = omitDefaults(preset, precision)
+    return quantize(preset, precision)
+
+
+def dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+
+# canonical JSON text of a preset
+
+
+def formatPreset(preset, precision=defaultPrecision, omit=False):
+    return dumps(canonicalize(preset, precision, omit))
+
+
+# returns { "etag": <hash of the text>, "look": <hash of the filter chain> } for the canonical text of a preset
+
+
+def hashes(text):
+    preset = json.loads(text)
+    return { "etag": '"' + hashlib.sha256(text.encode('utf-8')).hexdigest() + '"',
+             "look": hashlib.sha256(dumps(preset.get("filters", [])).encode('utf-8')).hexdigest() }
+
+
+# name of the file holding the hashes of an output file
+
+
+def hashFile(path):
+    return path + ".etag"
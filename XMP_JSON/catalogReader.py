@@ -0,0 +1,309 @@
+#! /usr/bin/python
+
+# Input adapter for Lightroom catalogs (.lrcat), so develop settings can be converted in bulk without exporting a
+# sidecar for every image first.
+#
+# A catalog is a SQLite database. The develop settings of each image are in Adobe_imageDevelopSettings.text as a
+# serialised Lua table, e.g.
+#   s = { Exposure2012 = 0.35, ConvertToGrayscale = false, ToneCurvePV2012 = { 0, 0, 64, 58, 192, 198, 255, 255, }, ... }
+# with the same names as the crs: keys of a sidecar. The rows are read in batches (keyset pagination on id_local, so
+# each query is an index range scan however large the catalog is) and each one is mapped onto a
+# xmpStream.StreamedXMP, which the converter reads in place of a parsed sidecar:
+#   - numbers, strings and booleans become crs: properties ("True"/"False" for booleans)
+#   - ToneCurve* lists of x, y values become the "x, y" items of the rdf:Seq of a sidecar
+#   - other tables (masks, look, retouching etc.) are not used by the converter and are dropped
+# The image's file name is used as the preset name, and the output tree mirrors the catalog's folders.
+#
+# The catalog is opened read-only. Lightroom locks the catalog while it is open, so close it (or use a copy) first.
+#
+# Usage:
+#   python batchConvert.py catalog.lrcat json/                          (see batchConvert.py)
+#   python catalogReader.py catalog.lrcat                               (list the images with develop settings)
+#   python catalogReader.py --fixture test.lrcat XMP/sample.xmp ...     (write a small catalog from XMP files)
+
+import os, os.path
+import re
+import sqlite3
+import zlib
+import argparse
+from urllib.request import pathname2url
+
+import xmpStream
+
+
+# rows read per query
+batchSize = 500
+
+SETTINGS_QUERY = ("SELECT ds.id_local, ds.text, f.baseName, fo.pathFromRoot "
+                  "FROM Adobe_imageDevelopSettings ds "
+                  "JOIN Adobe_images i ON i.id_local = ds.image "
+                  "LEFT JOIN AgLibraryFile f ON f.id_local = i.rootFile "
+                  "LEFT JOIN AgLibraryFolder fo ON fo.id_local = f.folder "
+                  "WHERE ds.id_local > ? AND ds.text IS NOT NULL "
+                  "ORDER BY ds.id_local LIMIT ?")
+
+# tokens of a Lua table literal
+LUA_TOKEN = re.compile(r'''\s*(?:(?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|
+                                 (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')|
+                                 (?P<long>\[(?P<level>=*)\[.*?\](?P=level)\])|
+                                 (?P<name>[A-Za-z_][A-Za-z0-9_]*)|
+                                 (?P<symbol>[{}=,;\[\]])|
+                                 (?P<comment>--[^\n]*))''', re.VERBOSE | re.DOTALL)
+
+LUA_ESCAPES = { "n": "\n", "t": "\t", "r": "\r", "\\": "\\", '"': '"', "'": "'", "\n": "\n" }
+
+
+# ----------------------------
+
+
+def main():
+
+    # parse the command line args
+    parser = argparse.ArgumentParser()
+    parser.add_argument("catalog", help="the Lightroom catalog (.lrcat)")
+    parser.add_argument("xmp", nargs="*", help="--fixture: the XMP files to put in the catalog")
+    parser.add_argument("--fixture", action="store_true", help="write a small catalog with the develop settings of the XMP files")
+    args = parser.parse_args()
+
+    if args.fixture:
+        writeFixture(args.catalog, args.xmp)
+        print("Saved " + str(len(args.xmp)) + " images to: " + args.catalog)
+        return
+
+    count = 0
+    for source, outfile, text in findInputs(args.catalog, ""):
+        settings = parseSettings(text)
+        print(source + " -> " + outfile + " (" + str(len(settings)) + " settings)")
+        count += 1
+    print(str(count) + " images with develop settings")
+
+
+# ----------------------------
+
+
+def connect(path):
+    # read-only, so that a conversion can never modify the catalog
+    return sqlite3.connect("file:" + pathname2url(os.path.abspath(path)) + "?mode=ro", uri=True)
+
+
+# read the develop settings of a catalog, in batches. Yields (id, settings text, file base name, folder path)
+
+
+def readSettings(path, size=None):
+    size = size if size is not None else batchSize
+    conn = connect(path)
+    try:
+        last = -1
+        while True:
+            rows = conn.execute(SETTINGS_QUERY, (last, size)).fetchall()
+            for row in rows:
+                yield row
+            if len(rows) < size:
+                break
+            last = rows[-1][0]
+    finally:
+        conn.close()
+
+
+# the inputs of a catalog for batchConvert.py: (source, output file, settings text), where source is
+# <catalog>#<settings id>. The output tree mirrors the catalog's folders: <outdir>/<folder>/<file name>.json, with the
+# id appended for the second and later settings of the same file (virtual copies)
+
+
+def findInputs(path, outdir, size=None):
+    seen = set()
+    for id, text, baseName, folder in readSettings(path, size):
+        name = baseName if baseName else "image-" + str(id)
+        rel = os.path.join(*([p for p in (folder or "").split("/") if len(p) > 0] + [name]))
+        if rel in seen:
+            rel = rel + "-" + str(id)
+        seen.add(rel)
+        yield (path + "#" + str(id), os.path.join(outdir, rel + ".json"), text)
+
+
+# journal fingerprint of a settings text (used in place of the file size and mtime)
+
+
+def fingerprint(text):
+    data = text.encode('utf-8')
+    return (len(data), zlib.crc32(data))
+
+
+# ----------------------------
+
+
+# parse the settings text ("s = { ... }") into a dict
+
+
+def parseSettings(text):
+    tokens = tokenize(text)
+    pos = 0
+    # skip the assignment
+    if len(tokens) > 2 and tokens[0][0] == "name" and tokens[1] == ("symbol", "="):
+        pos = 2
+    value, pos = parseValue(tokens, pos)
+    return value if isinstance(value, dict) else {}
+
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    end = len(text.rstrip())
+    while pos < end:
+        match = LUA_TOKEN.match(text, pos)
+        if match is None:
+            raise ValueError("invalid settings text at offset " + str(pos) + ": " + text[pos:pos+20])
+        pos = match.end()
+        kind = match.lastgroup if match.lastgroup != "level" else "long"
+        if kind == "comment":
+            continue
+        tokens.append((kind, match.group(kind)))
+    return tokens
+
+
+def parseValue(tokens, pos):
+    kind, text = tokens[pos]
+    if kind == "number":
+        value = float(text)
+        return (int(value) if value == int(value) and "." not in text and "e" not in text.lower() else value), pos + 1
+    if kind == "string":
+        return unescape(text[1:-1]), pos + 1
+    if kind == "long":
+        return text[text.index("[", 1) + 1:text.rindex("]", 0, len(text) - 1)], pos + 1
+    if kind == "name":
+        return { "true": True, "false": False }.get(text), pos + 1
+    if text == "{":
+        return parseTable(tokens, pos + 1)
+    raise ValueError("unexpected '" + text + "' in settings text")
+
+
+# a table becomes a dict, or a list if it only has positional values
+
+
+def parseTable(tokens, pos):
+    fields = {}
+    items = []
+    while tokens[pos] != ("symbol", "}"):
+        kind, text = tokens[pos]
+        if kind == "name" and tokens[pos + 1] == ("symbol", "="):
+            key, pos = text, pos + 2
+            fields[key], pos = parseValue(tokens, pos)
+        elif (kind, text) == ("symbol", "["):
+            key, pos = parseValue(tokens, pos + 1)
+            pos += 2  # ] =
+            fields[key], pos = parseValue(tokens, pos)
+        else:
+            value, pos = parseValue(tokens, pos)
+            items.append(value)
+        if tokens[pos] in [("symbol", ","), ("symbol", ";")]:
+            pos += 1
+    if len(fields) == 0:
+        return items, pos + 1
+    for i, value in enumerate(items):
+        fields[i + 1] = value
+    return fields, pos + 1
+
+
+def unescape(text):
+    if "\\" not in text:
+        return text
+    return re.sub(r'\\(\d{1,3}|.)', lambda m: chr(int(m.group(1))) if m.group(1).isdigit() else LUA_ESCAPES.get(m.group(1), m.group(1)),
+                  text, flags=re.DOTALL)
+
+
+# ----------------------------
+
+
+# the settings as the metadata object read by the converter. name/group are used as the preset info
+
+
+def toMetadata(settings, name=None, group=None):
+    meta = xmpStream.StreamedXMP()
+    for key, value in settings.items():
+        if not isinstance(key, str):
+            continue
+        if isinstance(value, bool):
+            meta.properties[key] = "True" if value else "False"
+        elif isinstance(value, (int, float)):
+            meta.properties[key] = repr(value)
+        elif isinstance(value, str):
+            meta.properties[key] = value
+        elif isinstance(value, list) and key.startswith("ToneCurve"):
+            points = [v for v in value if isinstance(v, (int, float))]
+            meta.arrays[key] = [formatNumber(x) + ", " + formatNumber(y) for x, y in zip(points[0::2], points[1::2])]
+    if name is not None and "Name" not in meta.properties:
+        meta.properties["Name"] = name
+    if group is not None and "Group" not in meta.properties:
+        meta.properties["Group"] = group
+    return meta
+
+
+def formatNumber(value):
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+# ----------------------------
+
+
+# write a catalog with the (minimal) tables used above, one image per XMP file, e.g. for testing the adapter
+
+
+def writeFixture(path, xmpFiles):
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    try:
+        conn.executescript('''
+            CREATE TABLE AgLibraryRootFolder (id_local INTEGER PRIMARY KEY, absolutePath TEXT, name TEXT);
+            CREATE TABLE AgLibraryFolder (id_local INTEGER PRIMARY KEY, pathFromRoot TEXT, rootFolder INTEGER);
+            CREATE TABLE AgLibraryFile (id_local INTEGER PRIMARY KEY, baseName TEXT, extension TEXT, folder INTEGER);
+            CREATE TABLE Adobe_images (id_local INTEGER PRIMARY KEY, rootFile INTEGER);
+            CREATE TABLE Adobe_imageDevelopSettings (id_local INTEGER PRIMARY KEY, image INTEGER, text TEXT);
+            CREATE INDEX index_Adobe_imageDevelopSettings_image ON Adobe_imageDevelopSettings(image);
+        ''')
+        conn.execute("INSERT INTO AgLibraryRootFolder VALUES (1, '/photos/', 'photos')")
+        folders = {}
+        for i, xmpFile in enumerate(xmpFiles):
+            folder = os.path.basename(os.path.dirname(os.path.abspath(xmpFile))) + "/"
+            if folder not in folders:
+                folders[folder] = len(folders) + 1
+                conn.execute("INSERT INTO AgLibraryFolder VALUES (?, ?, 1)", (folders[folder], folder))
+            baseName = os.path.splitext(os.path.basename(xmpFile))[0]
+            conn.execute("INSERT INTO AgLibraryFile VALUES (?, ?, 'dng', ?)", (i + 1, baseName, folders[folder]))
+            conn.execute("INSERT INTO Adobe_images VALUES (?, ?)", (i + 1, i + 1))
+            meta = xmpStream.parseFile(xmpFile)
+            conn.execute("INSERT INTO Adobe_imageDevelopSettings VALUES (?, ?, ?)", (i + 1, i + 1, toLua(meta)))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# the settings text of a parsed XMP file (xmpStream.StreamedXMP)
+
+
+def toLua(meta):
+    fields = []
+    for key in sorted(meta.properties.keys()):
+        fields.append("\t" + key + " = " + luaValue(meta.properties[key]) + ",\n")
+    for key in sorted(meta.arrays.keys()):
+        values = [v.strip() for item in meta.arrays[key] for v in item.split(",")]
+        fields.append("\t" + key + " = {\n" + "".join("\t\t" + v + ",\n" for v in values) + "\t},\n")
+    return "s = {\n" + "".join(fields) + "}\n"
+
+
+def luaValue(text):
+    if text in ["True", "False"]:
+        return text.lower()
+    try:
+        float(text)
+        return text.lstrip("+")
+    except ValueError:
+        return '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,10 @@
 
 import os, os.path
 import errno
+import math
+import time
+import threading
+from collections import OrderedDict
 
 from libxmp import XMPMeta, XMPIterator, utils
 from scipy.interpolate import UnivariateSpline
@@ -15,6 +19,15 @@ import numpy as np
 import json
 import argparse
 
+import xmpStream
+import atomicWriter
+import presetIR
+import stageTracker
+import canonicalJson
+import presetState
+import metrics
+import costModel
+
 
 XMP_NS_CAMERA_RAW = "http://ns.adobe.com/camera-raw-settings/1.0/"
 
@@ -23,22 +36,42 @@ infile = 'sample_sidecar.xmp'
 outfile = 'sample_preset.json'
 
 
-# XMP Metadata
-xmp = XMPMeta()
+# XMP Metadata of the preset being converted, set by parseInput()
+xmp = None
+
+# if set, the input is streamed and only the Camera Raw settings are kept (see xmpStream.py), rather than parsed by libxmp
+streamInput = False
+
+
+# the preset being built, in target-neutral form (see presetIR.py). The output for each target is generated from this
+currentPreset = presetIR.newPreset("")
 
+# the targets (output formats) to generate. The first one is written to the output file, any others alongside it
+outputTargets = ["coreimage"]
 
-# map holding the various filter parameters
-filterMap = {}
+# output format. If canonicalOutput is set, presets are written in canonical form (see canonicalJson.py) with the
+# floats rounded to floatPrecision decimal places, and an ETag file alongside
+canonicalOutput = False
+floatPrecision = canonicalJson.defaultPrecision
+omitDefaults = False
 
-# there are several ways to change the tone curve, so make it global and have each method build on any previous changes
-# default is a linear tone curve:
-toneCurve = [ [0.0, 0.0], [25.0, 25.0], [50.0, 50.0], [75.0, 75.0], [100.0, 100.0]]
+# device cost (see costModel.py). If costBudget is set, Core Image output is annotated with its estimated cost, and
+# with previewLite a variant within the budget is written to <output>.lite.json for presets over it
+costBudget = None
+previewLite = False
 
-# flag to indicate that ToneCurve should be added (modified by several different processes)
-toneCurveChanged = False
+# there are several ways to change the tone curve and the colour bands, so the state is global and each method builds on
+# any previous changes. It holds the tone curve (default is linear), the HSV colour vectors (default is no-op) and the
+# flags indicating that the Tone Curve/HSV filters should be added, and that conversion to B&W was requested.
+# See presetState.py
+state = presetState.PresetState()
 
-# flag to indicate that conversion to B&W requested
-convertToMono = False
+# how the metadata and state objects are set up for each conversion: "fresh" creates new objects for every preset,
+# "pooled" resets and reuses the same ones (fewer allocations in long runs). Either way nothing carries over from the
+# previous preset, and endConversion() drops the references to the preset's objects once it is converted
+lifecycle = "fresh"
+pooledMetadata = None
+pooledState = None
 
 
 '''
@@ -60,22 +93,57 @@ refColour = {"red": [0.0, 0.7, 0.886806], "orange": [0.083333, 0.7, 0.901961], "
 colourVectors = {"red": [0.0, 0.7, 0.886806], "orange": [0.083333, 0.7, 0.901961], "yellow": [0.166666, 0.7, 0.901961], "green": [0.333333, 0.7, 0.901961],
                  "aqua": [0.5, 0.7, 0.901961], "blue": [0.666666, 0.7, 0.901961], "purple": [0.75, 0.7, 0.901961], "magenta": [0.833333, 0.7, 0.901961] }
 '''
-'''
-colourVectors = {"red": [0.0, 0.7, 0.886806], "orange": [0.0, 0.7, 0.901961], "yellow": [0.0, 0.7, 0.901961], "green": [0.0, 0.7, 0.901961],
-    "aqua": [0.0, 0.7, 0.901961], "blue": [0.0, 0.7, 0.901961], "purple": [0.0, 0.7, 0.901961], "magenta": [0.0, 0.7, 0.901961] }
-'''
-
-# 'no-op' values - 0 degree hue shift and 1x multipliers for saturation and value
-colourVectors = {"red": [0.0,1.0,1.0], "orange": [0.0,1.0,1.0], "yellow": [0.0,1.0,1.0], "green": [0.0,1.0,1.0],
-                 "aqua": [0.0,1.0,1.0], "blue": [0.0,1.0,1.0], "purple": [0.0,1.0,1.0], "magenta": [0.0,1.0,1.0] }
-
-
-# flag indicating that colour vectors have been modified
-coloursChanged = False
 
 # width of a colour band (used for calculating hue changes)
 hueWidth = (360.0 / 8.0) / 100.0
 
+# the conversion works on the global state above, so only one conversion can run at a time (per process).
+# Multi-threaded callers (e.g. the batch pipeline) must hold this lock around parse/init/process
+conversionLock = threading.Lock()
+
+
+# Named tone curve presets (ToneCurveName/ToneCurveName2012), precomputed on the 0..100 scale used by the tone curve state
+namedToneCurves = { "Medium Contrast": [ [0.0, 0.0], [25.0, 20.0], [50.0, 50.0], [75.0, 80.0], [100.0, 100.0]],
+                    "Strong Contrast": [ [0.0, 0.0], [25.0, 15.0], [50.0, 50.0], [75.0, 85.0], [100.0, 100.0]] }
+
+# Fitted (and sampled) tone curves are memoised, since preset packs re-use a handful of curves over and over.
+# The cache lives at module level so that it is shared by every conversion run in the same (batch/server) process
+curveCacheSize = 512
+curveCache = OrderedDict()
+curveCacheHits = 0
+curveCacheMisses = 0
+
+# limits applied when reading tone curves, so that a malformed (or hostile) preset cannot make curve fitting slow
+maxCurveItems = 4096   # max. number of rdf:Seq items read from a single curve (longer curves are sampled)
+maxCurvePoints = 32    # max. number of points passed to the spline fit (longer curves are downsampled)
+curveTolerance = 0.5   # initial max. error (0..255 scale) allowed when downsampling a curve
+maxCurveDoublings = 40 # max. number of times the downsampling tolerance is doubled (ample for errors on 0..255)
+
+# records the keys read by each stage during the last conversion (see stageTracker.py)
+stageKeys = None
+
+# globals that hold the state of a conversion (rather than settings), so are not part of the stage versions
+stateGlobals = [ "xmp", "currentPreset", "outputTargets", "streamInput", "infile", "outfile", "state", "curveName",
+                 "lifecycle", "pooledMetadata", "pooledState",
+                 "curveCache", "curveCacheHits", "curveCacheMisses",
+                 "stageKeys", "stageVersionCache" ]
+
+# version of each stage, calculated on first use
+stageVersionCache = None
+
+# the keys consumed by the stages (see consumedKeys)
+probedKeys = None
+
+# metrics (see metrics.py). Curve fits are the curve cache misses
+conversionCount = metrics.registry.counter("xmp_conversions_total", "Presets converted")
+conversionSeconds = metrics.registry.histogram("xmp_conversion_seconds", "Time spent running the conversion stages of a preset")
+stageSeconds = metrics.registry.histogram("xmp_stage_seconds", "Time spent in each stage (parse, process*, save)", ["stage"])
+stageErrors = metrics.registry.counter("xmp_stage_errors_total", "Errors, by stage", ["stage"])
+overBudget = metrics.registry.counter("xmp_presets_over_budget_total", "Presets over the cost budget (--cost-budget)")
+metrics.registry.callback("xmp_curve_cache_hits_total", "Tone curve cache hits", lambda: curveCacheHits, "counter")
+metrics.registry.callback("xmp_curve_fits_total", "Tone curve spline fits (cache misses)", lambda: curveCacheMisses, "counter")
+metrics.registry.callback("xmp_curve_cache_size", "Number of fitted curves in the cache", lambda: len(curveCache))
+
 '''
     Note that the format of a preset setup is similar the syntax used in the phixer config file (without the UI stuff).
     Syntax is a bit different because it's driven by the Python, not JSON, and we have to deal with position and vector types
@@ -92,6 +160,9 @@ hueWidth = (360.0 / 8.0) / 100.0
                 ]
 
     Also note that we use an array (rather than a dictionary) for the list of filters so that we can maintain the order of the filters
+
+    This is the "coreimage" target. The process* functions don't build it directly, they add target-neutral effects to
+    currentPreset, which is then passed to the emitter for each target (see presetIR.py)
 '''
 
 # ----------------------------
@@ -101,99 +172,403 @@ def main():
 
     global infile
     global outfile
+    global streamInput
+    global outputTargets
+    global canonicalOutput, floatPrecision, omitDefaults
+    global costBudget, previewLite
     
     # parse the command line args
     parser = argparse.ArgumentParser()
     parser.add_argument("input", help="the name of the input XML file")
     parser.add_argument("output", help="the name of the output JSON file")
+    parser.add_argument("--stream", action="store_true", help="stream the input and only keep the Camera Raw settings (for large sidecars)")
+    parser.add_argument("--target", action="append", choices=presetIR.targets(),
+                        help="output format, can be repeated (default: coreimage). Extra targets are saved as <output>.<target>.json")
+    parser.add_argument("--canonical", action="store_true", help="write canonical (sorted, rounded, compact) JSON and an ETag file")
+    parser.add_argument("--precision", type=int, default=floatPrecision, help="canonical output: number of decimal places kept")
+    parser.add_argument("--omit-defaults", action="store_true", help="canonical output: leave out parameters at their default value")
+    parser.add_argument("--cost-budget", type=float, help="annotate the output with its estimated device cost, and flag it if over this budget")
+    parser.add_argument("--preview-lite", action="store_true", help="if over the cost budget, also write a preview-lite variant (<output>.lite.json)")
     args = parser.parse_args()
     
     # print args
     infile = args.input
     outfile = args.output
+    streamInput = args.stream
+    if args.target is not None:
+        outputTargets = args.target
+    canonicalOutput = args.canonical
+    floatPrecision = args.precision
+    omitDefaults = args.omit_defaults
+    costBudget = args.cost_budget
+    previewLite = args.preview_lite
+    if previewLite and costBudget is None:
+        costBudget = costModel.defaultBudget
     
-    parseInput(infile)
+    runStage("parse", parseInput, infile)
 
     # set up an empty preset
     initPreset(outfile)
 
     # process the input based on the filters we support in the app
-    # Note: order is based on Photoshop/Lightroom since those are the main sources of presets
-    processInfo()
-    processAuto()
-    processWhiteBalance()
-    processExposure()
-    processContrast()
-    processClarity()
-    processVibrance()
-    processSaturation()
-    processSharpening()
-    processNoiseReduction()
-
-    processGrain()
-    processShadowsHighlights()
-
-    processHSV()
-    processCalibration()
-    processGrayMixer()
-    processRGBToneCurves()
-    
-    processToneCurve()
-    processParametricCurve()
-    
-    addHSV()
-    addToneCurve()
-
-    # process these last
-    processGrayscale()
-    processSplitToning()
-    processVignette()
-
+    processPreset()
 
     # print the final preset
     # printPreset()
 
     # and save it...
-    savePreset(outfile)
+    runStage("save", savePreset, outfile)
+    endConversion()
+
+
+# ----------------------------
+
+
+# the conversion stages, in the order they are run.
+# Note: order is based on Photoshop/Lightroom since those are the main sources of presets
+
+
+def presetStages():
+    return [ processInfo, processAuto, processWhiteBalance, processExposure, processContrast, processClarity, processVibrance,
+             processSaturation, processSharpening, processNoiseReduction,
+             processGrain, processShadowsHighlights,
+             processHSV, processCalibration, processGrayMixer, processRGBToneCurves,
+             processToneCurve, processParametricCurve,
+             addHSV, addToneCurve,
+             # process these last
+             processGrayscale, processSplitToning, processVignette ]
+
+
+def processPreset(stages=None):
+    global xmp, stageKeys
+
+    # record the keys read by each stage, so that we know which stages a preset depends on
+    source = xmp
+    stageKeys = stageTracker.KeyRecorder(source)
+    xmp = stageKeys
+    start = time.time()
+    try:
+        for stage in (stages if stages is not None else presetStages()):
+            stageKeys.stage = stage.__name__
+            count = len(currentPreset["effects"])
+            runStage(stage.__name__, stage)
+            if len(currentPreset["effects"]) > count:
+                stageKeys.emitted.add(stage.__name__)
+    finally:
+        xmp = source
+    conversionCount.inc()
+    conversionSeconds.observe(time.time() - start)
+
+
+# run a stage, recording its time and any error in the metrics
+
+
+def runStage(name, func, *args):
+    start = time.time()
+    try:
+        return func(*args)
+    except Exception:
+        stageErrors.inc(stage=name)
+        raise
+    finally:
+        stageSeconds.observe(time.time() - start, stage=name)
+
+
+# ----------------------------
+
+
+# the version of each stage (changes whenever the code or settings used by the stage change), followed by the
+# versions that apply to every preset (see globalVersions)
+
+
+def stageVersions():
+    versions = OrderedDict(presetStageVersions())
+    versions.update(globalVersions())
+    return versions
+
+
+def presetStageVersions():
+    global stageVersionCache
+    if stageVersionCache is None:
+        stageVersionCache = OrderedDict((stage.__name__, stageTracker.functionVersion(stage, globals(), stateGlobals))
+                                        for stage in presetStages())
+    return stageVersionCache
+
+
+# the versions that every preset depends on, whichever stages it used (the journal records them with every input):
+#   (stages)  the list of stages: adding, removing or reordering a stage changes it
+#   (state)   the tone curve/colour band state that the stages build on (presetState.py)
+#   (output)  the emitters of the output targets (presetIR.py), and the output settings and the code they use
+#             (canonical JSON, cost budget and preview-lite variants)
+
+
+def globalVersions():
+    output = { "targets": dict((target, stageTracker.functionVersion(presetIR.emitters[target], vars(presetIR)))
+                               for target in outputTargets) }
+    if canonicalOutput:
+        output["canonical"] = [ floatPrecision, omitDefaults,
+                                stageTracker.functionVersion(canonicalJson.formatPreset, vars(canonicalJson)) ]
+    if costBudget is not None:
+        output["cost"] = [ costBudget, previewLite,
+                           stageTracker.functionVersion(costModel.annotate, vars(costModel)),
+                           stageTracker.functionVersion(costModel.previewLite, vars(costModel)) ]
+    return OrderedDict([ ("(stages)", stageTracker.valueVersion([stage.__name__ for stage in presetStages()])),
+                         ("(state)", stageTracker.classVersion(presetState.PresetState, vars(presetState))),
+                         ("(output)", stageTracker.valueVersion(output)) ])
+
+
+# the stages that the last converted preset depends on: { "stages": { stage: version }, "keys": { stage: [keys read] } }
+
+
+def presetDependencies():
+    versions = presetStageVersions()
+    used = stageKeys.usedStages()
+    return { "stages": dict((name, version) for name, version in versions.items() if name in used),
+             "keys": dict((name, sorted(keys)) for name, keys in stageKeys.keys.items()) }
 
 
 # ----------------------------
 
 
 def parseInput(f):
+    global xmp
+
     # open the XMP file and parse
-    with open(f, 'r') as inf:
-        strbuffer = inf.read()
-    xmp.parse_from_str(strbuffer)
+    if streamInput:
+        xmp = xmpStream.parseFile(f)
+    else:
+        with open(f, 'r') as inf:
+            strbuffer = inf.read()
+        xmp = newMetadata()
+        xmp.parse_from_str(strbuffer)
     print("--------------------------------")
-    print("\nProcessing: " + infile + "...")
+    print("\nProcessing: " + f + "...")
+
+
+# parse the (already read) contents of an XMP file. Used when the file is read elsewhere, e.g. by the batch pipeline
+
+
+def parseInputData(data, f):
+    global xmp
+
+    if streamInput:
+        xmp = xmpStream.parseData(data)
+    else:
+        xmp = newMetadata()
+        xmp.parse_from_str(data.decode('utf-8'))
+    print("--------------------------------")
+    print("\nProcessing: " + f + "...")
+
+
+# use metadata that was read elsewhere, e.g. from a Lightroom catalog (see catalogReader.py)
+
+
+def parseInputMetadata(meta, f):
+    global xmp
+
+    xmp = meta
+    print("--------------------------------")
+    print("\nProcessing: " + f + "...")
 
 
 # ----------------------------
 
 
 def initPreset(f):
-    filterMap["key"] = f
-    filterMap["info"] ={}
-    filterMap["filters"] = []
+    # start a new preset, resetting any state left over from a previous conversion
+    global currentPreset, state, stageKeys
+
+    currentPreset = presetIR.newPreset(f)
+    state = newState()
+    stageKeys = None
+
+
+# ----------------------------
+
+
+# the metadata object to parse a preset into. Parsing replaces any previous contents, so a pooled object is reused as is
+
+
+def newMetadata():
+    global pooledMetadata
+    if lifecycle == "pooled":
+        if pooledMetadata is None:
+            pooledMetadata = XMPMeta()
+        return pooledMetadata
+    return XMPMeta()
+
+
+def newState():
+    global pooledState
+    if lifecycle == "pooled":
+        if pooledState is None:
+            pooledState = presetState.PresetState()
+        else:
+            pooledState.reset()
+        return pooledState
+    return presetState.PresetState()
+
+
+# called once a preset has been converted (and emitted/saved): drops the references to the parsed metadata and the
+# dependency records, so that they can be freed before the next file is read
+
+
+def endConversion():
+    global xmp, stageKeys
+    xmp = None
+    stageKeys = None
+
+
+# ----------------------------
+
+
+# convert the contents of an XMP file and return the preset for the target. key is the preset key (normally the output file).
+# Thread safe, but conversions are serialised (see conversionLock)
+
+
+def convertPresetData(data, f, key, target="coreimage"):
+    return convertPresetDependencies(data, f, key, target)[0]
+
+
+# as convertPresetData, but returns (preset, dependencies) - see presetDependencies()
+
+
+def convertPresetDependencies(data, f, key, target="coreimage"):
+    return convertParsed(parseInputData, data, f, key, target)
+
+
+# as convertPresetDependencies, for metadata that is already parsed (an object with the XMPMeta calls used here)
+
+
+def convertPresetMetadata(meta, f, key, target="coreimage"):
+    return convertParsed(parseInputMetadata, meta, f, key, target)
+
+
+def convertParsed(parse, source, f, key, target, stages=None):
+    with conversionLock:
+        try:
+            runStage("parse", parse, source, f)
+            initPreset(key)
+            processPreset(stages)
+            return emitPreset(target), presetDependencies()
+        finally:
+            endConversion()
+
+
+# fast path for XMP data that has none of the keys used by the filter stages (see prefilter.py): the data is streamed
+# and only the info stage is run. Same result as convertPresetDependencies
+
+
+def convertInfoOnly(data, f, key, target="coreimage"):
+    return convertParsed(parseInputMetadata, xmpStream.parseData(data), f, key, target, [processInfo])
+
+
+# the Camera Raw keys that the stages look for: { "info": keys of the info stage, "filters": keys of the other stages },
+# found by running the stages over empty metadata. None if that adds any effects (every preset then has filters)
+
+
+def consumedKeys():
+    global xmp, probedKeys
+    with conversionLock:
+        if probedKeys is None:
+            probe = stageTracker.KeyProbe(xmpStream.StreamedXMP())
+            initPreset("")
+            xmp = probe
+            try:
+                for stage in presetStages():
+                    probe.stage = stage.__name__
+                    stage()
+                filterKeys = set()
+                for stage, keys in probe.keys.items():
+                    if stage != processInfo.__name__:
+                        filterKeys.update(keys)
+                probedKeys = { "info": probe.keys.get(processInfo.__name__, set()), "filters": filterKeys,
+                               "empty": len(currentPreset["effects"]) == 0 }
+            finally:
+                endConversion()
+        return probedKeys if probedKeys["empty"] else None
+
+
+# ----------------------------
+
+
+# generate the output for a target from the current preset
+
+
+def emitPreset(target):
+    return presetIR.emit(currentPreset, target)
+
+
+def addEffect(category, name, **params):
+    presetIR.addEffect(currentPreset, category, name, **params)
 
 
 # ----------------------------
 
 
 def printPreset():
-    #print ("Raw map: " + str(filterMap))
+    #print ("Raw map: " + str(currentPreset))
     print ("\n\n")
-    print ("JSON: " + json.dumps(filterMap, indent=2))
+    print ("JSON: " + json.dumps(emitPreset(outputTargets[0]), indent=2))
 
 
 # ----------------------------
 
 
 def savePreset(f):
-    with safe_open_w(f) as outf:
-        json.dump(filterMap, outf, indent=2)
-        print("\nSaved to: " + f + "\n")
+    # the first target goes to the output file, any others to <output>.<target>.json
+    for i, target in enumerate(outputTargets):
+        path = f
+        if i > 0:
+            path = os.path.splitext(f)[0] + "." + target + ".json"
+        preset = emitPreset(target)
+        if target == "coreimage":
+            for variantPath, variant in costVariants(preset, path):
+                writePreset(variant, variantPath)
+        else:
+            writePreset(preset, path)
+        print("\nSaved to: " + path + " (" + target + ")\n")
+
+
+def writePreset(preset, f):
+    # written to a temp file and renamed, so a crash never leaves a truncated preset behind
+    text = formatPreset(preset)
+    if canonicalOutput:
+        atomicWriter.writeAtomic(canonicalJson.hashFile(f), presetHashes(text))
+    atomicWriter.writeAtomic(f, text)
+
+
+# the files to write for a Core Image preset: [(output file, preset)], plus [(lite file, variant)] before it if it is
+# over the cost budget and previewLite is set. Without a cost budget, just the preset
+
+
+def costVariants(preset, f):
+    if costBudget is None:
+        return [(f, preset)]
+    preset = costModel.annotate(preset, costBudget)
+    if not preset["cost"]["overBudget"]:
+        return [(f, preset)]
+    overBudget.inc()
+    print("Over the cost budget: " + str(preset["cost"]["perPixel"]) + " (budget: " + str(costBudget) + ")")
+    if not previewLite:
+        return [(f, preset)]
+    return [(costModel.liteFile(f), costModel.previewLite(preset, costBudget)), (f, preset)]
+
+
+# the text of a preset, in the selected output format
+
+
+def formatPreset(preset):
+    if canonicalOutput:
+        return canonicalJson.formatPreset(preset, floatPrecision, omitDefaults)
+    return json.dumps(preset, indent=2)
+
+
+# contents of the ETag file for a (canonical) preset
+
+
+def presetHashes(text):
+    return canonicalJson.dumps(canonicalJson.hashes(text)) + "\n"
 
 
 def mkdir_p(path):
@@ -209,7 +584,8 @@ def mkdir_p(path):
 def safe_open_w(path):
     # Open "path" for writing, creating any parent directories as needed.
 
-    mkdir_p(os.path.dirname(path))
+    if len(os.path.dirname(path)) > 0:
+        mkdir_p(os.path.dirname(path))
     return open(path, 'w')
 
 
@@ -220,12 +596,12 @@ def processInfo():
     if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Name"):
         name = xmp.get_localized_text(XMP_NS_CAMERA_RAW, "Name", "", "us-en")
         # print ("Name: " + str(name))
-        filterMap["info"]["name"] = name
+        currentPreset["info"]["name"] = name
 
     if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Group"):
         group = xmp.get_localized_text(XMP_NS_CAMERA_RAW, "Group", "", "us-en")
         # print ("Name: " + str(name))
-        filterMap["info"]["group"] = group
+        currentPreset["info"]["group"] = group
 
 
 # ----------------------------
@@ -243,7 +619,7 @@ def processAuto():
     elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "AutoShadows"):
         auto = True
     if auto:
-        filterMap["filters"].append( { 'key':"AutoAdjustFilter", "parameters":[] } )
+        addEffect(presetIR.SCALAR, "autoAdjust")
         print ("...Auto Adjust")
 
 
@@ -269,12 +645,10 @@ def processWhiteBalance():
         if preset in wbPresets:
             temp = min(wbPresets[preset]['temp'], 10000.0)
             tint = max(min(wbPresets[preset]['tint'], 100.0), -100.0)
-            filterMap["filters"].append( { 'key':"WhiteBalanceFilter", "parameters":[ { 'key':"inputTemperature", 'val':temp, 'type':"CIAttributeTypeScalar"},
-                                                                                      {'key':"inputTint", 'val': tint, 'type': "CIAttributeTypeScalar"} ]
-                                                                 } )
+            addEffect(presetIR.SCALAR, "whiteBalance", temperature=temp, tint=tint)
             print ("...Preset White Balance")
         elif preset == "Auto": # for Auto, just run auto correct
-            filterMap["filters"].append( { 'key':"AutoAdjustFilter", "parameters":[] } )
+            addEffect(presetIR.SCALAR, "autoAdjust")
 
         elif preset == "Custom":
             temp = 5500.0
@@ -285,9 +659,7 @@ def processWhiteBalance():
             if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Tint"):
                 tint = clamp(xmp.get_property_float(XMP_NS_CAMERA_RAW, "Tint"), -100.0, 100.0)
 
-            filterMap["filters"].append( { 'key':"WhiteBalanceFilter", "parameters":[ { 'key':"inputTemperature", 'val':temp, 'type':"CIAttributeTypeScalar"},
-                                                                                 {'key':"inputTint", 'val': tint, 'type': "CIAttributeTypeScalar"} ]
-                                    } )
+            addEffect(presetIR.SCALAR, "whiteBalance", temperature=temp, tint=tint)
             print("Temp: " + str(temp) + " Tint: " + str(tint))
             print ("...Custom White Balance")
 
@@ -301,13 +673,13 @@ def processExposure():
     if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Exposure"):
         value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Exposure")
         if abs(value)>0.01:
-            filterMap["filters"].append( { 'key':"CIExposureAdjust", "parameters":[{ 'key':"inputEV", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+            addEffect(presetIR.SCALAR, "exposure", ev=value)
             print("Exposure: " + str(value))
             print ("...Exposure")
     elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Exposure2012"):
         value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Exposure2012")
         if abs(value)>0.01:
-            filterMap["filters"].append( { 'key':"CIExposureAdjust", "parameters":[{ 'key':"inputEV", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+            addEffect(presetIR.SCALAR, "exposure", ev=value)
             print("Exposure: " + str(value))
             print ("...Exposure2012")
 
@@ -316,9 +688,6 @@ def processExposure():
 
 
 def processContrast():
-    
-    global toneCurve
-    global toneCurveChanged
 
     minContrast = 1.0
     found = False
@@ -341,15 +710,16 @@ def processContrast():
             value = 1.0 + value / 100.0 # 0..100 -> 1..2
 
             value = clamp(value, minContrast, 4.0)
-            filterMap["filters"].append( { 'key':"ContrastFilter", "parameters":[{ 'key':"inputContrast", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+            addEffect(presetIR.SCALAR, "contrast", contrast=value)
             print("Contrast: " + str(value))
         else:
             print("Negative Contrast not really supported")
             # -ve contrast, the built in filter sucks with this, so adjust the tone curve instead
-            b = calculateCurveChangeConstrained(toneCurve[1][1], -value, toneCurve[2][1]-10.0, toneCurve[0][1]+10.0)
-            toneCurve[1][1] = b
-            toneCurveChanged = True
-            print("Updated Curve: " + str(toneCurve))
+            curve = state.curve
+            b = calculateCurveChangeConstrained(curve[1,1], -value, curve[2,1]-10.0, curve[0,1]+10.0)
+            state.setCurve(b, 1, 1)
+            state.curveChanged = True
+            print("Updated Curve: " + str(state.curve.tolist()))
             '''
             value = 1.0 + value / 100.0 # 0..100 -> 1..2
             value = clamp(value, 0.25, 1.0)
@@ -366,9 +736,6 @@ def processShadowsHighlights():
     # Highlights, Shadows, Whites, Blacks or: Highlights2012, Shadows2012, Whites2012, Blacks2012
     # maybe not the right way to do it, but we will just modify the input values of the tone curve
     # [0]=Blacks [1]=Shadows [2]=??? [3]=Highlights [4]=Whites
-    
-    global toneCurve
-    global toneCurveChanged
 
     found = False
     
@@ -387,28 +754,28 @@ def processShadowsHighlights():
         value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Blacks")
         if abs(value)>0.01:
             found = True
-            b = calculateCurveChangeConstrained(toneCurve[0][0], -value, toneCurve[1][0]-10.0, 0.0)
-            toneCurve[0][0] = b
+            b = calculateCurveChangeConstrained(state.curve[0,0], -value, state.curve[1,0]-10.0, 0.0)
+            state.setCurve(b, 0, 0)
     elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Blacks2012"):
         value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Blacks2012")
         if abs(value)>0.01:
             found = True
-            b = calculateCurveChangeConstrained(toneCurve[0][0], -value, toneCurve[1][0]-10.0, 0.0)
-            toneCurve[0][0] = b
+            b = calculateCurveChangeConstrained(state.curve[0,0], -value, state.curve[1,0]-10.0, 0.0)
+            state.setCurve(b, 0, 0)
 
 
     if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Whites"):
         value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Whites")
         if abs(value)>0.01:
             found = True
-            w = calculateCurveChangeConstrained(toneCurve[4][0], -value, 100.0, toneCurve[3][0]+10.0)
-            toneCurve[4][0] = w
+            w = calculateCurveChangeConstrained(state.curve[4,0], -value, 100.0, state.curve[3,0]+10.0)
+            state.setCurve(w, 4, 0)
     elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Whites2012"):
         value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Whites2012")
         if abs(value)>0.01:
             found = True
-            w = calculateCurveChangeConstrained(toneCurve[4][0], -value, 100.0, toneCurve[3][0]+10.0)
-            toneCurve[4][0] = w
+            w = calculateCurveChangeConstrained(state.curve[4,0], -value, 100.0, state.curve[3,0]+10.0)
+            state.setCurve(w, 4, 0)
 
     '''
 
@@ -440,7 +807,7 @@ def processShadowsHighlights():
     '''
 
     if found:
-        toneCurveChanged = True
+        state.curveChanged = True
         #addToneCurve()
         print("Blacks: " + str(b) + " Whites:" + str(w))
         print ("...Blacks/Whites")
@@ -494,10 +861,7 @@ def processParametricCurve():
     # Note: each value is a percentage, i.e. 0..100 (-100..+100 for output adjustments), not an absolute value
     # note that I constrained the changes so that they cannot go higher than the next point or lower than the previous point. This is
     # artificial and precludes any 'inversion' type changes (via Parametric values)
-    
-    global toneCurve
-    global toneCurveChanged
-    
+
     found = False
     sum = 0.0
     value = 0.0
@@ -507,15 +871,21 @@ def processParametricCurve():
     if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricDarks"):
         found = True
         value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricDarks")
-        #toneCurve[0][1] = clamp ((toneCurve[0][1] + value), 0.0, 100.0)
         print("Darks: " + str(value))
-        toneCurve[0][1] = calculateCurveChangeConstrained(toneCurve[0][1], value, toneCurve[1][1]-10.0, 0.0)
+        state.setCurve(calculateCurveChangeConstrained(state.curve[0,1], value, state.curve[1,1]-10.0, 0.0), 0, 1)
     
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricShadowSplit"):
-        found = True
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricShadowSplit")
-        toneCurve[1][0] = value
-        sum = sum + abs(value)
+    # the splits set the input values of points 1..3
+    points = []
+    splits = []
+    for i, key in [ (1, "ParametricShadowSplit"), (2, "ParametricMidtoneSplit"), (3, "ParametricHighlightSplit") ]:
+        if xmp.does_property_exist(XMP_NS_CAMERA_RAW, key):
+            found = True
+            value = xmp.get_property_float(XMP_NS_CAMERA_RAW, key)
+            points.append(i)
+            splits.append(value)
+            sum = sum + abs(value)
+    if len(points) > 0:
+        state.setCurve(splits, points, 0)
     
     '''
     if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricShadows"):
@@ -525,22 +895,7 @@ def processParametricCurve():
         #toneCurve[1][1] = calculateCurveChange(toneCurve[1][1], value, 100.0)
         toneCurve[1][1] = calculateCurveChangeConstrained(toneCurve[1][1], value, toneCurve[2][1]-10.0, toneCurve[0][1]+10.0)
         sum = sum + abs(value)
-    '''
-    
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricMidtoneSplit"):
-        found = True
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricMidtoneSplit")
-        toneCurve[2][0] = value
-        sum = sum + abs(value)
-    
-    
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricHighlightSplit"):
-        found = True
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricHighlightSplit")
-        toneCurve[3][0] = value
-        sum = sum + abs(value)
-    
-    '''
+
     if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricHighlights"):
         found = True
         value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricHighlights")
@@ -554,37 +909,16 @@ def processParametricCurve():
         found = True
         value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricLights")
         print("Lights: " + str(value))
-        #toneCurve[4][1] = calculateCurveChange(toneCurve[4][1], value, 100.0)
-        toneCurve[4][1] = calculateCurveChangeConstrained(toneCurve[4][1], value, 100.0, toneCurve[3][1]+10.0)
+        state.setCurve(calculateCurveChangeConstrained(state.curve[4,1], value, 100.0, state.curve[3,1]+10.0), 4, 1)
         sum = sum + abs(value)
     
     
     if found and abs(sum)>0.01:
-        toneCurveChanged = True
+        state.curveChanged = True
         #addToneCurve()
-        print("Updated Curve: " + str(toneCurve))
+        print("Updated Curve: " + str(state.curve.tolist()))
         print ("...Parametric Curve")
 
-    # process Shadows and Highlights using built in filter rather than adjusting Tone Curve
-    found2 = False
-    s = 0.0
-    h = 0.0
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricShadows"):
-        s = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricShadows")
-        if abs(s)>0.01:
-            found2 = True
-            print("Shadows: " + str(s))
-
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricHighlights"):
-        h = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricHighlights")
-        if abs(h)>0.01:
-            found2 = True
-            print("Highlights: " + str(h))
-
-    if found2:
-            updateShadowsHighlights(s, h)
-
-
 # ----------------------------
 
 # takes XMP-based shadow/highlight values and creates filter definition for those (used in multiple places)
@@ -601,9 +935,7 @@ def updateShadowsHighlights(s, h):
         h2 = clamp (h2, 0.3, 1.0)
         
         print("Shadows: " + str(s) + " -> " + str(s2) + " Highlights: " + str(h) + " -> " + str(h2))
-        filterMap["filters"].append( { 'key':"CIHighlightShadowAdjust", "parameters":[{ 'key':"inputShadowAmount", 'val': s2, 'type': "CIAttributeTypeScalar"},
-                                                                                      { 'key':"inputHighlightAmount", 'val': h2, 'type': "CIAttributeTypeScalar"}
-                                                                                      ] } )
+        addEffect(presetIR.SCALAR, "shadowsHighlights", shadows=s2, highlights=h2)
     else:
         print("WARNING - Ignoring Shadows/Highlights. s:" + str(s) + " h:" + str(h))
 
@@ -616,12 +948,12 @@ def processClarity():
     if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Clarity"):
         value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Clarity") / 100.0
         if abs(value)>0.0:
-            filterMap["filters"].append( { 'key':"ClarityFilter", "parameters":[{ 'key':"inputClarity", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+            addEffect(presetIR.SPATIAL, "clarity", amount=value)
             print ("...Clarity")
     elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Clarity2012"):
         value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Clarity2012") / 100.0
         if abs(value)>0.0:
-            filterMap["filters"].append( { 'key':"ClarityFilter", "parameters":[{ 'key':"inputClarity", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+            addEffect(presetIR.SPATIAL, "clarity", amount=value)
             print ("...Clarity2012")
 
     if abs(value)>0.0:
@@ -637,7 +969,7 @@ def processVibrance():
     if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Vibrance"):
         value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Vibrance") / 100.0
         if abs(value)>0.01:
-            filterMap["filters"].append( { 'key':"CIVibrance", "parameters":[{ 'key':"inputAmount", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+            addEffect(presetIR.SCALAR, "vibrance", amount=value)
             print ("...Vibrance")
 
     if abs(value)>0.01:
@@ -655,7 +987,7 @@ def processSaturation():
         if abs(value)>0.01:
             value = (value / 100.0) + 1.0
             value = clamp(value, 0.0, 2.0)
-            filterMap["filters"].append( { 'key':"SaturationFilter", "parameters":[{ 'key':"inputSaturation", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+            addEffect(presetIR.SCALAR, "saturation", saturation=value)
             print ("...Saturation")
 
     if abs(value)>0.01:
@@ -686,9 +1018,7 @@ def processNoiseReduction():
         amount = clamp(amount, 0.0, 0.1)
         detail = detail / 500.0 # 0..100 -> 0.0..2.0
         detail = clamp(detail, 0.0, 0.2)
-        filterMap["filters"].append( { 'key':"CINoiseReduction", "parameters":[{ 'key':"inputNoiseLevel", 'val': amount, 'type': "CIAttributeTypeScalar"},
-                                                                               { 'key':"inputSharpness", 'val': detail, 'type': "CIAttributeTypeScalar"},
-                                                                            ] })
+        addEffect(presetIR.SPATIAL, "noiseReduction", level=amount, sharpness=detail)
         print("Noise Reduction: amount: " + str(amount) + " detail: " + str(detail))
         print ("...Noise Reduction")
 
@@ -698,8 +1028,7 @@ def processNoiseReduction():
 def processToneCurve():
     # this is the Photoshop version of a Tone Curve. Note, will overwrite any previous Tone Curve or Parametric curve
 
-    global toneCurve, curveName
-    global toneCurveChanged
+    global curveName
     found = False
 
     # first, look for a named preset
@@ -711,54 +1040,39 @@ def processToneCurve():
     
     if len(name) > 0:
         found = True
-        if name == "Medium Contrast":
-            toneCurve = [ [0.0, 0.0], [25.0, 20.0], [50.0, 50.0], [75.0, 80.0], [100.0, 100.0]]
-        elif name == "Strong Contrast":
-            toneCurve = [ [0.0, 0.0], [25.0, 15.0], [50.0, 50.0], [75.0, 85.0], [100.0, 100.0]]
+        if name in namedToneCurves:
+            state.setCurve(namedToneCurves[name])
 
     # look for tone curve values
-    curvename = ""
+    curveName = ""
     if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ToneCurve"):
         curveName = "ToneCurve"
     elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ToneCurvePV2012"):
         curveName = "ToneCurvePV2012"
 
-    if len(name) > 0:
+    if len(name) > 0 and len(curveName) > 0:
         found = True
-        count = xmp.count_array_items(XMP_NS_CAMERA_RAW, curveName)
+        # read, validate and (if needed) downsample the curve points
+        points = getCurvePoints(curveName)
+        count = len(points)
         if count > 0:
             found = True
-            points = []
-            for i in range(1, (count+1)):
-                item = xmp.get_array_item(XMP_NS_CAMERA_RAW, curveName, i)
-                point = map(float, item.split(","))
-                points.append(point)
             print("\nInput Curve: "+str(points)+"\n")
 
             # if 2 or less points then ignore (linear anyway), otherwise interpolate
             if (count <2):
-                print("ERROR: too few points(" + count + ")")
+                print("ERROR: too few points(" + str(count) + ")")
             #elif (count <= 3):
             else:
                 #print("Need to interpolate Tone Curve")
-                # split into 2 arrays, convert to 0..100 scale, create spline, interpolate and update the curve
-                x, y = zip(*points)
-                x2 = [100.0 * f / 255 for f in x]
-                y2 = [100.0 * f / 255 for f in y]
-                spline = UnivariateSpline(x2, y2, s=0, k=min(5,(count-1)))
+                # convert to 0..100 scale, create spline, interpolate and update the curve
                 xcurve = [ 0.0, 25.0, 50.0, 75.0, 100.0 ]
-                tmp1 = 0.0
-                tmp2 = 0.0
-                for i in range(0, len(xcurve)):
-                    tmp1 = clamp(spline(xcurve[i]), 0.0, 100.0)
-                    tmp2 = float(tmp1)
-                    if tmp2 < 0.001: # small numbers cause issues with JSON
-                        tmp2 = 0.0
-                    toneCurve[i] = [xcurve[i], tmp2]
+                ycurve = fitCurve(points, 100.0, xcurve)
+                state.setCurve(np.column_stack((xcurve, ycurve)))
 
     if found:
-        toneCurveChanged = True
-        print ("Curve: " + str(toneCurve))
+        state.curveChanged = True
+        print ("Curve: " + str(state.curve.tolist()))
         print ("...Tone Curve")
 
 # ----------------------------
@@ -766,19 +1080,10 @@ def processToneCurve():
 
 def addToneCurve():
     
-    global toneCurve
-    global toneCurveChanged
-    
-    if toneCurveChanged:
-        filterMap["filters"].append( { 'key':"CIToneCurve",
-                                    "parameters":[{ 'key':"inputPoint0", 'val': [(toneCurve[0][0]/100.0), (toneCurve[0][1]/100.0)], 'type': "CIAttributeTypeOffset"},
-                                                  { 'key':"inputPoint1", 'val': [(toneCurve[1][0]/100.0), (toneCurve[1][1]/100.0)], 'type': "CIAttributeTypeOffset"},
-                                                  { 'key':"inputPoint2", 'val': [(toneCurve[2][0]/100.0), (toneCurve[2][1]/100.0)], 'type': "CIAttributeTypeOffset"},
-                                                  { 'key':"inputPoint3", 'val': [(toneCurve[3][0]/100.0), (toneCurve[3][1]/100.0)], 'type': "CIAttributeTypeOffset"},
-                                                  { 'key':"inputPoint4", 'val': [(toneCurve[4][0]/100.0), (toneCurve[4][1]/100.0)], 'type': "CIAttributeTypeOffset"} ]
-                                    } )
+    if state.curveChanged:
+        addEffect(presetIR.TONE_CURVE, "toneCurve", points=state.curvePoints())
 
-        print ("Curve: " + str(toneCurve))
+        print ("Curve: " + str(state.curve.tolist()))
 
 
 # ----------------------------
@@ -810,14 +1115,11 @@ def processRGBToneCurves():
     
     if len(curveName) > 0:
         #found = True
-        count = xmp.count_array_items(XMP_NS_CAMERA_RAW, curveName)
+        # read, validate and (if needed) downsample the curve points
+        points = getCurvePoints(curveName)
+        count = len(points)
         if count > 0:
             found = True
-            points = []
-            for i in range(1, (count+1)):
-                item = xmp.get_array_item(XMP_NS_CAMERA_RAW, curveName, i)
-                point = map(float, item.split(","))
-                points.append(point)
             print("\nInput Red Curve: "+str(points)+"\n")
             
             # if we have exactly 5 points then we can use them directly, otherwise we need to interpolate to get those 5 points
@@ -832,16 +1134,7 @@ def processRGBToneCurves():
             else:
                 #print("Need to interpolate Tone Curve")
                 # split into 2 arrays, convert to 0..1.0 scale, create spline, interpolate and update the curve
-                x, y = zip(*points)
-                x2 = [f / 255 for f in x]
-                y2 = [f / 255 for f in y]
-                spline = UnivariateSpline(x2, y2, s=0, k=min(5,(count-1)))
-                tmp = 0.0
-                for i in range(0, len(redX)):
-                    tmp = clamp(spline(redX[i]), 0.0, 1.0)
-                    redY[i] = float(tmp)
-                    if redY[i] < 0.001: # small numbers case issues with JSON
-                        redY[i] = 0.0
+                redY = fitCurve(points, 1.0, redX)
 
     # GREEN
     curveName = ""
@@ -852,14 +1145,11 @@ def processRGBToneCurves():
     
     if len(curveName) > 0:
         #found = True
-        count = xmp.count_array_items(XMP_NS_CAMERA_RAW, curveName)
+        # read, validate and (if needed) downsample the curve points
+        points = getCurvePoints(curveName)
+        count = len(points)
         if count > 0:
             found = True
-            points = []
-            for i in range(1, (count+1)):
-                item = xmp.get_array_item(XMP_NS_CAMERA_RAW, curveName, i)
-                point = map(float, item.split(","))
-                points.append(point)
             print("\nInput Green Curve: "+str(points)+"\n")
             
             # if we have exactly 5 points then we can use them directly, otherwise we need to interpolate to get those 5 points
@@ -874,16 +1164,7 @@ def processRGBToneCurves():
             else:
                 #print("Need to interpolate Tone Curve")
                 # split into 2 arrays, convert to 0..1.0 scale, create spline, interpolate and update the curve
-                x, y = zip(*points)
-                x2 = [f / 255 for f in x]
-                y2 = [f / 255 for f in y]
-                spline = UnivariateSpline(x2, y2, s=0, k=min(5,(count-1)))
-                tmp = 0.0
-                for i in range(0, len(greenX)):
-                    tmp = clamp(spline(greenX[i]), 0.0, 1.0)
-                    greenY[i] = float(tmp)
-                    if greenY[i] < 0.001: # small numbers case issues with JSON
-                        greenY[i] = 0.0
+                greenY = fitCurve(points, 1.0, greenX)
 
     # BLUE
     curveName = ""
@@ -894,14 +1175,11 @@ def processRGBToneCurves():
     
     if len(curveName) > 0:
         #found = True
-        count = xmp.count_array_items(XMP_NS_CAMERA_RAW, curveName)
+        # read, validate and (if needed) downsample the curve points
+        points = getCurvePoints(curveName)
+        count = len(points)
         if count > 0:
             found = True
-            points = []
-            for i in range(1, (count+1)):
-                item = xmp.get_array_item(XMP_NS_CAMERA_RAW, curveName, i)
-                point = map(float, item.split(","))
-                points.append(point)
             print("\nInput Blue Curve: "+str(points)+"\n")
             
             # if we have exactly 5 points then we can use them directly, otherwise we need to interpolate to get those 5 points
@@ -916,16 +1194,7 @@ def processRGBToneCurves():
             else:
                 # print("Need to interpolate Tone Curve")
                 # split into 2 arrays, convert to 0..1.0 scale, create spline, interpolate and update the curve
-                x, y = zip(*points)
-                x2 = [f / 255 for f in x]
-                y2 = [f / 255 for f in y]
-                spline = UnivariateSpline(x2, y2, s=0, k=min(5,(count-1)))
-                tmp = 0.0
-                for i in range(0, len(blueX)):
-                    tmp = clamp(spline(blueX[i]), 0.0, 1.0)
-                    blueY[i] = float(tmp)
-                    if blueY[i] < 0.001: # small numbers case issues with JSON
-                        blueY[i] = 0.0
+                blueY = fitCurve(points, 1.0, blueX)
 
 
     if linearCount == 3:
@@ -936,14 +1205,7 @@ def processRGBToneCurves():
         print("\nOutput Red Curve:\n    X:"+str(redX)+"\n    Y:"+str(redY))
         print("\nOutput Green Curve:\n    X:"+str(greenX)+"\n    Y:"+str(greenY))
         print("\nOutput Blue Curve:\n    X:"+str(blueX)+"\n    Y:"+str(blueY)+"\n")
-        filterMap["filters"].append( { 'key':"RGBChannelToneCurve",
-                                    "parameters":[{ 'key':"inputRedXvalues",   'val': redX, 'type': "CIAttributeTypeVector"},
-                                                  { 'key':"inputRedYvalues",   'val': redY, 'type': "CIAttributeTypeVector"},
-                                                  { 'key':"inputGreenXvalues", 'val': greenX, 'type': "CIAttributeTypeVector"},
-                                                  { 'key':"inputGreenYvalues", 'val': greenY, 'type': "CIAttributeTypeVector"},
-                                                  { 'key':"inputBlueXvalues",  'val': blueX, 'type': "CIAttributeTypeVector"},
-                                                  { 'key':"inputBlueYvalues",  'val': blueY, 'type': "CIAttributeTypeVector"} ]
-                                    } )
+        addEffect(presetIR.TONE_CURVE, "rgbCurves", red=[redX, redY], green=[greenX, greenY], blue=[blueX, blueY])
         print ("...RGB Tone Curves")
 
 # ----------------------------
@@ -951,9 +1213,6 @@ def processRGBToneCurves():
 
 def processHSV():
     
-    global colourVectors
-    global coloursChanged
-    
     '''
         vector is [hue, saturation, brightness]
         range of input is -100..+100
@@ -961,50 +1220,32 @@ def processHSV():
         attribute type CIAttributeTypePosition3 (CIVector)
         '''
     
-    # update colour vectors
+    # read the adjustments for all the bands: one row per band, columns are hue, saturation, luminance
     found = False
-    sum = 0.0 # check to see if anything changed
-    for key in colourVectors.keys():
-        h = 0.0
-        s = 0.0
-        v = 0.0
+    adjustments = np.zeros(state.colours.shape)
+    for i, key in enumerate(presetState.BANDS):
         tag = key.capitalize()
-        if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "HueAdjustment"+tag):
-            found = True
-            h = xmp.get_property_float(XMP_NS_CAMERA_RAW, "HueAdjustment"+tag)
-
-            sum = sum + abs(h)
-            if abs(h)>0.01:
-                value = (h / 100.0) / 8.0 # treat as a %age of the colour band
-                #value = (h / 100.0)
-                colourVectors[key][0] = colourVectors[key][0] + value
-        if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "SaturationAdjustment"+tag):
-            found = True
-            s = xmp.get_property_float(XMP_NS_CAMERA_RAW, "SaturationAdjustment"+tag)
-            if abs(s)>0.01:
-                value = (s / 100.0) # treat as a %age change
-                colourVectors[key][1] = colourVectors[key][1] + value
-                #colourVectors[key][1] = calculateCurveChange(colourVectors[key][1], value, 1.0)
-            sum = sum + abs(s)
-        if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "LuminanceAdjustment"+tag):
-            found = True
-            v = xmp.get_property_float(XMP_NS_CAMERA_RAW, "LuminanceAdjustment"+tag)
-            if abs(v)>0.01:
-                value = (v / 100.0) # treat as a %age change
-                colourVectors[key][2] = colourVectors[key][2] + value
-            #colourVectors[key][2] = calculateCurveChange(colourVectors[key][2], value, 1.0)
-            sum = sum + abs(v)
-        
-        # if hue, saturation and value are all 0 then set to noop values [0, 1, 1]
-        if (abs(h) + abs(s) + abs(v)) < 0.01:
-            colourVectors[key] = [0.0, 1.0, 1.0]
-
+        for j, prefix in enumerate(["HueAdjustment", "SaturationAdjustment", "LuminanceAdjustment"]):
+            if xmp.does_property_exist(XMP_NS_CAMERA_RAW, prefix+tag):
+                found = True
+                adjustments[i, j] = xmp.get_property_float(XMP_NS_CAMERA_RAW, prefix+tag)
+        h, s, v = adjustments[i]
         print (str(tag) + ": h:" + str(h) + ": s:" + str(s) + ": v:" + str(v))
 
+    # update colour vectors. Hue is treated as a %age of the colour band, saturation and luminance as a %age change
+    significant = np.abs(adjustments) > 0.01
+    state.addColours(0, np.where(significant[:, 0], (adjustments[:, 0] / 100.0) / 8.0, 0.0))
+    state.addColours(1, np.where(significant[:, 1], adjustments[:, 1] / 100.0, 0.0))
+    state.addColours(2, np.where(significant[:, 2], adjustments[:, 2] / 100.0, 0.0))
+
+    # if hue, saturation and value are all 0 then set to noop values [0, 1, 1]
+    state.resetColours(np.abs(adjustments).sum(axis=1) < 0.01)
+
+    sum = np.abs(adjustments).sum() # check to see if anything changed
     if found:
         if (sum > 0.01): # check that something was specified, not all 0s
-            coloursChanged = True
-            print ("Updated Colours: " + str(colourVectors) + "\n")
+            state.coloursChanged = True
+            print ("Updated Colours: " + str(state.bands()) + "\n")
             print ("...HSV")
         else:
             print ("Ignoring HSV")
@@ -1015,51 +1256,33 @@ def processHSV():
 
 def processCalibration():
     # This is an 'older' way to change hue and saturation. Range is -100..+100 and represents % change
-    
-    
-    global colourVectors
-    global coloursChanged
-    
-    found = False
-    
-    # update colour vectors
+
     found = False
     sum = 0.0 # check to see if anything changed
-    h = 0.0
-    s = 1.0
-    v = 1.0
 
-    for key in ["red", "green", "blue"]:
+    # one row per band (red, green, blue), columns are hue and saturation
+    bands = ["red", "green", "blue"]
+    rows = [state.bandIndex(key) for key in bands]
+    adjustments = np.zeros((len(bands), 2))
+    for i, key in enumerate(bands):
         tag = key.capitalize()
-        if xmp.does_property_exist(XMP_NS_CAMERA_RAW, tag+"Hue"):
-            found = True
-            h = xmp.get_property_float(XMP_NS_CAMERA_RAW, tag+"Hue")
-            sum = sum + abs(h)
-            if abs(h)>0.01:
-                print(tag+" Hue: "+str(h))
-                # if noop values in use([0, 1, 1]), then replace with reference colour
-                #if (approxEqual(colourVectors[key][0],0.0) and approxEqual(colourVectors[key][1],1.0) and approxEqual(colourVectors[key][2],1.0)):
-                #    colourVectors[key] = refColour[key]
-                #value = (h / 100.0) * hueWidth # treat as a %age of the hue band (not the entire hue range)
-                value = (h / 100.0)  / 8.0 # treat as a %age of the colour band
-                #value = colourVectors[key][0] + value
-                colourVectors[key][0] = colourVectors[key][0] + value
-        if xmp.does_property_exist(XMP_NS_CAMERA_RAW, tag+"Saturation"):
-            found = True
-            s = xmp.get_property_float(XMP_NS_CAMERA_RAW, tag+"Saturation")
-            sum = sum + abs(s)
-            if abs(s)>0.01:
-                print(tag+" Sat: "+str(s))
-                # if noop values in use([0, 1, 1]), then replace with reference colour
-                #if (approxEqual(colourVectors[key][0],0.0) and approxEqual(colourVectors[key][1],1.0) and approxEqual(colourVectors[key][2],1.0)):
-                #    colourVectors[key] = refColour[key]
-                value = s / 100.0
-                colourVectors[key][1] = colourVectors[key][1] + value
-                #colourVectors[key][1] = calculateCurveChange(colourVectors[key][1], value, 1.0)
+        for j, suffix in enumerate(["Hue", "Saturation"]):
+            if xmp.does_property_exist(XMP_NS_CAMERA_RAW, tag+suffix):
+                found = True
+                value = xmp.get_property_float(XMP_NS_CAMERA_RAW, tag+suffix)
+                adjustments[i, j] = value
+                sum = sum + abs(value)
+                if abs(value)>0.01:
+                    print(tag+" "+suffix[:3]+": "+str(value))
+
+    # hue is treated as a %age of the colour band (not the entire hue range), saturation as a %age change
+    significant = np.abs(adjustments) > 0.01
+    state.addColours(0, np.where(significant[:, 0], (adjustments[:, 0] / 100.0) / 8.0, 0.0), rows)
+    state.addColours(1, np.where(significant[:, 1], adjustments[:, 1] / 100.0, 0.0), rows)
 
     if found and (sum > 0.01):
-        coloursChanged = True
-        print ("Updated Colours: " + str(colourVectors) + "\n")
+        state.coloursChanged = True
+        print ("Updated Colours: " + str(state.bands()) + "\n")
         print ("...Calibration")
 
 
@@ -1067,47 +1290,38 @@ def processCalibration():
 
 
 def processGrayMixer():
-    global colourVectors
-    global coloursChanged
-    global convertToMono
     
-    # update colour vectors
+    # read the mix for all the bands
     found = False
-    for key in colourVectors.keys():
-        s = 0.0
+    mix = np.zeros(len(presetState.BANDS))
+    for i, key in enumerate(presetState.BANDS):
         tag = key.capitalize()
-
         if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "GrayMixer"+tag):
             found = True
-            s = xmp.get_property_float(XMP_NS_CAMERA_RAW, "GrayMixer"+tag)
-            if abs(s)>0.01:
-                value = (s / 100.0) # treat as a %age change
-                colourVectors[key][1] = colourVectors[key][1] + value
-                coloursChanged = True
-                print ("GrayMixer"+tag + ": " + str(s))
+            mix[i] = xmp.get_property_float(XMP_NS_CAMERA_RAW, "GrayMixer"+tag)
+            if abs(mix[i])>0.01:
+                print ("GrayMixer"+tag + ": " + str(mix[i]))
+
+    # update colour vectors, treat as a %age change of the saturation
+    significant = np.abs(mix) > 0.01
+    if significant.any():
+        state.addColours(1, np.where(significant, mix / 100.0, 0.0))
+        state.coloursChanged = True
 
     if found:
-        print ("Updated Colours: " + str(colourVectors) + "\n")
+        print ("Updated Colours: " + str(state.bands()) + "\n")
         print ("...GrayMixer")
         # if GrayMix is specified then assume conversion to greyscale
-        convertToMono = True
+        state.mono = True
 
 
 # ----------------------------
 
 
 def addHSV():
-    if coloursChanged:
-        filterMap["filters"].append( { 'key':"MultiBandHSV", "parameters":[{ 'key':"inputRedShift", 'val': colourVectors["red"], 'type': "CIAttributeTypePosition3"},
-                                                                           { 'key':"inputOrangeShift", 'val': colourVectors["orange"], 'type': "CIAttributeTypePosition3"},
-                                                                           { 'key':"inputYellowShift", 'val': colourVectors["yellow"], 'type': "CIAttributeTypePosition3"},
-                                                                           { 'key':"inputGreenShift", 'val': colourVectors["green"], 'type': "CIAttributeTypePosition3"},
-                                                                           { 'key':"inputAquaShift", 'val': colourVectors["aqua"], 'type': "CIAttributeTypePosition3"},
-                                                                           { 'key':"inputBlueShift", 'val': colourVectors["blue"], 'type': "CIAttributeTypePosition3"},
-                                                                           { 'key':"inputPurpleShift", 'val': colourVectors["purple"], 'type': "CIAttributeTypePosition3"},
-                                                                           { 'key':"inputMagentaShift", 'val': colourVectors["magenta"], 'type': "CIAttributeTypePosition3"} ]
-                                    } )
-        print ("Final Colours: " + str(colourVectors) + "\n")
+    if state.coloursChanged:
+        addEffect(presetIR.COLOUR, "hsv", bands=state.bands())
+        print ("Final Colours: " + str(state.bands()) + "\n")
 
 # ----------------------------
 
@@ -1143,11 +1357,8 @@ def processSplitToning():
         sum = sum + abs(shadowSaturation)
 
     if found and abs(sum)>0.01:
-        filterMap["filters"].append( { 'key':"SplitToningFilter", "parameters":[{ 'key':"inputHighlightHue", 'val': highlightHue, 'type': "CIAttributeTypeScalar"},
-                                                                                { 'key':"inputHighlightSaturation", 'val': highlightSaturation, 'type': "CIAttributeTypeScalar"},
-                                                                                { 'key':"inputShadowHue", 'val': shadowHue, 'type': "CIAttributeTypeScalar"},
-                                                                                { 'key':"inputShadowSaturation", 'val': shadowSaturation, 'type': "CIAttributeTypeScalar"} ]
-                                    } )
+        addEffect(presetIR.COLOUR, "splitToning", highlightHue=highlightHue, highlightSaturation=highlightSaturation,
+                  shadowHue=shadowHue, shadowSaturation=shadowSaturation)
         print ("...Split Toning")
 
 # ----------------------------
@@ -1161,7 +1372,7 @@ def processSharpening():
         value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Sharpness") / 50.0
         value = clamp(value, 0.0, 2.0)
         if abs(value)>0.01:
-            filterMap["filters"].append( { 'key':"CISharpenLuminance", "parameters":[{ 'key':"inputSharpness", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+            addEffect(presetIR.SPATIAL, "sharpen", amount=value)
             print ("Luminance Sharpen: " + str(value))
             print ("...Sharpening")
 
@@ -1184,10 +1395,7 @@ def processSharpening():
         threshold = xmp.get_property_float(XMP_NS_CAMERA_RAW, "SharpenThreshold")
 
     if found and approxEqual(amount, 0.0):
-        filterMap["filters"].append( { 'key':"UnsharpMaskFilter", "parameters":[{ 'key':"inputAmount", 'val': amount, 'type': "CIAttributeTypeScalar"},
-                                                                                { 'key':"inputRadius", 'val': radius, 'type': "CIAttributeTypeScalar"},
-                                                                                { 'key':"inputThreshold", 'val': threshold, 'type': "CIAttributeTypeScalar"} ]
-                                    } )
+        addEffect(presetIR.SPATIAL, "unsharpMask", amount=amount, radius=radius, threshold=threshold)
         print ("Unsharp Mask: amount: " + str(amount) + " radius: "  + str(radius) + " threshold: "  + str(threshold))
         print ("...Unsharp Mask")
 
@@ -1235,10 +1443,7 @@ def processVignette():
         #                                                                       {'key': "inputRadius", "val": radius, "type": "CIAttributeTypeDistance"},
         #                                                                      {'key': "inputIntensity", "val": intensity, "type": "CIAttributeTypeScalar"},
         #                                                                       {'key': "inputFalloff", "val": falloff, "type": "CIAttributeTypeScalar"}]
-        filterMap["filters"].append({'key': "CenteredVignetteFilter", "parameters": [{'key': "inputRadius", "val": radius, "type": "CIAttributeTypeScalar"},
-                                                                                     {'key': "inputIntensity", "val": intensity, "type": "CIAttributeTypeScalar"},
-                                                                                     {'key': "inputFalloff", "val": falloff, "type": "CIAttributeTypeScalar"}]
-                                                                  } )
+        addEffect(presetIR.SPATIAL, "vignette", radius=radius, intensity=intensity, falloff=falloff)
         print ("Vignette: intensity:" + str(intensity) + " radius: "  + str(radius) + " falloff: "  + str(falloff))
         print ("...Vignette")
 
@@ -1248,20 +1453,17 @@ def processVignette():
 
 def processGrayscale():
 
-    global coloursChanged
-    global convertToMono
-
     flag = False
     if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ConvertToGrayscale"):
         flag = xmp.get_property_bool(XMP_NS_CAMERA_RAW, "ConvertToGrayscale")
 
     # apply if flagged here or elsewhere, unless Split Toning is applied (this is used for Sepia toning etc.)
-    if (flag or convertToMono):
+    if (flag or state.mono):
         # filterMap["filters"].append( { 'key':"CIPhotoEffectMono", "parameters":[] } )
         value = 0.0
-        if coloursChanged:
+        if state.coloursChanged:
             value = 0.001  # if we messed with the colours, then leave a little in there
-        filterMap["filters"].append({'key': "SaturationFilter", "parameters": [ {'key': "inputSaturation", 'val': value, 'type': "CIAttributeTypeScalar"}]})
+        addEffect(presetIR.SCALAR, "saturation", saturation=value)
         print ("...ConvertToGrayscale")
 
 
@@ -1288,14 +1490,158 @@ def processGrain():
     
 
     if found and not approxEqual(amount, 0.0):
-        filterMap["filters"].append( { 'key':"FilmGrainFilter", "parameters":[{ 'key':"inputAmount", 'val': amount, 'type': "CIAttributeTypeScalar"},
-                                                                          { 'key':"inputSize", 'val': size, 'type': "CIAttributeTypeScalar"} ]
-                                    } )
+        addEffect(presetIR.SPATIAL, "grain", amount=amount, size=size)
         print ("Film Grain: amount: " + str(amount) + " size: "  + str(size))
         print ("...Film Grain")
 
 # ----------------------------
 
+# fits a spline through the supplied (0..255) curve points and samples it at the xcurve positions.
+# scale is the output range (1.0 or 100.0 here), results are clamped to 0..scale
+# Fits are memoised (LRU) on the points, degree and sample positions
+
+
+def fitCurve(points, scale, xcurve):
+    global curveCacheHits, curveCacheMisses
+
+    degree = min(5, (len(points)-1))
+    cacheKey = (tuple((float(p[0]), float(p[1])) for p in points), degree, scale, tuple(xcurve))
+    if cacheKey in curveCache:
+        curveCacheHits += 1
+        curveCache.move_to_end(cacheKey)
+        return list(curveCache[cacheKey])
+
+    curveCacheMisses += 1
+    x, y = zip(*points)
+    x2 = [scale * f / 255 for f in x]
+    y2 = [scale * f / 255 for f in y]
+    try:
+        spline = UnivariateSpline(x2, y2, s=0, k=degree)
+    except ValueError as e:
+        # should not happen for cleaned points, but don't let one bad curve kill the conversion
+        print("WARN: spline fit failed (" + str(e) + "). Using linear interpolation")
+        spline = lambda v: np.interp(v, x2, y2)
+    ycurve = []
+    for i in range(0, len(xcurve)):
+        tmp = float(clamp(spline(xcurve[i]), 0.0, scale))
+        if tmp < 0.001: # small numbers cause issues with JSON
+            tmp = 0.0
+        ycurve.append(tmp)
+
+    curveCache[cacheKey] = tuple(ycurve)
+    if len(curveCache) > curveCacheSize:
+        curveCache.popitem(last=False)
+    return ycurve
+
+
+# reads the points of a tone curve (rdf:Seq of "x, y" strings), returning a cleaned list of [x, y] pairs (0..255 scale)
+# The amount of work is bounded (and does not depend on the machine): very long sequences are sampled, so at most
+# maxCurveItems + 1 items are read
+
+
+def getCurvePoints(curveName):
+    count = xmp.count_array_items(XMP_NS_CAMERA_RAW, curveName)
+
+    step = 1
+    if count > maxCurveItems:
+        step = int(math.ceil(float(count) / maxCurveItems))
+        print("WARN: " + curveName + " has " + str(count) + " points, sampling every " + str(step) + " points")
+    indexes = list(range(1, (count+1), step))
+    if count > 0 and indexes[-1] != count:
+        indexes.append(count)
+
+    points = []
+    for i in indexes:
+        point = parseCurvePoint(xmp.get_array_item(XMP_NS_CAMERA_RAW, curveName, i))
+        if point is not None:
+            points.append(point)
+        else:
+            print("WARN: ignoring invalid point in " + curveName + " (item " + str(i) + ")")
+
+    return cleanCurvePoints(points)
+
+
+# parses a single "x, y" curve point. Returns None if invalid, otherwise the point clamped to 0..255
+
+
+def parseCurvePoint(item):
+    try:
+        values = [float(v) for v in item.split(",")]
+    except (ValueError, AttributeError):
+        return None
+    if len(values) != 2 or not all(math.isfinite(v) for v in values):
+        return None
+    return [clamp(values[0], 0.0, 255.0), clamp(values[1], 0.0, 255.0)]
+
+
+# sorts curve points by x, removes duplicate x values (last one wins) and downsamples very long curves
+# the spline fit needs strictly increasing x values, and its cost grows with the number of points
+
+
+def cleanCurvePoints(points):
+    unique = {}
+    for point in points:
+        unique[point[0]] = point[1]
+    cleaned = [[x, unique[x]] for x in sorted(unique.keys())]
+    if len(cleaned) < len(points):
+        print("WARN: removed " + str(len(points) - len(cleaned)) + " duplicate curve points")
+    if len(cleaned) > maxCurvePoints:
+        cleaned = downsampleCurve(cleaned, curveTolerance, maxCurvePoints)
+    return cleaned
+
+
+# reduces a curve to at most maxPoints points (Ramer-Douglas-Peucker, using the vertical distance to the simplified curve).
+# The tolerance is doubled until the result is small enough, so the error is bounded by the final tolerance. After
+# maxCurveDoublings only the end points are kept (maxPoints has to allow for them)
+
+
+def downsampleCurve(points, tolerance, maxPoints):
+    if maxPoints < 2:
+        raise ValueError("a curve needs at least 2 points, not " + str(maxPoints))
+    x = np.array([p[0] for p in points])
+    y = np.array([p[1] for p in points])
+    # a tolerance of 0 would never grow
+    tolerance = max(tolerance, 1e-6)
+
+    for doubling in range(maxCurveDoublings + 1):
+        keep = np.zeros(len(x), dtype=bool)
+        keep[0] = True
+        keep[-1] = True
+        segments = [(0, len(x)-1)]
+        while segments:
+            first, last = segments.pop()
+            if (last - first) < 2:
+                continue
+            line = y[first] + (y[last] - y[first]) * (x[first+1:last] - x[first]) / (x[last] - x[first])
+            error = np.abs(y[first+1:last] - line)
+            i = int(np.argmax(error))
+            if error[i] > tolerance:
+                keep[first+1+i] = True
+                segments.append((first, first+1+i))
+                segments.append((first+1+i, last))
+        if np.count_nonzero(keep) <= maxPoints:
+            break
+        tolerance = tolerance * 2.0
+    else:
+        keep = np.zeros(len(x), dtype=bool)
+        keep[0] = True
+        keep[-1] = True
+
+    print("WARN: downsampled curve from " + str(len(x)) + " to " + str(np.count_nonzero(keep)) + " points (max error: " + str(tolerance) + ")")
+    return [[float(a), float(b)] for a, b in zip(x[keep], y[keep])]
+
+
+# returns the curve cache statistics (useful when converting a batch of presets in the same process)
+def curveCacheStats():
+    total = curveCacheHits + curveCacheMisses
+    hitRate = 0.0
+    if total > 0:
+        hitRate = float(curveCacheHits) / total
+    return { "hits": curveCacheHits, "misses": curveCacheMisses, "size": len(curveCache), "hitRate": hitRate }
+
+
+# ----------------------------
+
 # calculates the change to a "curve". We assume the change is a percentage of the remaining distance above/below the curve
 # change is -100..+100 and emulates Photoshop/Lightroom controls
 # scale is the maximum value of the curve (typically 1.0 or 100.0 here)
@@ -1345,4 +1691,5 @@ def approxEqual(var, value):
 
 
 # execute main function
-main()
+if __name__ == "__main__":
+    main()
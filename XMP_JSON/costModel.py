@@ -0,0 +1,261 @@
+#! /usr/bin/python
+
+# Device cost model for converted (Core Image) presets.
+#
+# Every filter in a preset's chain is a pass over the image on the device, and some are much more expensive than
+# others: sharpening, grain, noise reduction and clarity look at neighbouring pixels (and are made of several passes),
+# while the colour filters are a few operations per pixel. A preset that stacks several of these may be too slow for
+# a real-time camera preview. The model gives each filter key an estimated cost per pixel, in units of one simple
+# colour pass (read a pixel, adjust it, write it: 1.0), plus its number of passes. Each pass also costs PASS_COST for
+# writing the intermediate image and reading it back. The numbers are rough relative costs, not timings: calibrate the
+# budget by timing a few presets on the slowest device that has to run the preview.
+#
+# estimate() gives the cost of a preset as emitted, and also with each run of per-pixel colour filters fused into one
+# pass (as shaderGen.py does). annotate() adds it to the preset:
+#   "cost": { "perPixel": ..., "passes": ..., "fusedPerPixel": ..., "fusedPasses": ..., "budget": ..., "overBudget": ... }
+# previewLite() makes a variant of a preset within a budget, by dropping the filters that matter least at preview size
+# (in the order of LITE_DROP: grain first, then noise reduction, sharpening etc.). The colour filters, which make the
+# look, are never dropped, so a variant may still be over the budget.
+#
+# The converter annotates its output with --cost-budget and writes <output>.lite.json for presets over the budget with
+# --preview-lite (batchConvert.py takes the same options).
+#
+# Usage: python costModel.py <directory of converted presets> [--budget 32] [--lite] [--report report.json]
+# prints the costs across the library: how many presets are over the budget, the most expensive presets and the
+# filters that contribute most.
+
+import os, os.path
+import sys
+import json
+import argparse
+
+import atomicWriter
+import presetIR
+
+
+# filter key -> (cost per pixel, passes, per-pixel colour filter). The per-pixel filters are the ones that
+# shaderGen.py can fuse (FUSABLE_FILTERS)
+FILTER_COSTS = { "AutoAdjustFilter":        (4.0, 2, False),   # histogram, then the adjustment
+                 "WhiteBalanceFilter":      (1.0, 1, True),
+                 "CIExposureAdjust":        (0.5, 1, True),
+                 "ContrastFilter":          (1.0, 1, False),
+                 "CIHighlightShadowAdjust": (6.0, 3, False),   # needs a blurred luminance image
+                 "ClarityFilter":           (8.0, 3, False),   # local contrast: large blur, then the adjustment
+                 "CIVibrance":              (1.0, 1, False),
+                 "SaturationFilter":        (0.5, 1, True),
+                 "CINoiseReduction":        (10.0, 2, False),
+                 "SplitToningFilter":       (1.5, 1, True),
+                 "CISharpenLuminance":      (3.0, 1, False),   # 3x3 convolution
+                 "UnsharpMaskFilter":       (4.0, 3, False),   # separable blur (2 passes), then the mask
+                 "CenteredVignetteFilter":  (1.0, 1, False),
+                 "FilmGrainFilter":         (5.0, 2, False),   # noise generation, then the blend
+                 "CIToneCurve":             (1.0, 1, True),
+                 "RGBChannelToneCurve":     (1.5, 1, True),
+                 "MultiBandHSV":            (3.0, 1, True) }
+
+# filters that are not in the table
+DEFAULT_COST = (2.0, 1, False)
+
+# extra cost of each pass, for the intermediate image
+PASS_COST = 1.0
+
+# UnsharpMaskFilter: extra cost per pixel of inputRadius (the blur kernel grows with the radius)
+UNSHARP_COST_PER_RADIUS = 2.0
+
+# default budget (cost per pixel) of a real-time preview
+defaultBudget = 32.0
+
+# filters dropped from a preview-lite variant, in this order, until it is within the budget
+LITE_DROP = [ "FilmGrainFilter", "CINoiseReduction", "UnsharpMaskFilter", "ClarityFilter", "CISharpenLuminance",
+              "AutoAdjustFilter", "CIHighlightShadowAdjust", "CenteredVignetteFilter" ]
+
+# files next to the converted presets that are not (Core Image) presets
+VARIANT_SUFFIXES = [".lite.json", ".pack.json"] + ["." + target + ".json" for target in presetIR.targets() if target != "coreimage"]
+
+
+# ----------------------------
+
+
+def main():
+
+    # parse the command line args
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="directory of converted (Core Image) presets, searched recursively")
+    parser.add_argument("--budget", type=float, default=defaultBudget, help="cost per pixel allowed for a real-time preview")
+    parser.add_argument("--lite", action="store_true", help="write a preview-lite variant (<name>.lite.json) of each preset over the budget")
+    parser.add_argument("--top", type=int, default=10, help="number of most expensive presets listed")
+    parser.add_argument("--report", help="write the report (JSON) to this file")
+    args = parser.parse_args()
+
+    report = libraryReport(args.input, args.budget, args.lite)
+    printReport(report, args.top)
+    if args.report:
+        atomicWriter.writeAtomic(args.report, json.dumps(report, indent=2))
+
+
+# ----------------------------
+
+
+# cost and passes of a filter
+
+
+def filterCost(f):
+    cost, passes, perPixel = FILTER_COSTS.get(f.get("key"), DEFAULT_COST)
+    if f.get("key") == "UnsharpMaskFilter":
+        for p in f.get("parameters", []):
+            if p.get("key") == "inputRadius" and isinstance(p.get("val"), (int, float)):
+                cost += UNSHARP_COST_PER_RADIUS * max(0.0, p["val"])
+    return cost, passes, perPixel
+
+
+# the estimated cost of a filter chain: { "perPixel", "passes" } as emitted (one Core Image filter after the other),
+# and { "fusedPerPixel", "fusedPasses" } with each run of per-pixel filters fused into one pass
+
+
+def estimate(filters):
+    cost = 0.0
+    passes = 0
+    fusedPasses = 0
+    inRun = False
+    for f in filters:
+        c, n, perPixel = filterCost(f)
+        cost += c
+        passes += n
+        if perPixel:
+            if not inRun:
+                fusedPasses += 1
+            inRun = True
+        else:
+            fusedPasses += n
+            inRun = False
+    return { "perPixel": round(cost + PASS_COST * passes, 3), "passes": passes,
+             "fusedPerPixel": round(cost + PASS_COST * fusedPasses, 3), "fusedPasses": fusedPasses }
+
+
+# the preset with its estimated cost (a new object, the preset is not modified)
+
+
+def annotate(preset, budget=defaultBudget):
+    cost = estimate(preset.get("filters", []))
+    cost["budget"] = budget
+    cost["overBudget"] = cost["perPixel"] > budget
+    preset = dict(preset)
+    preset["cost"] = cost
+    return preset
+
+
+# a variant of the preset within the budget, if possible: the filters in LITE_DROP are dropped, one kind after the
+# other, until it is. The variant is annotated, and lists what was dropped:
+#   "lite": { "dropped": [ <filter key>, ... ], "withinBudget": ... }
+
+
+def previewLite(preset, budget=defaultBudget):
+    filters = list(preset.get("filters", []))
+    dropped = []
+    for key in LITE_DROP:
+        if estimate(filters)["perPixel"] <= budget:
+            break
+        if any(f.get("key") == key for f in filters):
+            filters = [f for f in filters if f.get("key") != key]
+            dropped.append(key)
+    lite = dict(preset)
+    lite["filters"] = filters
+    lite = annotate(lite, budget)
+    lite["lite"] = { "dropped": dropped, "withinBudget": not lite["cost"]["overBudget"] }
+    return lite
+
+
+# name of the preview-lite variant of an output file
+
+
+def liteFile(path):
+    return os.path.splitext(path)[0] + ".lite.json"
+
+
+# ----------------------------
+
+
+# the costs of the converted presets below a directory. With lite set, a preview-lite variant is written next to each
+# preset that is over the budget
+
+
+def libraryReport(indir, budget=defaultBudget, lite=False):
+    presets = []
+    filters = {}
+    skipped = 0
+    for path in findPresets(indir):
+        try:
+            with open(path, 'r') as inf:
+                preset = json.load(inf)
+            chain = preset["filters"]
+        except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+            sys.stderr.write("Skipping " + path + ": " + str(e) + "\n")
+            skipped += 1
+            continue
+
+        cost = estimate(chain)
+        entry = { "path": os.path.relpath(path, indir), "perPixel": cost["perPixel"], "passes": cost["passes"],
+                  "fusedPerPixel": cost["fusedPerPixel"], "fusedPasses": cost["fusedPasses"],
+                  "overBudget": cost["perPixel"] > budget }
+        for f in chain:
+            c, n, perPixel = filterCost(f)
+            stats = filters.setdefault(f.get("key"), { "presets": 0, "cost": 0.0 })
+            stats["presets"] += 1
+            stats["cost"] += c + PASS_COST * n
+        if lite and entry["overBudget"]:
+            variant = previewLite(preset, budget)
+            atomicWriter.writeAtomic(liteFile(path), json.dumps(variant, indent=2), sync=False)
+            entry["lite"] = { "perPixel": variant["cost"]["perPixel"], "dropped": variant["lite"]["dropped"],
+                              "withinBudget": variant["lite"]["withinBudget"] }
+        presets.append(entry)
+
+    costs = sorted(entry["perPixel"] for entry in presets)
+    return { "budget": budget, "presets": len(presets), "skipped": skipped,
+             "overBudget": sum(1 for entry in presets if entry["overBudget"]),
+             "liteOverBudget": sum(1 for entry in presets if "lite" in entry and not entry["lite"]["withinBudget"]),
+             "percentiles": dict((name, percentile(costs, q)) for name, q in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0)]),
+             "filters": filters,
+             "costs": sorted(presets, key=lambda entry: -entry["perPixel"]) }
+
+
+# the converted presets below a directory: skips the outputs for other targets, variants, packs and hidden files
+
+
+def findPresets(indir):
+    for root, dirs, files in os.walk(indir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.startswith(".") or not name.endswith(".json") or any(name.endswith(suffix) for suffix in VARIANT_SUFFIXES):
+                continue
+            yield os.path.join(root, name)
+
+
+def percentile(values, q):
+    if len(values) == 0:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def printReport(report, top=10):
+    print("Presets: " + str(report["presets"]) + ", over the budget of " + str(report["budget"]) + ": " +
+          str(report["overBudget"]) + (" (" + str(report["liteOverBudget"]) + " still over as preview-lite)" if report["liteOverBudget"] > 0 else ""))
+    p = report["percentiles"]
+    print("Cost per pixel: p50 " + str(p["p50"]) + ", p90 " + str(p["p90"]) + ", p99 " + str(p["p99"]) + ", max " + str(p["max"]))
+
+    print("\n%-28s %8s %12s %8s" % ("filter", "presets", "cost", "share"))
+    total = sum(stats["cost"] for stats in report["filters"].values())
+    for key, stats in sorted(report["filters"].items(), key=lambda kv: -kv[1]["cost"]):
+        print("%-28s %8d %12.1f %7.1f%%" % (key, stats["presets"], stats["cost"], 100.0 * stats["cost"] / max(total, 1e-9)))
+
+    print("\n%-48s %9s %7s %9s %7s" % ("most expensive", "cost", "passes", "fused", "passes"))
+    for entry in report["costs"][:top]:
+        print("%-48s %9.1f %7d %9.1f %7d%s" % (entry["path"][-48:], entry["perPixel"], entry["passes"], entry["fusedPerPixel"],
+                                              entry["fusedPasses"], "  OVER" if entry["overBudget"] else ""))
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+#! /usr/bin/python
+
+# Discovery of the input files of a batch (batchConvert.py) in large directory trees, e.g. millions of .xmp files in
+# nested vendor folders on network storage, where listing the tree one directory at a time (os.walk) and then stat'ing
+# every file takes minutes before the first conversion starts.
+#
+#   - directories are scanned concurrently (os.scandir) by a pool of threads, so the round trips to the storage overlap
+#   - files are passed on as they are found, so conversion starts straight away, while the rest of the tree is scanned
+#   - the listing of each directory (its subdirectories and its matching files) is cached between runs. If a
+#     directory's mtime is unchanged, its cached listing is used rather than listing it again. The files themselves are
+#     still stat'ed (by the scan threads, concurrently), as a file that is rewritten in place does not change the mtime
+#     of its directory. The size and mtime of each file are passed on with it (used by the journal, which then does not
+#     stat the file again)
+# Files are found in no particular order (each directory's files are sorted).
+#
+# The cache (one JSON object per directory, per line) relies on the mtime of a directory changing when entries are
+# added, removed or renamed in it; use a full rescan (rescan=True, batchConvert.py --rescan) on storage where it does
+# not. Directories modified within RACY_SECONDS of the scan are not cached, as changes in the same second would not
+# change their mtime.
+
+import os, os.path
+import time
+import json
+import threading
+import queue
+
+import atomicWriter
+
+
+# directories whose mtime is this close to the time of the scan are not cached (mtime granularity)
+RACY_SECONDS = 2.0
+
+_END = object()
+
+
+class Discovery(object):
+    '''
+        Finds the files with a given suffix below a root directory. scan() generates (path, size, mtime) as they are
+        found. cache is the path of the directory cache file (None: no cache)
+    '''
+
+    def __init__(self, root, suffix=".xmp", workers=8, cache=None, rescan=False, queueSize=1000):
+        self.root = root
+        self.suffix = suffix.lower()
+        self.workers = max(1, workers)
+        self.cachePath = cache
+        self.rescan = rescan
+        self.queueSize = queueSize
+
+        self.lock = threading.Lock()
+        self.stats = { "directories": 0, "cached": 0, "files": 0, "errors": 0, "seconds": 0.0, "firstFile": None }
+        self.errors = []     # (directory, error)
+        self.cache = {}      # relative directory path -> { "mtime", "dirs", "files": [[name, size, mtime], ...] }
+        self.newCache = {}
+
+    # ----------------------------
+
+    def scan(self):
+        if self.cachePath is not None and not self.rescan:
+            self.cache = loadCache(self.cachePath, self.root)
+        self.work = queue.Queue()
+        self.found = queue.Queue(self.queueSize)
+        self.pending = 1
+        self.stopped = False
+        self.work.put("")
+
+        self.start = time.time()
+        threads = [threading.Thread(target=self.worker, name="discovery-" + str(i)) for i in range(self.workers)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+
+        complete = False
+        try:
+            while True:
+                path, files = self.found.get()
+                if path is _END:
+                    complete = True
+                    break
+                if self.stats["firstFile"] is None and len(files) > 0:
+                    self.stats["firstFile"] = time.time() - self.start
+                for name, size, mtime in files:
+                    yield (os.path.join(path, name), size, mtime)
+        finally:
+            self.stopped = True
+            for t in threads:
+                self.work.put(None)
+            # if the scan was abandoned, unblock the workers still passing on files
+            while any(t.is_alive() for t in threads):
+                try:
+                    self.found.get(timeout=0.05)
+                except queue.Empty:
+                    pass
+            # a partial scan would lose the cached listings of the directories that were not reached
+            if complete and self.cachePath is not None:
+                saveCache(self.cachePath, self.root, self.newCache)
+
+    def worker(self):
+        while True:
+            rel = self.work.get()
+            if rel is None:
+                return
+            try:
+                if not self.stopped:
+                    self.scanDirectory(rel)
+            except OSError as e:
+                # unreadable directories are skipped (as by os.walk)
+                with self.lock:
+                    self.stats["errors"] += 1
+                    self.errors.append((rel, str(e)))
+            finally:
+                with self.lock:
+                    self.pending -= 1
+                    done = (self.pending == 0)
+                    if done:
+                        # the time of the scan itself (the files may still be queued)
+                        self.stats["seconds"] = time.time() - self.start
+                if done:
+                    self.found.put((_END, None))
+
+    def scanDirectory(self, rel):
+        path = os.path.join(self.root, rel)
+        mtime = os.stat(path).st_mtime_ns
+        record = self.cache.get(rel)
+        cached = record is not None and record["mtime"] == mtime
+        if cached:
+            record = dict(record, files=statFiles(path, record["files"]))
+        else:
+            dirs = []
+            files = []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.name)
+                    elif entry.name.lower().endswith(self.suffix) and entry.is_file():
+                        st = entry.stat()
+                        files.append([entry.name, st.st_size, int(st.st_mtime)])
+            dirs.sort()
+            files.sort()
+            racy = (time.time() - mtime / 1e9) < RACY_SECONDS
+            record = { "mtime": None if racy else mtime, "dirs": dirs, "files": files }
+
+        with self.lock:
+            self.newCache[rel] = record
+            self.stats["directories"] += 1
+            self.stats["files"] += len(record["files"])
+            if cached:
+                self.stats["cached"] += 1
+            self.pending += len(record["dirs"])
+        for name in record["dirs"]:
+            self.work.put(os.path.join(rel, name))
+        # the files of a directory are passed on together (fewer queue operations)
+        self.found.put((path, record["files"]))
+
+    def summary(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+# ----------------------------
+
+
+# the current [name, size, mtime] of the listed files of a directory (files that are gone are left out)
+
+
+def statFiles(path, files):
+    current = []
+    for name, size, mtime in files:
+        try:
+            st = os.stat(os.path.join(path, name))
+        except FileNotFoundError:
+            continue
+        current.append([name, st.st_size, int(st.st_mtime)])
+    return current
+
+
+# ----------------------------
+
+
+# the directory cache: { "root": <root directory> }, then one line per directory:
+#   { "dir": <relative path>, "mtime": ..., "dirs": [...], "files": [...] }
+# The cache of another root directory is ignored
+
+
+def loadCache(path, root):
+    cache = {}
+    try:
+        with open(path, 'r') as inf:
+            try:
+                header = json.loads(inf.readline())
+            except ValueError:
+                return cache
+            if header.get("root") != os.path.abspath(root):
+                return cache
+            for line in inf:
+                try:
+                    record = json.loads(line)
+                    cache[record.pop("dir")] = record
+                except (ValueError, KeyError):
+                    # e.g. a truncated line
+                    continue
+    except (IOError, OSError):
+        pass
+    return cache
+
+
+def saveCache(path, root, cache):
+    lines = [json.dumps({ "root": os.path.abspath(root) })]
+    lines.extend(json.dumps(dict(record, dir=rel)) for rel, record in sorted(cache.items()))
+    atomicWriter.writeAtomic(path, "".join(line + "\n" for line in lines))
+
+
+def printReport(summary, out=None):
+    text = ("Discovery: " + str(summary["files"]) + " files in " + str(summary["directories"]) + " directories (" +
+            str(summary["cached"]) + " listed from the cache, " + str(summary["errors"]) + " unreadable) in " +
+            ("%.3f" % summary["seconds"]) + "s" +
+            (", first file after " + ("%.3f" % summary["firstFile"]) + "s" if summary["firstFile"] is not None else ""))
+    if out is None:
+        print(text)
+    else:
+        out.write(text + "\n")
@@ -0,0 +1,369 @@
+#! /usr/bin/python
+
+# Regression check of the converter against stored ("golden") JSON outputs, for verifying that a refactor or speedup
+# does not change the results.
+#
+# The XMP files below the input directory are converted in parallel (one converter per worker process) and each
+# result is compared with the golden JSON at the same relative path (<golden dir>/<rel path>.json, the layout that
+# batchConvert.py writes, so a batch output can be used as the goldens). Numbers are compared with a tolerance
+# (--abs-tol, --rel-tol), everything else exactly. The preset key is not compared: it is the output path, which
+# depends on where the preset was written. The report lists, for each file that differs:
+#   - filters added or removed (filters are matched by key, and by occurrence for repeated keys), or moved
+#   - parameters added or removed, and parameter values that changed (with the delta of numeric values)
+#   - changes to the preset info, and to any other fields (e.g. the cost estimate)
+#
+# Both runs are timed: the time of the run that generated the goldens is saved with them (.golden-timing.json), and
+# with --baseline <directory of another copy of the converter> the goldens are regenerated with that version first,
+# so that both versions are timed on the same machine, in the same session.
+#
+# Usage:
+#   python goldenCompare.py <XMP dir> <golden dir> --update           (store the goldens, from the current converter)
+#   python goldenCompare.py <XMP dir> <golden dir> [--report report.json]
+#   python goldenCompare.py <XMP dir> <golden dir> --baseline ../old/XMP_JSON
+# Exits with 1 if any file changed, has no golden, or failed to convert (unless the golden run failed on it too).
+
+import os, os.path
+import sys
+import json
+import time
+import math
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import atomicWriter
+
+
+TIMING_NAME = ".golden-timing.json"
+
+# default tolerances for numeric values: equal if |a - b| <= max(absTol, relTol * max(|a|, |b|))
+absTolerance = 1e-6
+relTolerance = 1e-6
+
+# preset fields that are not compared (the key is the output path)
+IGNORED_FIELDS = [ "key" ]
+
+# the converter module used by a worker process
+converter = None
+
+
+# ----------------------------
+
+
+def main():
+
+    # parse the command line args
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="the directory containing the XMP files (searched recursively)")
+    parser.add_argument("golden", help="the directory of golden JSON files")
+    parser.add_argument("--update", action="store_true", help="(re)generate the goldens instead of comparing")
+    parser.add_argument("--baseline", help="directory of the converter version that generates the goldens (default: this one)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--stream", action="store_true", help="convert with --stream")
+    parser.add_argument("--abs-tol", type=float, default=absTolerance, help="absolute tolerance for numbers")
+    parser.add_argument("--rel-tol", type=float, default=relTolerance, help="relative tolerance for numbers")
+    parser.add_argument("--report", help="write the full (JSON) report to this file")
+    args = parser.parse_args()
+
+    files = findInputs(args.input)
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    if args.update or args.baseline is not None:
+        converterDir = os.path.abspath(args.baseline) if args.baseline is not None else here
+        timing = updateGoldens(files, args.input, args.golden, converterDir, args.workers, args.stream)
+        print("Saved " + str(timing["files"]) + " goldens from: " + converterDir + " in " + ("%.3f" % timing["elapsed"]) + "s")
+        if args.update:
+            return
+
+    report = compareGoldens(files, args.input, args.golden, here, args.workers, args.stream, args.abs_tol, args.rel_tol)
+    if args.report is not None:
+        atomicWriter.writeAtomic(args.report, json.dumps(report, indent=1, sort_keys=True), sync=False)
+    printReport(report)
+    if report["summary"]["changed"] > 0 or report["summary"]["errors"] > 0 or report["summary"]["missing"] > 0:
+        sys.exit(1)
+
+
+# ----------------------------
+
+
+# the XMP files below a directory, as paths relative to it
+
+
+def findInputs(indir):
+    files = []
+    for root, dirs, names in os.walk(indir):
+        dirs.sort()
+        for name in sorted(names):
+            if name.lower().endswith(".xmp"):
+                files.append(os.path.relpath(os.path.join(root, name), indir))
+    return files
+
+
+def goldenPath(golden, rel):
+    return os.path.join(golden, os.path.splitext(rel)[0] + ".json")
+
+
+# ----------------------------
+
+
+# worker process setup: import the converter from the given directory (so that another version can be used as the
+# baseline) and silence its output
+
+
+def initWorker(converterDir, stream):
+    global converter
+    sys.path.insert(0, converterDir)
+    import convertXMPToJson
+    converter = convertXMPToJson
+    converter.streamInput = stream
+    sys.stdout = open(os.devnull, 'w')
+
+
+# convert a file. Returns (rel path, preset or None, error or None, conversion time)
+
+
+def convertFile(args):
+    indir, rel = args
+    start = time.time()
+    try:
+        with open(os.path.join(indir, rel), 'rb') as inf:
+            data = inf.read()
+        preset = converter.convertPresetData(data, rel, os.path.splitext(rel)[0] + ".json")
+        return (rel, preset, None, time.time() - start)
+    except Exception as e:
+        return (rel, None, str(e), time.time() - start)
+
+
+# convert all the files with the converter in converterDir. Returns (list of results, in order, timing)
+
+
+def convertAll(files, indir, converterDir, workers, stream):
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=(converterDir, stream)) as pool:
+        results = list(pool.map(convertFile, [(indir, rel) for rel in files], chunksize=16))
+    elapsed = time.time() - start
+    timing = { "files": len(files), "elapsed": elapsed, "convertTime": sum(r[3] for r in results),
+               "workers": workers, "converter": converterDir }
+    return results, timing
+
+
+# ----------------------------
+
+
+def updateGoldens(files, indir, golden, converterDir, workers, stream):
+    results, timing = convertAll(files, indir, converterDir, workers, stream)
+    for rel, preset, error, seconds in results:
+        if error is not None:
+            print("ERROR: " + rel + ": " + error)
+            continue
+        atomicWriter.writeAtomic(goldenPath(golden, rel), json.dumps(preset, indent=2), sync=False)
+    timing["failed"] = [r[0] for r in results if r[2] is not None]
+    atomicWriter.writeAtomic(os.path.join(golden, TIMING_NAME), json.dumps(timing, indent=1, sort_keys=True))
+    return timing
+
+
+def compareGoldens(files, indir, golden, converterDir, workers, stream, absTol=absTolerance, relTol=relTolerance):
+    results, timing = convertAll(files, indir, converterDir, workers, stream)
+    goldenTiming = loadTiming(golden)
+    report = { "files": {}, "timing": { "current": timing, "golden": goldenTiming },
+               "summary": { "files": len(files), "same": 0, "withinTolerance": 0, "changed": 0, "missing": 0, "errors": 0,
+                            "failedBoth": 0 } }
+    summary = report["summary"]
+    # inputs that the golden run could not convert either, e.g. broken files kept in the corpus on purpose
+    failed = set(goldenTiming.get("failed", [])) if goldenTiming is not None else set()
+    for rel, preset, error, seconds in results:
+        if error is not None and rel in failed and not os.path.exists(goldenPath(golden, rel)):
+            summary["failedBoth"] += 1
+            continue
+        if error is not None:
+            report["files"][rel] = { "status": "error", "error": error }
+            summary["errors"] += 1
+            continue
+        path = goldenPath(golden, rel)
+        if not os.path.exists(path):
+            report["files"][rel] = { "status": "missing golden" }
+            summary["missing"] += 1
+            continue
+        with open(path, 'r') as inf:
+            expected = json.load(inf)
+        # compare through JSON, so that e.g. tuples compare equal to the lists they are saved as
+        preset = json.loads(json.dumps(preset))
+        if comparedFields(preset) == comparedFields(expected):
+            summary["same"] += 1
+            continue
+        changes = diffPresets(expected, preset, absTol, relTol)
+        if len(changes) == 0:
+            summary["withinTolerance"] += 1
+        else:
+            report["files"][rel] = { "status": "changed", "changes": changes }
+            summary["changed"] += 1
+    return report
+
+
+def comparedFields(preset):
+    return dict((name, value) for name, value in preset.items() if name not in IGNORED_FIELDS)
+
+
+def loadTiming(golden):
+    try:
+        with open(os.path.join(golden, TIMING_NAME), 'r') as inf:
+            return json.load(inf)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+# ----------------------------
+
+
+# the differences between two presets (beyond the tolerances), as a list of dicts:
+#   { "change": "filter added"|"filter removed"|"filter moved"|"parameter added"|"parameter removed"|"parameter changed"|
+#               "info changed"|"<field> changed", "filter": ..., "parameter": ..., "golden": ..., "current": ..., "delta": ... }
+# The fields in IGNORED_FIELDS are not compared
+
+
+def diffPresets(expected, actual, absTol=absTolerance, relTol=relTolerance):
+    changes = []
+    for name in sorted(set(expected.keys()) | set(actual.keys())):
+        if name in IGNORED_FIELDS or name == "filters":
+            continue
+        if not valuesMatch(expected.get(name), actual.get(name), absTol, relTol):
+            changes.append({ "change": name + " changed", "golden": expected.get(name), "current": actual.get(name) })
+
+    before = labelFilters(expected.get("filters", []))
+    after = labelFilters(actual.get("filters", []))
+    for label in before:
+        if label not in after:
+            changes.append({ "change": "filter removed", "filter": label })
+    for label in after:
+        if label not in before:
+            changes.append({ "change": "filter added", "filter": label })
+
+    common = [label for label in before if label in after]
+    if common != [label for label in after if label in before]:
+        changes.append({ "change": "filter moved", "golden": common, "current": [label for label in after if label in before] })
+    for label in common:
+        changes.extend(diffParameters(label, before[label], after[label], absTol, relTol))
+    return changes
+
+
+# the filters of a preset keyed by label: the filter key, with #n appended for repeated keys (in order)
+
+
+def labelFilters(filters):
+    labelled = {}
+    counts = {}
+    for f in filters:
+        key = f.get("key")
+        counts[key] = counts.get(key, 0) + 1
+        label = key if counts[key] == 1 else key + "#" + str(counts[key])
+        labelled[label] = f
+    return labelled
+
+
+def diffParameters(label, expected, actual, absTol, relTol):
+    changes = []
+    before = dict((p["key"], p) for p in expected.get("parameters", []))
+    after = dict((p["key"], p) for p in actual.get("parameters", []))
+    for name in before:
+        if name not in after:
+            changes.append({ "change": "parameter removed", "filter": label, "parameter": name, "golden": before[name].get("val") })
+    for name in after:
+        if name not in before:
+            changes.append({ "change": "parameter added", "filter": label, "parameter": name, "current": after[name].get("val") })
+    for name in before:
+        if name in after:
+            old, new = before[name].get("val"), after[name].get("val")
+            if not valuesMatch(old, new, absTol, relTol) or before[name].get("type") != after[name].get("type"):
+                change = { "change": "parameter changed", "filter": label, "parameter": name, "golden": old, "current": new }
+                delta = valueDelta(old, new)
+                if delta is not None:
+                    change["delta"] = delta
+                changes.append(change)
+    return changes
+
+
+# ----------------------------
+
+
+def isNumber(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def valuesMatch(a, b, absTol, relTol):
+    if isNumber(a) and isNumber(b):
+        if math.isnan(a) or math.isnan(b):
+            return math.isnan(a) and math.isnan(b)
+        return abs(a - b) <= max(absTol, relTol * max(abs(a), abs(b)))
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(valuesMatch(x, y, absTol, relTol) for x, y in zip(a, b))
+    if isinstance(a, dict) and isinstance(b, dict):
+        return set(a.keys()) == set(b.keys()) and all(valuesMatch(a[k], b[k], absTol, relTol) for k in a)
+    return a == b
+
+
+# current - golden, for numbers and (same length) lists of numbers. None otherwise
+
+
+def valueDelta(a, b):
+    if isNumber(a) and isNumber(b):
+        return b - a
+    if isinstance(a, list) and isinstance(b, list) and len(a) == len(b):
+        deltas = [valueDelta(x, y) for x, y in zip(a, b)]
+        if all(d is not None for d in deltas):
+            return deltas
+    return None
+
+
+# ----------------------------
+
+
+def printReport(report, limit=20):
+    summary = report["summary"]
+    current = report["timing"]["current"]
+    golden = report["timing"]["golden"]
+
+    for rel in sorted(report["files"]):
+        entry = report["files"][rel]
+        if entry["status"] == "error":
+            print("ERROR: " + rel + ": " + entry["error"])
+        elif entry["status"] == "missing golden":
+            print("MISSING: " + rel + " has no golden")
+        else:
+            print("CHANGED: " + rel)
+            for change in entry["changes"][:limit]:
+                print("    " + describeChange(change))
+            if len(entry["changes"]) > limit:
+                print("    ... " + str(len(entry["changes"]) - limit) + " more")
+
+    print("Files: " + str(summary["files"]) + "  same: " + str(summary["same"]) + "  within tolerance: " +
+          str(summary["withinTolerance"]) + "  changed: " + str(summary["changed"]) + "  missing goldens: " +
+          str(summary["missing"]) + "  errors: " + str(summary["errors"]) + "  failed in both: " + str(summary["failedBoth"]))
+    print("Time (current): " + ("%.3f" % current["elapsed"]) + "s elapsed, " + ("%.3f" % current["convertTime"]) + "s converting")
+    if golden is not None:
+        print("Time (golden):  " + ("%.3f" % golden["elapsed"]) + "s elapsed, " + ("%.3f" % golden["convertTime"]) + "s converting" +
+              " (" + str(golden["workers"]) + " workers)")
+        if current["convertTime"] > 0:
+            print("Speedup: " + ("%.2f" % (golden["convertTime"] / current["convertTime"])) + "x (conversion time)")
+
+
+def describeChange(change):
+    kind = change["change"]
+    if kind in ["filter added", "filter removed"]:
+        return kind + ": " + change["filter"]
+    if kind == "parameter added":
+        return kind + ": " + change["filter"] + "." + change["parameter"] + " = " + json.dumps(change["current"])
+    if kind == "parameter removed":
+        return kind + ": " + change["filter"] + "." + change["parameter"] + " (was " + json.dumps(change["golden"]) + ")"
+    if kind == "parameter changed":
+        text = kind + ": " + change["filter"] + "." + change["parameter"] + " " + json.dumps(change["golden"]) + " -> " + json.dumps(change["current"])
+        if "delta" in change:
+            text += " (delta " + json.dumps(change["delta"]) + ")"
+        return text
+    return kind + ": " + json.dumps(change.get("golden")) + " -> " + json.dumps(change.get("current"))
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+#! /usr/bin/python
+
+# Checkpoint journal for batch conversions, so that a job that dies part way through (OOM, a crash in libxmp, a node
+# restart) can be restarted without redoing the work that was already finished.
+#
+# The journal is an append-only file of JSON lines, one record per event:
+#   { "input": <path>, "status": "started", "size": <bytes>, "mtime": <secs> }
+#   { "input": <path>, "status": "done", "hash": <sha1 of the input>, "output": <path>, "stages": { <stage>: <version> },
+#     "keys": {...} }
+#   { "input": <path>, "status": "filtered", "hash": ..., "stages": {...}, "reason": <why> }
+#   { "input": <path>, "status": "failed", "error": <message> }
+# Records are appended with a single unbuffered write, so they survive a crash of the process (though not necessarily
+# of the machine, sync() is called for that). "done" is only recorded once the output file is committed. "filtered"
+# records an input that was finished without any output, because it had nothing to convert (see prefilter.py).
+#
+# On restart, an input is skipped if it is done (or filtered) and unchanged (same size and mtime), and its output file
+# is still there. Inputs that failed, or were still
+# in flight when the job died, are retried until they have been attempted maxAttempts times - an input that crashes
+# the converter shows up as 'started' with no outcome, so it only costs a few attempts, not the whole job.
+#
+# If the journal is given the current stage versions (see stageTracker.py), a done input is also reconverted if any of
+# the converter stages that it depends on (as recorded with "done") has changed since, otherwise its output is reused.
+# The versions named "(...)" apply to every input (e.g. the list of stages, the output settings), they are recorded
+# with every done input, and one that is missing from a record counts as changed.
+
+import os, os.path
+import json
+import threading
+
+
+# the statuses of finished inputs
+FINISHED = ["done", "filtered"]
+
+
+# ----------------------------
+
+
+class JobJournal(object):
+
+    def __init__(self, path, maxAttempts=3, stageVersions=None):
+        self.path = path
+        self.maxAttempts = max(1, int(maxAttempts))
+        self.stageVersions = stageVersions
+        self.lock = threading.Lock()
+        self.entries = {}      # input -> { "status", "attempts", "size", "mtime", "hash", "error" }
+        self.fingerprints = {} # input -> (size, mtime), for inputs checked in this run
+        self.skipped = 0
+        self.givenUp = []
+        self.outdated = 0         # done inputs that are reconverted because the converter changed
+        self.missing = 0          # done inputs that are reconverted because their output is gone
+        self.changedStages = set()
+
+        records = self.load()
+        # a long history of restarts makes the journal slow to load, so squash it down to the latest state
+        if records > 2 * len(self.entries) + 1000:
+            self.compact()
+
+        directory = os.path.dirname(path)
+        if len(directory) > 0 and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def load(self):
+        count = 0
+        if not os.path.exists(self.path):
+            return count
+        with open(self.path, 'r') as inf:
+            for line in inf:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line may be incomplete if the machine went down while writing it
+                    continue
+                count += 1
+                self.apply(record)
+        return count
+
+    def apply(self, record):
+        entry = self.entries.setdefault(record["input"], { "status": None, "attempts": 0 })
+        status = record["status"]
+        if status == "started":
+            if entry["status"] in FINISHED or (entry.get("size"), entry.get("mtime")) != (record.get("size"), record.get("mtime")):
+                # a different version of the input (or of the converter), earlier attempts don't count
+                entry["attempts"] = 0
+            entry["attempts"] += 1
+            entry["size"] = record.get("size")
+            entry["mtime"] = record.get("mtime")
+        elif status in FINISHED:
+            entry["hash"] = record.get("hash")
+            entry["output"] = record.get("output")
+            entry["stages"] = record.get("stages")
+            entry["keys"] = record.get("keys")
+        elif status == "failed":
+            if entry["status"] != "started":
+                # failed before it was started (e.g. could not be read), still counts as an attempt
+                entry["attempts"] += 1
+            entry["error"] = record.get("error")
+        elif status == "state":
+            # compacted entry
+            entry.update(record["entry"])
+            return
+        entry["status"] = status
+
+    def compact(self):
+        lines = []
+        for name, entry in self.entries.items():
+            lines.append(json.dumps({ "input": name, "status": "state", "entry": entry }))
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as outf:
+            outf.write("\n".join(lines) + "\n")
+            outf.flush()
+            os.fsync(outf.fileno())
+        os.replace(tmp, self.path)
+
+    def append(self, record):
+        line = (json.dumps(record) + "\n").encode('utf-8')
+        with self.lock:
+            self.apply(record)
+            os.write(self.fd, line)
+
+    # ----------------------------
+
+    # returns True if the input needs to be converted (i.e. not already done, and not given up on).
+    # fingerprint replaces the (size, mtime) of the file for inputs that are not files, e.g. catalog rows
+
+    def check(self, infile, fingerprint=None):
+        if fingerprint is None:
+            st = os.stat(infile)
+            fingerprint = (st.st_size, int(st.st_mtime))
+        self.fingerprints[infile] = fingerprint
+
+        entry = self.entries.get(infile)
+        if entry is None:
+            return True
+        unchanged = (entry.get("size"), entry.get("mtime")) == fingerprint
+        if not unchanged:
+            # the input changed since it was last attempted, so start again
+            entry["attempts"] = 0
+            return True
+        if entry["status"] in FINISHED:
+            if entry.get("output") is not None and not os.path.exists(entry["output"]):
+                # e.g. deleted, or the output directory was cleaned
+                self.missing += 1
+                return True
+            changed = self.outdatedStages(entry)
+            if len(changed) > 0:
+                self.outdated += 1
+                self.changedStages.update(changed)
+                return True
+            self.skipped += 1
+            return False
+        if entry["attempts"] >= self.maxAttempts:
+            self.givenUp.append(infile)
+            return False
+        return True
+
+    # the stages used by a done input that have changed since it was converted
+
+    def outdatedStages(self, entry):
+        if self.stageVersions is None:
+            return []
+        stages = entry.get("stages")
+        if stages is None:
+            # converted before stages were tracked
+            return ["(untracked)"]
+        changed = [name for name, version in stages.items() if self.stageVersions.get(name) != version]
+        return changed + [name for name in self.stageVersions if isGlobal(name) and name not in stages]
+
+    def forget(self, infile):
+        # the input was checked, but is not going to be converted by this job (e.g. belongs to another shard)
+        self.fingerprints.pop(infile, None)
+
+    def started(self, infile):
+        size, mtime = self.fingerprints.pop(infile, (None, None))
+        self.append({ "input": infile, "status": "started", "size": size, "mtime": mtime })
+
+    def done(self, infile, hash, dependencies=None, outfile=None):
+        record = self.finished("done", infile, hash, dependencies)
+        record["output"] = outfile
+        self.append(record)
+
+    # the input had nothing to convert, and has no output. reason is the prefilter's
+
+    def filtered(self, infile, hash, dependencies=None, reason=None):
+        record = self.finished("filtered", infile, hash, dependencies)
+        record["reason"] = reason
+        self.append(record)
+
+    def finished(self, status, infile, hash, dependencies):
+        record = { "input": infile, "status": status, "hash": hash }
+        if dependencies is not None:
+            record["stages"] = dict(dependencies["stages"])
+            record["keys"] = dependencies["keys"]
+            if self.stageVersions is not None:
+                record["stages"].update((name, version) for name, version in self.stageVersions.items() if isGlobal(name))
+        return record
+
+    def failed(self, infile, error):
+        self.append({ "input": infile, "status": "failed", "error": str(error) })
+
+    def sync(self):
+        with self.lock:
+            os.fsync(self.fd)
+
+    def close(self):
+        self.sync()
+        os.close(self.fd)
+
+    # counts of the inputs by their (latest) status
+
+    def summary(self):
+        counts = { "done": 0, "filtered": 0, "failed": 0, "started": 0 }
+        for entry in self.entries.values():
+            if entry["status"] in counts:
+                counts[entry["status"]] += 1
+        counts["skipped"] = self.skipped
+        counts["outdated"] = self.outdated
+        counts["missing"] = self.missing
+        counts["givenUp"] = len(self.givenUp)
+        return counts
+
+
+# versions that apply to every input, rather than to a stage
+
+
+def isGlobal(name):
+    return name.startswith("(")
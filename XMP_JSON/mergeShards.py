@@ -0,0 +1,57 @@
+#! /usr/bin/python
+
+# Script to merge the outputs of a sharded batch conversion (batchConvert.py --shard i/N) into a single tree,
+# checking for gaps and duplicates. See sharding.py
+#
+# Example, 4 shards on one machine:
+#   for i in 0 1 2 3; do python batchConvert.py XMP/ out/ --shard $i/4 & done; wait
+#   python mergeShards.py out/ json/
+
+import sys
+import argparse
+
+import sharding
+
+
+# ----------------------------
+
+
+def main():
+
+    # parse the command line args
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output", help="the output directory of the sharded batch (containing the shard-i-of-N directories)")
+    parser.add_argument("merged", help="the directory for the merged JSON files")
+    parser.add_argument("--copy", action="store_true", help="copy the files rather than moving them")
+    args = parser.parse_args()
+
+    report = sharding.mergeShards(args.output, args.merged, args.copy)
+
+    print("Merged " + str(report["merged"]) + " files from " + str(report["shards"]) + " shards")
+    if len(report["filtered"]) > 0:
+        print("Skipped " + str(len(report["filtered"])) + " inputs with nothing to convert (prefilter)")
+    for e in report["errors"]:
+        print("ERROR: " + e)
+    for i in report["missingShards"]:
+        print("GAP: shard " + str(i) + " has no manifest (not run, or did not finish)")
+    for rel in report["failed"]:
+        print("GAP: " + rel + " failed")
+    for rel in report["quarantined"]:
+        print("GAP: " + rel + " was quarantined (it crashed or hung the converter)")
+    for rel in report["missingOutputs"]:
+        print("GAP: " + rel + " is in the manifest, but the output file is missing")
+    if report["unassigned"] > 0:
+        print("GAP: " + str(report["unassigned"]) + " inputs were not converted by any shard")
+    for rel, first, second in report["duplicates"]:
+        print("DUPLICATE: " + rel + " converted by shards " + str(first) + " and " + str(second))
+
+    if sharding.hasProblems(report):
+        sys.exit(1)
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+#! /usr/bin/python
+
+# In-process metrics (counters, histograms and gauges) for long running conversions, e.g. batchConvert.py.
+#
+# Metrics are registered with a Registry (normally the module level 'registry') and can be exposed:
+#   - as a Prometheus text format endpoint: serve(port) starts an HTTP server (localhost by default) on a background
+#     thread, scrape http://localhost:<port>/metrics
+#   - as a JSON file that is rewritten every few seconds: PeriodicDump(path, interval)
+#
+# Updates take a lock, which is cheap next to a conversion (a few dozen updates per preset).
+#
+# Metrics recorded in other processes (e.g. the worker processes of batchConvert.py --processes) are passed back with
+# drain(), which returns the counts recorded since the last drain, and added to the parent's registry with merge().
+
+import os
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import atomicWriter
+
+
+# default histogram buckets (seconds)
+LATENCY_BUCKETS = [ 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0 ]
+
+
+# ----------------------------
+
+
+class Metric(object):
+    '''
+        Base class: a named metric with optional labels. Values are kept per combination of label values
+    '''
+
+    kind = None
+
+    def __init__(self, name, help, labels=(), lock=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = lock if lock is not None else threading.Lock()
+        self.values = {}  # tuple of label values -> value
+
+    def key(self, labels):
+        if set(labels.keys()) != set(self.labels):
+            raise ValueError(self.name + ": expected labels " + str(list(self.labels)) + ", got " + str(sorted(labels.keys())))
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def labelText(self, key, extra=None):
+        pairs = list(zip(self.labels, key))
+        if extra is not None:
+            pairs.append(extra)
+        if len(pairs) == 0:
+            return ""
+        return "{" + ",".join(name + '="' + escape(value) + '"' for name, value in pairs) + "}"
+
+
+class Counter(Metric):
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [ (self.name + self.labelText(key), value) for key, value in sorted(self.values.items()) ]
+
+    def snapshot(self):
+        with self.lock:
+            if len(self.labels) == 0:
+                return self.values.get((), 0)
+            return dict((",".join(key), value) for key, value in self.values.items())
+
+    # the values recorded since the last drain (and clears them), and adding drained values
+
+    def drain(self):
+        with self.lock:
+            values = self.values
+            self.values = {}
+        return values
+
+    def merge(self, values):
+        with self.lock:
+            for key, value in values.items():
+                self.values[key] = self.values.get(key, 0) + value
+
+
+class Histogram(Metric):
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS, lock=None):
+        Metric.__init__(self, name, help, labels, lock)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = { "counts": [0] * len(self.buckets), "sum": 0.0, "count": 0 }
+                self.values[key] = entry
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["counts"][i] += 1
+                    break
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def samples(self):
+        lines = []
+        with self.lock:
+            for key, entry in sorted(self.values.items()):
+                # buckets are cumulative in the exposition format
+                total = 0
+                for bound, count in zip(self.buckets, entry["counts"]):
+                    total += count
+                    lines.append((self.name + "_bucket" + self.labelText(key, ("le", formatNumber(bound))), total))
+                lines.append((self.name + "_bucket" + self.labelText(key, ("le", "+Inf")), entry["count"]))
+                lines.append((self.name + "_sum" + self.labelText(key), entry["sum"]))
+                lines.append((self.name + "_count" + self.labelText(key), entry["count"]))
+        return lines
+
+    def snapshot(self):
+        result = {}
+        with self.lock:
+            for key, entry in self.values.items():
+                result[",".join(key)] = { "count": entry["count"], "sum": entry["sum"],
+                                          "mean": entry["sum"] / entry["count"] if entry["count"] > 0 else 0.0,
+                                          "buckets": dict(zip([formatNumber(b) for b in self.buckets], entry["counts"])) }
+        return result
+
+    def drain(self):
+        with self.lock:
+            values = self.values
+            self.values = {}
+        return values
+
+    def merge(self, values):
+        with self.lock:
+            for key, other in values.items():
+                entry = self.values.get(key)
+                if entry is None:
+                    entry = { "counts": [0] * len(self.buckets), "sum": 0.0, "count": 0 }
+                    self.values[key] = entry
+                entry["counts"] = [a + b for a, b in zip(entry["counts"], other["counts"])]
+                entry["sum"] += other["sum"]
+                entry["count"] += other["count"]
+
+
+class Callback(Metric):
+    '''
+        A metric whose (unlabelled) value is read from a function when the metrics are collected. Counters can be
+        drained and merged (the merged amounts are added to the value), gauges belong to their process
+    '''
+
+    def __init__(self, name, help, func, kind="gauge"):
+        Metric.__init__(self, name, help)
+        self.func = func
+        self.kind = kind
+        self.merged = 0
+        self.drained = 0
+
+    def value(self):
+        return self.func() + self.merged
+
+    def samples(self):
+        return [ (self.name, self.value()) ]
+
+    def snapshot(self):
+        return self.value()
+
+    def drain(self):
+        if self.kind != "counter":
+            return 0
+        with self.lock:
+            value = self.func()
+            amount = value - self.drained
+            self.drained = value
+        return amount
+
+    def merge(self, amount):
+        with self.lock:
+            self.merged += amount
+
+
+# ----------------------------
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.started = time.time()
+
+    def add(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, help, func, kind="gauge"):
+        return self.add(Callback(name, help, func, kind))
+
+    # Prometheus text format
+
+    def prometheusText(self):
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics)
+        for metric in metrics:
+            lines.append("# HELP " + metric.name + " " + metric.help)
+            lines.append("# TYPE " + metric.name + " " + metric.kind)
+            for name, value in metric.samples():
+                lines.append(name + " " + formatNumber(value))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        result = { "time": time.time(), "uptime": time.time() - self.started }
+        for metric in metrics:
+            result[metric.name] = metric.snapshot()
+        return result
+
+    # the counts recorded since the last drain, by metric name (to be merged into another process's registry)
+
+    def drain(self):
+        with self.lock:
+            metrics = list(self.metrics)
+        delta = {}
+        for metric in metrics:
+            values = metric.drain()
+            if values:
+                delta[metric.name] = values
+        return delta
+
+    def merge(self, delta):
+        with self.lock:
+            metrics = dict((metric.name, metric) for metric in self.metrics)
+        for name, values in delta.items():
+            # metrics only registered in the other process are dropped
+            if name in metrics:
+                metrics[name].merge(values)
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def formatNumber(value):
+    if isinstance(value, float) and value == int(value) and abs(value) < 1e15:
+        return str(int(value)) + ".0"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# ----------------------------
+
+
+# the current resident set size (bytes). Uses /proc where available, otherwise the peak RSS
+
+
+def residentMemory():
+    try:
+        with open("/proc/self/statm", 'r') as inf:
+            return int(inf.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kB on Linux, bytes on macOS
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+# the default registry, used by the converter
+registry = Registry()
+registry.callback("process_resident_memory_bytes", "Resident memory size in bytes", residentMemory)
+registry.callback("process_uptime_seconds", "Time since the metrics were set up", lambda: time.time() - registry.started)
+
+
+# ----------------------------
+
+
+# serve the metrics in Prometheus text format at http://<host>:<port>/metrics, on a background (daemon) thread.
+# Returns the server (call shutdown() to stop it)
+
+
+def serve(port, host="127.0.0.1", reg=None):
+    reg = reg if reg is not None else registry
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ["/metrics", "/"]:
+                self.send_error(404)
+                return
+            body = reg.prometheusText().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # don't log every scrape
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server")
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class PeriodicDump(object):
+    '''
+        Writes the metrics (as JSON) to a file every interval seconds, on a background thread. Each dump also has
+        the per-second rate of every counter since the previous dump. stop() writes a final dump
+    '''
+
+    def __init__(self, path, interval=10.0, reg=None):
+        self.path = path
+        self.interval = interval
+        self.registry = reg if reg is not None else registry
+        self.stopped = threading.Event()
+        self.previous = None
+        self.thread = threading.Thread(target=self.run, name="metrics-dump")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        snapshot = self.registry.snapshot()
+        rates = {}
+        if self.previous is not None:
+            elapsed = max(snapshot["time"] - self.previous["time"], 1e-9)
+            for metric in self.registry.metrics:
+                if metric.kind != "counter":
+                    continue
+                now, before = snapshot[metric.name], self.previous.get(metric.name)
+                if isinstance(now, dict):
+                    before = before or {}
+                    rates[metric.name] = dict((k, (v - before.get(k, 0)) / elapsed) for k, v in now.items())
+                else:
+                    rates[metric.name] = (now - (before or 0)) / elapsed
+        snapshot["rates"] = rates
+        self.previous = snapshot
+        atomicWriter.writeAtomic(self.path, json.dumps(snapshot, indent=1, sort_keys=True), sync=False)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.dump()
@@ -0,0 +1,173 @@
+#! /usr/bin/python
+
+# Simple threaded, staged pipeline.
+#
+# Each stage has a number of worker threads that take items from a bounded input queue, process them and pass the
+# result on to the next stage. The bounded queues provide backpressure: a fast stage blocks when the next stage falls
+# behind, rather than buffering everything in memory.
+#
+# The pipeline keeps per-stage timings (busy, waiting for input, blocked on output) so that the worker counts can be
+# sized for the storage in use (e.g. NFS-backed preset stores, where most of the time is spent reading and writing).
+
+import threading
+import time
+import queue
+
+
+# marks the end of the input for a stage worker
+_END = object()
+
+
+# ----------------------------
+
+
+class Stage(object):
+    '''
+        A pipeline stage. func(item) is called for each item and returns the item for the next stage, or None to drop it.
+        Exceptions are recorded against the stage and the item is dropped.
+    '''
+
+    def __init__(self, name, func, workers=1, queueSize=16):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=max(1, int(queueSize)))
+
+        # statistics (updated under lock, since several workers share them)
+        self.lock = threading.Lock()
+        self.items = 0
+        self.errors = []     # list of (item, exception)
+        self.busyTime = 0.0  # time spent in func
+        self.waitTime = 0.0  # time spent waiting for input
+        self.blockTime = 0.0 # time spent blocked on the next stage's (full) queue
+
+    def record(self, busy, wait, block, item=None, error=None):
+        with self.lock:
+            self.busyTime += busy
+            self.waitTime += wait
+            self.blockTime += block
+            if error is None:
+                self.items += 1
+            else:
+                self.errors.append((item, error))
+
+
+# ----------------------------
+
+
+class Pipeline(object):
+    '''
+        A chain of stages connected by bounded queues. run() feeds the items through and returns a report (dict)
+    '''
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    def run(self, items):
+        threads = []
+        remaining = [] # number of running workers per stage, used to pass the end marker on
+        for i, stage in enumerate(self.stages):
+            remaining.append(stage.workers)
+            for w in range(stage.workers):
+                t = threading.Thread(target=self.worker, args=(i, remaining), name=stage.name + "-" + str(w))
+                t.daemon = True
+                threads.append(t)
+
+        start = time.time()
+        for t in threads:
+            t.start()
+
+        # feed the first stage. This blocks when the first stage is busy
+        first = self.stages[0]
+        feedBlocked = 0.0
+        count = 0
+        try:
+            for item in items:
+                t0 = time.time()
+                first.queue.put(item)
+                feedBlocked += time.time() - t0
+                count += 1
+        finally:
+            # even if the items fail, the items already fed are finished (e.g. their output committed) before
+            # the error is passed on
+            for w in range(first.workers):
+                first.queue.put(_END)
+            for t in threads:
+                t.join()
+
+        return self.report(count, time.time() - start, feedBlocked)
+
+    def worker(self, index, remaining):
+        stage = self.stages[index]
+        nextStage = self.stages[index+1] if (index+1) < len(self.stages) else None
+
+        while True:
+            t0 = time.time()
+            item = stage.queue.get()
+            t1 = time.time()
+            if item is _END:
+                with stage.lock:
+                    stage.waitTime += t1 - t0
+                    remaining[index] -= 1
+                    last = (remaining[index] == 0)
+                # the last worker of a stage tells the next stage that there is no more input
+                if last and nextStage is not None:
+                    for w in range(nextStage.workers):
+                        nextStage.queue.put(_END)
+                return
+
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                stage.record(time.time() - t1, t1 - t0, 0.0, item, e)
+                continue
+            t2 = time.time()
+
+            if result is not None and nextStage is not None:
+                nextStage.queue.put(result)
+            stage.record(t2 - t1, t1 - t0, time.time() - t2)
+
+    def report(self, count, elapsed, feedBlocked):
+        stages = []
+        for stage in self.stages:
+            capacity = elapsed * stage.workers
+            utilization = 0.0
+            if capacity > 0.0:
+                utilization = stage.busyTime / capacity
+            stages.append({ "name": stage.name, "workers": stage.workers, "items": stage.items, "errors": len(stage.errors),
+                            "busy": stage.busyTime, "wait": stage.waitTime, "blocked": stage.blockTime,
+                            "utilization": utilization })
+        throughput = 0.0
+        if elapsed > 0.0:
+            throughput = count / elapsed
+        return { "items": count, "elapsed": elapsed, "throughput": throughput, "feedBlocked": feedBlocked, "stages": stages }
+
+    def errors(self):
+        errors = []
+        for stage in self.stages:
+            for item, e in stage.errors:
+                errors.append((stage.name, item, e))
+        return errors
+
+
+# ----------------------------
+
+
+# print a pipeline report in a readable form
+# utilization is the fraction of the stage's worker time spent doing work. A stage near 100% is the bottleneck;
+# a stage with a lot of 'blocked' time is waiting on the next stage (backpressure)
+
+
+def printReport(report, out=None):
+    lines = []
+    lines.append("Items: " + str(report["items"]) + "  Elapsed: " + ("%.3f" % report["elapsed"]) + "s" +
+                 "  Throughput: " + ("%.1f" % report["throughput"]) + " items/s")
+    lines.append("%-10s %8s %8s %7s %10s %10s %10s %7s" % ("stage", "workers", "items", "errors", "busy(s)", "wait(s)", "blocked(s)", "util"))
+    for s in report["stages"]:
+        lines.append("%-10s %8d %8d %7d %10.3f %10.3f %10.3f %6.1f%%" % (s["name"], s["workers"], s["items"], s["errors"],
+                                                                          s["busy"], s["wait"], s["blocked"], 100.0 * s["utilization"]))
+    text = "\n".join(lines)
+    if out is None:
+        print(text)
+    else:
+        out.write(text + "\n")
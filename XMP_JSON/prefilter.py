@@ -0,0 +1,148 @@
+#! /usr/bin/python
+
+# Byte-level prefilter for XMP sidecars with nothing to convert.
+#
+# Many sidecars in an ingest have no Camera Raw settings at all (plain metadata sidecars), or only keys that the
+# converter ignores (e.g. crs:PresetType, crs:UUID, crs:SupportsColor). A full parse and all the conversion stages
+# only produce a preset with an empty filter list for them. The prefilter finds them from the raw bytes, without
+# parsing:
+#   - "no-namespace": the Camera Raw namespace (XMP_NS_CAMERA_RAW) does not occur in the data
+#   - "no-settings":  none of the keys consumed by the filter stages occurs as <prefix>:<key>, for the prefix(es) bound
+#                     to the namespace, as an attribute (prefix:Key="...") or an element (<prefix:Key>)
+# The consumed keys come from the converter itself (convertXMPToJson.consumedKeys): the stages are run over empty
+# metadata and every key they look for is recorded. A file that has none of those keys makes every stage take the
+# same path as for empty metadata, which adds no filters. So the result is exact, as long as the converter reads
+# everything through the Camera Raw namespace. Anything the byte scan cannot be sure of (UTF-16/32 data, the namespace
+# used as the default namespace, or an unusual declaration) is passed on for a full conversion.
+#
+# batchConvert.py uses the prefilter (--prefilter): rejected files are either converted with the fast path (only the
+# info stage, on the streamed settings - the output is the same as from a full conversion) or skipped, and counted.
+#
+# Usage: python prefilter.py <XMP dir>    (counts the files in the directory tree that would be rejected, and why)
+
+import os, os.path
+import sys
+import re
+import argparse
+
+import metrics
+import stageTracker
+
+
+XMP_NS_CAMERA_RAW = b"http://ns.adobe.com/camera-raw-settings/1.0/"
+
+# the reasons for rejecting a file
+NO_NAMESPACE = "no-namespace"
+NO_SETTINGS = "no-settings"
+
+# prefixes bound to the Camera Raw namespace
+NS_DECLARATION = re.compile(rb'xmlns:([A-Za-z_][A-Za-z0-9_.-]*)\s*=\s*["\']' + re.escape(XMP_NS_CAMERA_RAW) + rb'["\']')
+
+# prefilter verdicts (the files that are converted in full are counted as "convert")
+prefilterCount = metrics.registry.counter("xmp_prefilter_total", "Files checked by the prefilter, by verdict", ["verdict"])
+
+
+class Prefilter(object):
+    '''
+        Checks XMP data for any of the given (Camera Raw) keys. check() returns the reason for rejecting the data, or
+        None if it has to be converted in full. version changes with the keys (recorded in the batch journal)
+    '''
+
+    def __init__(self, keys):
+        self.version = stageTracker.valueVersion(sorted(keys))
+        # longest first, so that e.g. Exposure2012 is tried before Exposure (either way the match has to end the name)
+        names = sorted(keys, key=lambda key: (-len(key), key))
+        self.keys = rb'(?:' + rb'|'.join(re.escape(key.encode('ascii')) for key in names) + rb')'
+        self.patterns = {}
+
+    def check(self, data):
+        if XMP_NS_CAMERA_RAW not in data:
+            # UTF-16/32 data would not contain the namespace as ASCII bytes
+            if data[:2] in (b"\xff\xfe", b"\xfe\xff") or b"\x00" in data[:64]:
+                return self.counted(None)
+            return self.counted(NO_NAMESPACE)
+
+        prefixes = set(NS_DECLARATION.findall(data))
+        if len(prefixes) == 0 or data.count(XMP_NS_CAMERA_RAW) > len(NS_DECLARATION.findall(data)):
+            # the namespace occurs other than as a prefix declaration (e.g. a default namespace): can't tell
+            return self.counted(None)
+        for prefix in prefixes:
+            if self.pattern(prefix).search(data) is not None:
+                return self.counted(None)
+        return self.counted(NO_SETTINGS)
+
+    def pattern(self, prefix):
+        pattern = self.patterns.get(prefix)
+        if pattern is None:
+            pattern = re.compile(rb'[<\s]' + re.escape(prefix) + rb':' + self.keys + rb'(?=[\s=>/])')
+            self.patterns[prefix] = pattern
+        return pattern
+
+    def counted(self, reason):
+        prefilterCount.inc(verdict=reason if reason is not None else "convert")
+        return reason
+
+
+# the prefilter for the keys consumed by the converter, or None if every preset has filters anyway
+
+
+def fromConverter(converter):
+    keys = converter.consumedKeys()
+    if keys is None:
+        return None
+    return Prefilter(keys["filters"])
+
+
+# counts of the verdicts so far: { "convert": n, NO_NAMESPACE: n, NO_SETTINGS: n }
+
+
+def summary():
+    counts = { "convert": 0, NO_NAMESPACE: 0, NO_SETTINGS: 0 }
+    counts.update(prefilterCount.snapshot())
+    return counts
+
+
+def describe(counts):
+    return (str(counts[NO_NAMESPACE]) + " without Camera Raw settings, " + str(counts[NO_SETTINGS]) +
+            " with only settings the converter ignores, " + str(counts["convert"]) + " to convert")
+
+
+# ----------------------------
+
+
+def main():
+
+    # parse the command line args
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="the directory containing the XMP files (searched recursively)")
+    parser.add_argument("--list", action="store_true", help="list the rejected files")
+    args = parser.parse_args()
+
+    import convertXMPToJson as converter
+    # the converter is very chatty
+    console = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        prefilter = fromConverter(converter)
+    finally:
+        sys.stdout.close()
+        sys.stdout = console
+    if prefilter is None:
+        print("The converter adds filters to every preset, nothing can be rejected")
+        return
+
+    for root, dirs, files in os.walk(args.input):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".xmp"):
+                path = os.path.join(root, name)
+                with open(path, 'rb') as inf:
+                    reason = prefilter.check(inf.read())
+                if reason is not None and args.list:
+                    print(reason + ": " + path)
+    print("Prefilter: " + describe(summary()))
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
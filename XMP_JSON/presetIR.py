@@ -0,0 +1,223 @@
+#! /usr/bin/python
+
+# Target-neutral description of a converted preset, and the emitters that turn it into the format used by a target.
+#
+# The converter (convertXMPToJson.py) parses the XMP once and records each adjustment as an 'effect':
+#   { "category": <category>, "name": <effect name>, "params": { <param>: <value>, ... } }
+# where category is one of:
+#   scalar     simple per-pixel adjustments (exposure, white balance, contrast, saturation, ...)
+#   toneCurve  tone curves. Curve points are always 0..1 (already fitted/sampled by the converter)
+#   colour     per-colour adjustments (HSV bands, split toning)
+#   spatial    effects that look at neighbouring pixels (sharpening, noise reduction, vignette, grain, ...)
+# Effects are kept in the order in which they should be applied.
+#
+# An emitter is a function emitter(preset) that returns the output (a JSON-able dict) for its target. All the key
+# lookup, range conversion and curve fitting is done once by the converter, emitters only rename/rescale parameters.
+# Emitters are registered by name (registerEmitter), the built in ones are:
+#   coreimage  Core Image filter chain, as used by phixer (the original output format)
+#   gpuimage   GPUImage filter classes and properties
+#   webgl      glfx.js style filter calls
+# Effects that a target cannot render are listed under "unsupported" in its output.
+
+from collections import OrderedDict
+
+
+# effect categories
+SCALAR = "scalar"
+TONE_CURVE = "toneCurve"
+COLOUR = "colour"
+SPATIAL = "spatial"
+
+# names of the colour bands used by the hsv effect, in order
+HSV_BANDS = [ "red", "orange", "yellow", "green", "aqua", "blue", "purple", "magenta" ]
+
+# the registered emitters: name -> function
+emitters = OrderedDict()
+
+
+# ----------------------------
+
+
+def newPreset(key):
+    return { "key": key, "info": {}, "effects": [] }
+
+
+def addEffect(preset, category, name, **params):
+    preset["effects"].append({ "category": category, "name": name, "params": params })
+
+
+# ----------------------------
+
+
+def registerEmitter(name, func):
+    emitters[name] = func
+
+
+def targets():
+    return list(emitters.keys())
+
+
+# generate the output for a target
+
+def emit(preset, target):
+    if target not in emitters:
+        raise ValueError("unknown target: " + target + " (known: " + ", ".join(targets()) + ")")
+    return emitters[target](preset)
+
+
+# ----------------------------
+# Core Image
+
+
+# simple effects: effect name -> (filter, [(param, filter parameter)]). All parameters are scalars
+
+coreImageFilters = { "autoAdjust":        ("AutoAdjustFilter", []),
+                     "whiteBalance":      ("WhiteBalanceFilter", [("temperature", "inputTemperature"), ("tint", "inputTint")]),
+                     "exposure":          ("CIExposureAdjust", [("ev", "inputEV")]),
+                     "contrast":          ("ContrastFilter", [("contrast", "inputContrast")]),
+                     "shadowsHighlights": ("CIHighlightShadowAdjust", [("shadows", "inputShadowAmount"), ("highlights", "inputHighlightAmount")]),
+                     "clarity":           ("ClarityFilter", [("amount", "inputClarity")]),
+                     "vibrance":          ("CIVibrance", [("amount", "inputAmount")]),
+                     "saturation":        ("SaturationFilter", [("saturation", "inputSaturation")]),
+                     "noiseReduction":    ("CINoiseReduction", [("level", "inputNoiseLevel"), ("sharpness", "inputSharpness")]),
+                     "splitToning":       ("SplitToningFilter", [("highlightHue", "inputHighlightHue"), ("highlightSaturation", "inputHighlightSaturation"),
+                                                                 ("shadowHue", "inputShadowHue"), ("shadowSaturation", "inputShadowSaturation")]),
+                     "sharpen":           ("CISharpenLuminance", [("amount", "inputSharpness")]),
+                     "unsharpMask":       ("UnsharpMaskFilter", [("amount", "inputAmount"), ("radius", "inputRadius"), ("threshold", "inputThreshold")]),
+                     "vignette":          ("CenteredVignetteFilter", [("radius", "inputRadius"), ("intensity", "inputIntensity"), ("falloff", "inputFalloff")]),
+                     "grain":             ("FilmGrainFilter", [("amount", "inputAmount"), ("size", "inputSize")]) }
+
+
+def emitCoreImage(preset):
+    filters = []
+    for effect in preset["effects"]:
+        name = effect["name"]
+        params = effect["params"]
+        if name == "toneCurve":
+            parameters = [ { 'key': "inputPoint" + str(i), 'val': point, 'type': "CIAttributeTypeOffset" }
+                           for i, point in enumerate(params["points"]) ]
+            filters.append({ 'key': "CIToneCurve", "parameters": parameters })
+        elif name == "rgbCurves":
+            parameters = []
+            for channel in ["red", "green", "blue"]:
+                x, y = params[channel]
+                label = "input" + channel.capitalize()
+                parameters.append({ 'key': label + "Xvalues", 'val': x, 'type': "CIAttributeTypeVector" })
+                parameters.append({ 'key': label + "Yvalues", 'val': y, 'type': "CIAttributeTypeVector" })
+            filters.append({ 'key': "RGBChannelToneCurve", "parameters": parameters })
+        elif name == "hsv":
+            parameters = [ { 'key': "input" + band.capitalize() + "Shift", 'val': params["bands"][band], 'type': "CIAttributeTypePosition3" }
+                           for band in HSV_BANDS ]
+            filters.append({ 'key': "MultiBandHSV", "parameters": parameters })
+        else:
+            key, names = coreImageFilters[name]
+            parameters = [ { 'key': ciName, 'val': params[param], 'type': "CIAttributeTypeScalar" } for param, ciName in names ]
+            filters.append({ 'key': key, "parameters": parameters })
+
+    return { "key": preset["key"], "info": preset["info"], "filters": filters }
+
+
+# ----------------------------
+# GPUImage
+
+
+def emitGPUImage(preset):
+    filters = []
+    unsupported = []
+
+    def add(name, **properties):
+        filters.append({ "filter": name, "properties": properties })
+
+    for effect in preset["effects"]:
+        name = effect["name"]
+        params = effect["params"]
+        if name == "whiteBalance":
+            add("GPUImageWhiteBalanceFilter", temperature=params["temperature"], tint=params["tint"])
+        elif name == "exposure":
+            add("GPUImageExposureFilter", exposure=params["ev"])
+        elif name == "contrast":
+            add("GPUImageContrastFilter", contrast=params["contrast"])
+        elif name == "shadowsHighlights":
+            # GPUImage can only lighten the shadows
+            add("GPUImageHighlightShadowFilter", shadows=max(0.0, params["shadows"]), highlights=params["highlights"])
+        elif name == "vibrance":
+            add("GPUImageVibranceFilter", vibrance=params["amount"])
+        elif name == "saturation":
+            add("GPUImageSaturationFilter", saturation=params["saturation"])
+        elif name == "toneCurve":
+            add("GPUImageToneCurveFilter", rgbCompositeControlPoints=params["points"])
+        elif name == "rgbCurves":
+            add("GPUImageToneCurveFilter", redControlPoints=curvePoints(params["red"]),
+                greenControlPoints=curvePoints(params["green"]), blueControlPoints=curvePoints(params["blue"]))
+        elif name == "sharpen":
+            add("GPUImageSharpenFilter", sharpness=params["amount"])
+        elif name == "unsharpMask":
+            add("GPUImageUnsharpMaskFilter", blurRadiusInPixels=params["radius"], intensity=params["amount"])
+        elif name == "vignette":
+            # -ve intensity lightens the edges
+            colour = [0.0, 0.0, 0.0] if params["intensity"] >= 0.0 else [1.0, 1.0, 1.0]
+            add("GPUImageVignetteFilter", vignetteColor=colour, vignetteStart=max(0.0, params["radius"] - params["falloff"] / 2.0),
+                vignetteEnd=params["radius"] + params["falloff"] / 2.0)
+        else:
+            unsupported.append(name)
+
+    return { "key": preset["key"], "info": preset["info"], "filters": filters, "unsupported": unsupported }
+
+
+# ----------------------------
+# WebGL (glfx.js)
+
+
+def emitWebGL(preset):
+    filters = []
+    unsupported = []
+
+    def add(name, *args):
+        filters.append({ "name": name, "args": list(args) })
+
+    for effect in preset["effects"]:
+        name = effect["name"]
+        params = effect["params"]
+        if name == "contrast":
+            add("brightnessContrast", 0.0, clamp(params["contrast"] - 1.0, -1.0, 1.0))
+        elif name == "saturation":
+            add("hueSaturation", 0.0, clamp(params["saturation"] - 1.0, -1.0, 1.0))
+        elif name == "vibrance":
+            add("vibrance", clamp(params["amount"], -1.0, 1.0))
+        elif name == "toneCurve":
+            add("curves", params["points"])
+        elif name == "rgbCurves":
+            add("curves", curvePoints(params["red"]), curvePoints(params["green"]), curvePoints(params["blue"]))
+        elif name == "sharpen":
+            add("unsharpMask", 1.0, params["amount"])
+        elif name == "unsharpMask":
+            add("unsharpMask", params["radius"], params["amount"])
+        elif name == "noiseReduction":
+            # denoise exponent: 50 (none) .. 1 (strongest). Level is 0..0.1
+            add("denoise", clamp(50.0 - params["level"] * 490.0, 1.0, 50.0))
+        elif name == "vignette" and params["intensity"] > 0.0:
+            add("vignette", clamp(params["radius"], 0.0, 1.0), clamp(params["intensity"], 0.0, 1.0))
+        elif name == "grain":
+            add("noise", clamp(params["amount"], 0.0, 1.0))
+        else:
+            unsupported.append(name)
+
+    return { "key": preset["key"], "info": preset["info"], "filters": filters, "unsupported": unsupported }
+
+
+# ----------------------------
+
+
+# (x values, y values) -> list of [x, y] points
+
+def curvePoints(curve):
+    return [ [x, y] for x, y in zip(curve[0], curve[1]) ]
+
+
+def clamp(value, minv, maxv):
+    return max(minv, min(maxv, value))
+
+
+registerEmitter("coreimage", emitCoreImage)
+registerEmitter("gpuimage", emitGPUImage)
+registerEmitter("webgl", emitWebGL)
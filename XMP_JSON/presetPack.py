@@ -0,0 +1,458 @@
+#! /usr/bin/python
+
+# Delta-encoded preset packs.
+#
+# The presets of a commercial pack (e.g. the "CREATIVE COLOUR PRESETS" group) are mostly variants of one look: the
+# same filter chain, with a few parameters changed. Stored as separate files, each one repeats the whole chain. A pack
+# file stores the chain once, as the pack's base, and each preset as the difference from it:
+#   { "format": 1, "group": <group>, "base": [ <filters> ],
+#     "presets": [ { "path": <relative path>, "key": ..., "info": ..., "fields": ..., "delta": <delta> }, ... ] }
+# The presets are grouped into packs by info.group ("group" is left out of each preset's info). "fields" holds any other
+# top-level fields of the preset (e.g. "cost", with --cost-budget), as they are. Variants (preview-lite, other targets)
+# are not packed, only the presets themselves (as in costModel.py). A delta has any of:
+#   "remove":  labels of base filters that the preset does not have
+#   "order":   labels of the remaining base filters, if the preset has them in a different order
+#   "add":     [position, filter] for the filters that are not in the base, by their position in the preset's chain
+#   "set":     { label: { parameter: value } } for parameters that differ from the base. For a parameter that the base
+#              filter does not have (or with a different type), the value is the whole { "val": ..., "type": ... }
+#   "unset":   { label: [ parameter, ... ] } for base parameters that the preset leaves out
+#   "replace": { label: [ parameters ] } when the parameters are in a different order
+# or "filters": the whole chain, for a preset that has nothing in common with the base. Filters are identified by
+# label: the filter key, with #n appended for repeated keys (as in goldenCompare.py). "key" is only stored if it
+# differs from the path.
+#
+# The base is either computed (--base consensus: the filters that most of the presets have, with the most common value
+# of each parameter) or one of the presets (--base medoid: the preset that gives the smallest deltas). By default both
+# are tried and the one that gives the smaller pack is used. Presets are stored in canonical form (see canonicalJson.py:
+# floats rounded to --precision decimal places), and every delta is checked to decode to the canonical preset.
+#
+# The decoder (Pack) indexes the base once, then builds each preset from the base and its delta. Filters that the
+# delta does not change are shared with the base, so treat decoded presets as read-only (or copy them).
+#
+# Usage:
+#   python presetPack.py json/ packs/ [--report report.json]     (encode the converted presets below json/)
+#   python presetPack.py --decode packs/<group>.pack.json out/    (write the presets of a pack back as files)
+
+import os, os.path
+import re
+import sys
+import json
+import time
+import gzip
+import argparse
+from collections import Counter, OrderedDict
+
+import atomicWriter
+import canonicalJson
+import costModel
+
+
+FORMAT = 1
+PACK_SUFFIX = ".pack.json"
+
+# the fields of a preset stored apart from "fields" in a pack
+PRESET_FIELDS = ["key", "info", "filters"]
+BASES = ["auto", "consensus", "medoid"]
+
+# max. number of presets tried as the medoid base (a sample, spread over the pack, for large packs)
+maxMedoidCandidates = 64
+
+
+# ----------------------------
+
+
+def main():
+
+    # parse the command line args
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="directory of converted presets (or, with --decode, a pack file)")
+    parser.add_argument("output", help="directory for the pack files (or, with --decode, for the presets)")
+    parser.add_argument("--decode", action="store_true", help="write the presets of a pack file back as separate files")
+    parser.add_argument("--base", choices=BASES, default="auto", help="how the base of each pack is chosen")
+    parser.add_argument("--precision", type=int, default=canonicalJson.defaultPrecision, help="decimal places kept in floats")
+    parser.add_argument("--min-presets", type=int, default=2, help="groups with fewer presets are not packed")
+    parser.add_argument("--report", help="write the size report (JSON) to this file")
+    args = parser.parse_args()
+
+    if args.decode:
+        start = time.time()
+        count = decodeFile(args.input, args.output)
+        print("Decoded " + str(count) + " presets to " + args.output + " in " + ("%.3f" % (time.time() - start)) + "s")
+        return
+
+    groups = loadPresets(args.input)
+    report = []
+    for group, presets in sorted(groups.items()):
+        if len(presets) < args.min_presets:
+            continue
+        pack = encodePack(group, presets, args.base, args.precision)
+        text = canonicalJson.dumps(pack)
+        atomicWriter.writeAtomic(os.path.join(args.output, packName(group)), text)
+        report.append(sizeReport(pack, text, presets, args.precision))
+
+    printReport(report)
+    if args.report:
+        atomicWriter.writeAtomic(args.report, json.dumps(report, indent=2))
+
+
+# the converted presets below a directory, grouped by info.group: group -> list of (relative path, preset, file size)
+
+
+def loadPresets(indir):
+    groups = OrderedDict()
+    for path in costModel.findPresets(indir):
+        try:
+            with open(path, 'r') as inf:
+                text = inf.read()
+            preset = json.loads(text)
+        except (IOError, OSError, ValueError) as e:
+            sys.stderr.write("Skipping " + path + ": " + str(e) + "\n")
+            continue
+        if not isinstance(preset, dict) or "filters" not in preset:
+            continue
+        group = preset.get("info", {}).get("group") or ""
+        rel = os.path.relpath(path, indir).replace(os.sep, "/")
+        groups.setdefault(group, []).append((rel, preset, len(text.encode('utf-8'))))
+    return groups
+
+
+def packName(group):
+    name = re.sub(r'[^A-Za-z0-9._-]+', "-", group).strip("-.")
+    return (name if len(name) > 0 else "ungrouped") + PACK_SUFFIX
+
+
+# ----------------------------
+
+
+# the filters of a chain as a list of labels: the filter key, with #n appended for repeated keys (in order)
+
+
+def labelFilters(filters):
+    labels = []
+    counts = {}
+    for f in filters:
+        key = f.get("key")
+        counts[key] = counts.get(key, 0) + 1
+        labels.append(key if counts[key] == 1 else key + "#" + str(counts[key]))
+    return labels
+
+
+# the delta of a filter chain from the base chain (both in canonical form)
+
+
+def encodeDelta(base, filters):
+    baseLabels = labelFilters(base)
+    baseFilters = dict(zip(baseLabels, base))
+    labels = labelFilters(filters)
+    present = set(labels)
+
+    delta = {}
+    remove = [label for label in baseLabels if label not in present]
+    if len(remove) > 0:
+        delta["remove"] = remove
+    kept = [label for label in labels if label in baseFilters]
+    if kept != [label for label in baseLabels if label in present]:
+        delta["order"] = kept
+    add = [[i, f] for i, (label, f) in enumerate(zip(labels, filters)) if label not in baseFilters]
+    if len(add) > 0:
+        delta["add"] = add
+
+    for label, f in zip(labels, filters):
+        if label in baseFilters:
+            diffParameters(delta, label, baseFilters[label], f)
+    return delta
+
+
+def diffParameters(delta, label, baseFilter, f):
+    if set(baseFilter.keys()) != set(f.keys()) or any(baseFilter[k] != f[k] for k in f if k != "parameters"):
+        # not just a change of parameters (not produced by the converter): replace the whole filter
+        raise ValueError("filter " + label + " differs in more than its parameters")
+    before = OrderedDict((p["key"], p) for p in baseFilter.get("parameters", []))
+    after = OrderedDict((p["key"], p) for p in f.get("parameters", []))
+
+    changed = {}
+    for name, p in after.items():
+        if name not in before or before[name].get("type") != p.get("type"):
+            changed[name] = dict((k, v) for k, v in p.items() if k != "key")
+        elif before[name] != p:
+            changed[name] = p["val"]
+    unset = [name for name in before if name not in after]
+
+    expected = [name for name in before if name in after] + [name for name in after if name not in before]
+    if expected != list(after.keys()):
+        delta.setdefault("replace", {})[label] = f.get("parameters", [])
+        return
+    if len(changed) > 0:
+        delta.setdefault("set", {})[label] = changed
+    if len(unset) > 0:
+        delta.setdefault("unset", {})[label] = unset
+
+
+# ----------------------------
+
+
+# the pack of a group of presets, a list of (relative path, preset, file size) as returned by loadPresets
+
+
+def encodePack(group, presets, base="auto", precision=canonicalJson.defaultPrecision):
+    canonical = [(rel, canonicalJson.canonicalize(preset, precision)) for rel, preset, size in presets]
+    chains = [preset["filters"] for rel, preset in canonical]
+
+    candidates = []
+    if base in ["auto", "consensus"]:
+        candidates.append(consensusBase(chains))
+    if base in ["auto", "medoid"]:
+        candidates.append(medoidBase(chains))
+    best = min(candidates, key=lambda chain: deltaSize(chain, chains))
+
+    entries = []
+    for rel, preset in canonical:
+        entry = OrderedDict()
+        entry["path"] = rel
+        if preset.get("key") != rel:
+            entry["key"] = preset.get("key")
+        info = dict(preset.get("info", {}))
+        if info.get("group") == group:
+            del info["group"]
+        entry["info"] = info
+        fields = OrderedDict((k, v) for k, v in preset.items() if k not in PRESET_FIELDS)
+        if len(fields) > 0:
+            entry["fields"] = fields
+        entry["delta"] = checkedDelta(best, preset["filters"])
+        entries.append(entry)
+
+    return OrderedDict([("format", FORMAT), ("group", group), ("base", best), ("presets", entries)])
+
+
+# the delta, checked to decode to the chain. Falls back to storing the whole chain
+
+
+def checkedDelta(base, filters):
+    try:
+        delta = encodeDelta(base, filters)
+    except ValueError:
+        return { "filters": filters }
+    if applyDelta(base, labelFilters(base), delta) != filters:
+        return { "filters": filters }
+    if len(canonicalJson.dumps(delta)) >= len(canonicalJson.dumps(filters)):
+        return { "filters": filters }
+    return delta
+
+
+# total size of the deltas of the chains from a base, plus the base itself
+
+
+def deltaSize(base, chains):
+    total = len(canonicalJson.dumps(base))
+    for filters in chains:
+        try:
+            total += len(canonicalJson.dumps(encodeDelta(base, filters)))
+        except ValueError:
+            total += len(canonicalJson.dumps(filters))
+    return total
+
+
+# the base computed from the chains: the filters that more than half of the chains have, in their average position,
+# with the parameters that more than half of those filters have, each with its most common value and type
+
+
+def consensusBase(chains):
+    counts = Counter()
+    positions = {}
+    instances = {}
+    for filters in chains:
+        for i, (label, f) in enumerate(zip(labelFilters(filters), filters)):
+            counts[label] += 1
+            positions.setdefault(label, []).append(i)
+            instances.setdefault(label, []).append(f)
+
+    majority = len(chains) / 2.0
+    labels = [label for label in counts if counts[label] > majority]
+    labels.sort(key=lambda label: sum(positions[label]) / float(len(positions[label])))
+
+    base = []
+    for label in labels:
+        filters = instances[label]
+        values = {}
+        order = {}
+        for f in filters:
+            for i, p in enumerate(f.get("parameters", [])):
+                values.setdefault(p["key"], Counter())[canonicalJson.dumps(p)] += 1
+                order.setdefault(p["key"], []).append(i)
+        parameters = []
+        for name in sorted(values, key=lambda name: sum(order[name]) / float(len(order[name]))):
+            if sum(values[name].values()) > len(filters) / 2.0:
+                parameters.append(json.loads(values[name].most_common(1)[0][0]))
+        f = dict((k, v) for k, v in filters[0].items() if k != "parameters")
+        f["parameters"] = parameters
+        base.append(f)
+    return base
+
+
+# the chain (of a sample of the chains) that gives the smallest deltas
+
+
+def medoidBase(chains):
+    step = max(1, len(chains) // maxMedoidCandidates)
+    candidates = chains[::step][:maxMedoidCandidates]
+    return min(candidates, key=lambda chain: deltaSize(chain, chains))
+
+
+# ----------------------------
+
+
+# a filter chain from the base (and its labels) and a delta
+
+
+def applyDelta(base, baseLabels, delta):
+    if "filters" in delta:
+        return delta["filters"]
+    baseFilters = dict(zip(baseLabels, base))
+    order = delta.get("order")
+    if order is None:
+        removed = delta.get("remove", [])
+        order = [label for label in baseLabels if label not in removed] if len(removed) > 0 else baseLabels
+
+    changes = set(delta.get("set", {})) | set(delta.get("unset", {})) | set(delta.get("replace", {}))
+    chain = [patchFilter(baseFilters[label], label, delta) if label in changes else baseFilters[label] for label in order]
+    for position, f in delta.get("add", []):
+        chain.insert(position, f)
+    return chain
+
+
+def patchFilter(baseFilter, label, delta):
+    f = dict(baseFilter)
+    if label in delta.get("replace", {}):
+        f["parameters"] = delta["replace"][label]
+        return f
+    unset = delta.get("unset", {}).get(label, [])
+    changed = delta.get("set", {}).get(label, {})
+    parameters = []
+    for p in baseFilter.get("parameters", []):
+        name = p["key"]
+        if name in unset:
+            continue
+        if name in changed:
+            value = changed[name]
+            p = patchParameter(p, name, value)
+        parameters.append(p)
+    existing = set(p["key"] for p in baseFilter.get("parameters", []))
+    for name, value in changed.items():
+        if name not in existing:
+            parameters.append(patchParameter(None, name, value))
+    f["parameters"] = parameters
+    return f
+
+
+def patchParameter(p, name, value):
+    if isinstance(value, dict):
+        # the whole parameter
+        new = { "key": name }
+        new.update(value)
+        return new
+    new = dict(p)
+    new["val"] = value
+    return new
+
+
+class Pack(object):
+    '''
+        Decoder of a pack: the base is indexed once, presets are built from it and their deltas on demand
+    '''
+
+    def __init__(self, data):
+        if data.get("format") != FORMAT:
+            raise ValueError("unsupported pack format: " + str(data.get("format")))
+        self.group = data.get("group", "")
+        self.base = data["base"]
+        self.labels = labelFilters(self.base)
+        self.entries = OrderedDict((entry["path"], entry) for entry in data["presets"])
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as inf:
+            return cls(json.load(inf))
+
+    def paths(self):
+        return list(self.entries.keys())
+
+    # the preset (key, info, filters and any other fields) stored at a path
+
+    def preset(self, path):
+        entry = self.entries[path]
+        info = dict(entry.get("info", {}))
+        if len(self.group) > 0:
+            info["group"] = self.group
+        preset = { "key": entry.get("key", path), "info": info,
+                   "filters": applyDelta(self.base, self.labels, entry["delta"]) }
+        preset.update(entry.get("fields", {}))
+        return preset
+
+    def presets(self):
+        for path in self.entries:
+            yield path, self.preset(path)
+
+
+# write the presets of a pack file below outdir (canonical form). Returns the number of presets
+
+
+def decodeFile(path, outdir):
+    pack = Pack.load(path)
+    count = 0
+    for rel, preset in pack.presets():
+        atomicWriter.writeAtomic(os.path.join(outdir, *rel.split("/")), canonicalJson.dumps(preset), sync=False)
+        count += 1
+    return count
+
+
+# ----------------------------
+
+
+# sizes (bytes) of a group as separate files (as read, and in canonical form) and as a pack, uncompressed and gzipped
+# (as served for download), and the time to decode all of its presets
+
+
+def sizeReport(pack, text, presets, precision=canonicalJson.defaultPrecision):
+    canonical = [canonicalJson.formatPreset(preset, precision) for rel, preset, size in presets]
+    start = time.time()
+    decoder = Pack(json.loads(text))
+    for rel, preset in decoder.presets():
+        pass
+    decodeTime = time.time() - start
+    return { "group": pack["group"], "presets": len(presets),
+             "full": sum(1 for preset in pack["presets"] if "filters" in preset["delta"]),
+             "files": sum(size for rel, preset, size in presets),
+             "canonical": sum(len(t.encode('utf-8')) for t in canonical),
+             "pack": len(text.encode('utf-8')),
+             "filesGzip": sum(gzipSize(t) for t in canonical),
+             "packGzip": gzipSize(text),
+             "decodeSeconds": decodeTime }
+
+
+def gzipSize(text):
+    return len(gzip.compress(text.encode('utf-8'), 9))
+
+
+def printReport(report):
+    print("%-32s %7s %10s %10s %10s %8s %12s %10s %8s %10s" % ("group", "presets", "files", "canonical", "pack", "saved",
+                                                               "files(gz)", "pack(gz)", "saved", "decode/ps"))
+    for r in report:
+        print("%-32s %7d %10d %10d %10d %7.1f%% %12d %10d %7.1f%% %8.1fus" % (
+            r["group"][:32], r["presets"], r["files"], r["canonical"], r["pack"], saving(r["files"], r["pack"]),
+            r["filesGzip"], r["packGzip"], saving(r["filesGzip"], r["packGzip"]), 1e6 * r["decodeSeconds"] / max(1, r["presets"])))
+    if len(report) > 1:
+        files = sum(r["files"] for r in report)
+        pack = sum(r["pack"] for r in report)
+        print("Total: " + str(files) + " bytes as files, " + str(pack) + " bytes as packs (" + ("%.1f" % saving(files, pack)) + "% saved)")
+
+
+def saving(before, after):
+    return 100.0 * (before - after) / before if before > 0 else 0.0
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#! /usr/bin/python
+
+# The tone curve and colour band state that several conversion stages build on, held in numpy arrays.
+#
+#   curve    5x2 array of (input, output) points, 0..100. Starts as a linear curve
+#   colours  8x3 array of (hue shift, saturation multiplier, value multiplier), one row per colour band (see BANDS).
+#            Starts as the no-op values [0, 1, 1]
+# Each array has a matching boolean mask of the elements changed from the starting values, so consumers (e.g. a LUT
+# builder) can tell which points/bands are actually in use without comparing floats.
+#
+# A state is created (or copied, or reset) per conversion. Stages update it with whole-array (vectorised) operations through
+# the set*/add* methods, which keep the masks up to date.
+
+import numpy as np
+
+import presetIR
+
+
+# colour band names, in row order
+BANDS = presetIR.HSV_BANDS
+
+LINEAR_CURVE = np.array([ [0.0, 0.0], [25.0, 25.0], [50.0, 50.0], [75.0, 75.0], [100.0, 100.0] ])
+
+# 'no-op' values - 0 degree hue shift and 1x multipliers for saturation and value
+NOOP_COLOUR = np.array([0.0, 1.0, 1.0])
+NOOP_COLOURS = np.tile(NOOP_COLOUR, (len(BANDS), 1))
+
+
+# ----------------------------
+
+
+class PresetState(object):
+    '''
+        Tone curve and colour band state of a conversion.
+        curveChanged/coloursChanged mark that the tone curve/HSV filters should be added to the preset, mono that
+        the preset should be converted to greyscale
+    '''
+
+    def __init__(self):
+        self.curve = LINEAR_CURVE.copy()
+        self.curveMask = np.zeros(self.curve.shape, dtype=bool)
+        self.curveChanged = False
+        self.colours = NOOP_COLOURS.copy()
+        self.colourMask = np.zeros(self.colours.shape, dtype=bool)
+        self.coloursChanged = False
+        self.mono = False
+
+    def copy(self):
+        other = PresetState.__new__(PresetState)
+        other.curve = self.curve.copy()
+        other.curveMask = self.curveMask.copy()
+        other.curveChanged = self.curveChanged
+        other.colours = self.colours.copy()
+        other.colourMask = self.colourMask.copy()
+        other.coloursChanged = self.coloursChanged
+        other.mono = self.mono
+        return other
+
+    # back to the starting values, reusing the arrays
+
+    def reset(self):
+        self.curve[...] = LINEAR_CURVE
+        self.curveMask[...] = False
+        self.curveChanged = False
+        self.colours[...] = NOOP_COLOURS
+        self.colourMask[...] = False
+        self.coloursChanged = False
+        self.mono = False
+
+    # ----------------------------
+
+    # set curve values. index selects the points (int, list or slice), column is 0 (input) or 1 (output), or None
+    # for both
+
+    def setCurve(self, values, index=slice(None), column=slice(None)):
+        if column is None:
+            column = slice(None)
+        self.curve[index, column] = values
+        self.curveMask = self.curve != LINEAR_CURVE
+
+    # ----------------------------
+
+    # add values (scalar, or one per selected band) to a column (0: hue, 1: saturation, 2: value) of the bands
+    # selected by rows (default: all)
+
+    def addColours(self, column, values, rows=slice(None)):
+        self.colours[rows, column] += values
+        self.colourMask = self.colours != NOOP_COLOURS
+
+    # reset the selected bands (boolean array or indices) to the no-op values
+
+    def resetColours(self, rows):
+        self.colours[rows] = NOOP_COLOUR
+        self.colourMask = self.colours != NOOP_COLOURS
+
+    # ----------------------------
+
+    # the curve as a list of [input, output] points, scaled to 0..1
+
+    def curvePoints(self):
+        return (self.curve / 100.0).tolist()
+
+    # the colour bands as a dict: band name -> [hue shift, saturation, value]
+
+    def bands(self):
+        return dict(zip(BANDS, self.colours.tolist()))
+
+    def bandIndex(self, name):
+        return BANDS.index(name)
@@ -0,0 +1,272 @@
+#! /usr/bin/python
+
+# CPU (numpy) renderer for converted presets, to preview what a preset looks like without the app.
+#
+# The filter chain of a converted (coreimage) preset is turned into a render plan once, then applied to the image
+# tile by tile, so that the temporary arrays stay small however large the image is. Runs of per-pixel colour filters
+# use the same steps as the generated GPU kernels (see shaderGen.py). Supported filters:
+#   CIExposureAdjust, WhiteBalanceFilter, ContrastFilter, SaturationFilter, CIVibrance, CIHighlightShadowAdjust,
+#   CIToneCurve, RGBChannelToneCurve, MultiBandHSV, SplitToningFilter, CenteredVignetteFilter, FilmGrainFilter
+# Contrast, vibrance, shadows/highlights, vignette and grain are approximations of the app's filters. The other
+# (mostly neighbourhood) filters, e.g. sharpening and noise reduction, are skipped and listed in the output.
+#
+# Usage:
+#   python previewRender.py <preset JSON> <image> <output image>
+#   python previewRender.py <directory of JSON presets> <image> <output directory>
+# The second form renders a thumbnail of the image for every preset (in parallel) and saves them as contact sheets,
+# along with an index (sheets.json) of which preset is in which cell.
+
+import os, os.path
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import shaderGen
+import atomicWriter
+import costModel
+import sharding
+
+
+# default tile size (pixels) used when rendering
+tileSize = 512
+
+LUMA = np.array(shaderGen.LUMA, dtype=np.float32)
+
+
+# ----------------------------
+
+
+def main():
+
+    # parse the command line args
+    parser = argparse.ArgumentParser()
+    parser.add_argument("preset", help="a converted JSON preset, or a directory of presets (searched recursively) for contact sheets")
+    parser.add_argument("image", help="the image to render")
+    parser.add_argument("output", help="the output image, or the output directory for contact sheets")
+    parser.add_argument("--tile", type=int, default=tileSize, help="tile size (pixels)")
+    parser.add_argument("--size", type=int, default=256, help="contact sheets: size of each thumbnail (pixels)")
+    parser.add_argument("--columns", type=int, default=8, help="contact sheets: thumbnails per row")
+    parser.add_argument("--rows", type=int, default=8, help="contact sheets: rows per sheet")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="contact sheets: number of worker processes")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.preset):
+        thumb = loadImage(args.image, args.size)
+        sheets = renderContactSheets(findPresets(args.preset), thumb, args.output, args.columns, args.rows, args.workers)
+        print("Saved " + str(len(sheets)) + " contact sheets to: " + args.output)
+    else:
+        with open(args.preset, 'r') as inf:
+            preset = json.load(inf)
+        image = loadImage(args.image)
+        plan, skipped = renderPlan(preset["filters"])
+        renderImage(plan, image, args.tile)
+        saveImage(image, args.output)
+        if len(skipped) > 0:
+            print("Skipped (not supported): " + ", ".join(skipped))
+        print("Saved to: " + args.output)
+
+
+# ----------------------------
+
+
+# load an image as a float32 RGB array (0..1). If size is set, the image is scaled down to fit in size x size
+
+
+def loadImage(path, size=None):
+    img = Image.open(path).convert("RGB")
+    if size is not None:
+        img.thumbnail((size, size))
+    return np.asarray(img, dtype=np.float32) / 255.0
+
+
+def toImage(image):
+    return Image.fromarray((np.clip(image, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8), "RGB")
+
+
+def saveImage(image, path):
+    directory = os.path.dirname(path)
+    if len(directory) > 0:
+        atomicWriter.mkdir_p(directory)
+    toImage(image).save(path)
+
+
+# ----------------------------
+
+
+# turn a filter chain into a list of render operations (name, arguments). Returns (plan, list of skipped filters)
+
+
+def renderPlan(filters):
+    plan = []
+    skipped = []
+    for kind, run in shaderGen.splitPasses(filters):
+        if kind == "fused":
+            plan.append(("steps", shaderGen.kernelSteps(run)))
+            continue
+
+        f = run[0]
+        params = shaderGen.getParameters(f)
+        key = f["key"]
+        if key == "ContrastFilter":
+            plan.append(("contrast", params["inputContrast"]))
+        elif key == "CIVibrance":
+            plan.append(("vibrance", params["inputAmount"]))
+        elif key == "CIHighlightShadowAdjust":
+            plan.append(("shadowsHighlights", params["inputShadowAmount"], params["inputHighlightAmount"]))
+        elif key == "CenteredVignetteFilter":
+            plan.append(("vignette", params["inputRadius"], params["inputIntensity"], params["inputFalloff"]))
+        elif key == "FilmGrainFilter":
+            plan.append(("grain", params["inputAmount"], params["inputSize"]))
+        else:
+            skipped.append(key)
+    return plan, skipped
+
+
+# render the plan onto the image (HxWx3 float32 array, modified in place), one tile at a time
+
+
+def renderImage(plan, image, tile=tileSize):
+    height, width = image.shape[:2]
+    for y in range(0, height, tile):
+        for x in range(0, width, tile):
+            view = image[y:y+tile, x:x+tile]
+            view[...] = renderTile(plan, view, x, y, width, height)
+    return image
+
+
+# render a tile. (x, y) is the position of the tile in the full (width x height) image, used by the spatial effects
+
+
+def renderTile(plan, tile, x, y, width, height):
+    c = tile.astype(np.float32)
+    for op in plan:
+        name = op[0]
+        if name == "steps":
+            c = shaderGen.referenceApply(op[1], c).astype(np.float32)
+        elif name == "contrast":
+            c = (c - 0.5) * op[1] + 0.5
+        elif name == "vibrance":
+            # boost (or cut) the saturation of the less saturated colours the most
+            l = np.dot(c, LUMA)[..., np.newaxis]
+            s = (np.max(c, axis=-1) - np.min(c, axis=-1))[..., np.newaxis]
+            c = l + (c - l) * (1.0 + op[1] * (1.0 - np.clip(s, 0.0, 1.0)))
+        elif name == "shadowsHighlights":
+            shadows, highlights = op[1], op[2]
+            l = np.clip(np.dot(c, LUMA), 0.0, 1.0)[..., np.newaxis]
+            c = c + shadows * 0.25 * (1.0 - l) * (1.0 - l)
+            c = c * (1.0 - (1.0 - highlights) * 0.5 * l * l)
+        elif name == "vignette":
+            c = c * vignetteMask(c.shape, x, y, width, height, op[1], op[2], op[3])
+        elif name == "grain":
+            c = c + grainNoise(c.shape, x, y, op[2])[..., np.newaxis] * (op[1] * 0.2)
+    return np.clip(c, 0.0, 1.0)
+
+
+# brightness multiplier for each pixel of the tile. Distance is measured from the image centre (1.0 at the corners)
+
+
+def vignetteMask(shape, x, y, width, height, radius, intensity, falloff):
+    ys = (np.arange(y, y + shape[0], dtype=np.float32) + 0.5 - height / 2.0) / (height / 2.0)
+    xs = (np.arange(x, x + shape[1], dtype=np.float32) + 0.5 - width / 2.0) / (width / 2.0)
+    d = np.sqrt(ys[:, np.newaxis] ** 2 + xs[np.newaxis, :] ** 2) / np.sqrt(2.0)
+    edge = max(falloff, 0.01)
+    t = np.clip((d - radius) / edge, 0.0, 1.0)
+    t = t * t * (3.0 - 2.0 * t)
+    return (1.0 - intensity * t)[..., np.newaxis]
+
+
+# grain noise (-1..+1) for each pixel of the tile. The noise only depends on the pixel position, so tiles join up
+# and renders are repeatable. Larger sizes give coarser grain
+
+
+def grainNoise(shape, x, y, size):
+    cell = 1 + int(size * 3.0)
+    ys = (np.arange(y, y + shape[0], dtype=np.uint32) // cell)[:, np.newaxis]
+    xs = (np.arange(x, x + shape[1], dtype=np.uint32) // cell)[np.newaxis, :]
+    h = xs * np.uint32(374761393) + ys * np.uint32(668265263)
+    h = (h ^ (h >> np.uint32(13))) * np.uint32(1274126177)
+    h = h ^ (h >> np.uint32(16))
+    return (h & np.uint32(0xffff)).astype(np.float32) / 32767.5 - 1.0
+
+
+# ----------------------------
+
+
+# find the JSON presets below a directory: not their variants (preview-lite, other targets, packs), nor the manifests of
+# a sharded batch
+
+
+def findPresets(directory):
+    return [path for path in costModel.findPresets(directory) if os.path.basename(path) not in sharding.SHARD_FILES]
+
+
+# render a thumbnail for a preset file. Returns (preset file, thumbnail array or None, error message or None)
+
+
+def renderThumbnail(args):
+    path, thumb = args
+    try:
+        with open(path, 'r') as inf:
+            preset = json.load(inf)
+        plan, skipped = renderPlan(preset["filters"])
+        return (path, renderImage(plan, thumb.copy()), None)
+    except Exception as e:
+        return (path, None, str(e))
+
+
+# render all the presets onto the thumbnail, in parallel, and save them as contact sheets (columns x rows thumbnails,
+# labelled with the preset file name). Returns the list of sheets written
+
+
+def renderContactSheets(presets, thumb, outdir, columns=8, rows=8, workers=None):
+    h, w = thumb.shape[:2]
+    label = 14
+    perSheet = columns * rows
+    sheets = []
+    index = []
+    sheet = None
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # results come back in order, so the sheets are the same however many workers are used
+        work = ((path, thumb) for path in presets)
+        for n, (path, result, error) in enumerate(pool.map(renderThumbnail, work, chunksize=8)):
+            cell = n % perSheet
+            if cell == 0:
+                if sheet is not None:
+                    sheets.append(saveSheet(sheet, outdir, len(sheets)))
+                sheet = Image.new("RGB", (columns * w, rows * (h + label)), (32, 32, 32))
+                draw = ImageDraw.Draw(sheet)
+            left = (cell % columns) * w
+            top = (cell // columns) * (h + label)
+            name = os.path.splitext(os.path.basename(path))[0]
+            if result is not None:
+                sheet.paste(toImage(result), (left, top))
+            else:
+                print("ERROR: " + path + ": " + error)
+                name = "ERROR " + name
+            draw.text((left + 2, top + h + 1), name[:w // 6], fill=(220, 220, 220))
+            index.append({ "preset": path, "sheet": len(sheets), "column": cell % columns, "row": cell // columns,
+                           "error": error })
+
+    if sheet is not None:
+        sheets.append(saveSheet(sheet, outdir, len(sheets)))
+    atomicWriter.writeAtomic(os.path.join(outdir, "sheets.json"), json.dumps(index, indent=1))
+    return sheets
+
+
+def saveSheet(sheet, outdir, n):
+    atomicWriter.mkdir_p(outdir)
+    path = os.path.join(outdir, "sheet-%03d.png" % n)
+    sheet.save(path)
+    return path
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+#! /usr/bin/python
+
+# Cost-aware ordering of batch conversions across a pool of worker processes (batchConvert.py --processes N).
+#
+# With the inputs converted in the order they are found (FIFO), a few expensive presets (long ToneCurvePV2012* sequences,
+# huge sidecars) that happen to come late start last and hold up the end of the batch while the other workers sit idle.
+# Dispatching the most expensive inputs first (longest processing time first) leaves the cheap ones to fill the gaps at
+# the end, which keeps the workers busy until close to the end.
+#
+# The cost of an input is estimated before it is dispatched, cheaply: from the file size and counts of the curve points
+# (rdf:li items) and Camera Raw keys found by a byte scan of the start of the file (at most PREFIX_BYTES, scaled up to
+# the size), no parsing. The weights are rough timings (ms) of the converter. Workers take the next input from the
+# ordered queue as soon as they are free, so each worker gets work one item at a time rather than in fixed chunks: a
+# conversion takes milliseconds, so the per-item overhead is small and the load is balanced as evenly as possible.
+#
+# The inputs are ordered a window at a time (WindowedOrder), as they are found, so that a large batch is neither held
+# in memory nor listed in full before the first conversion. Within the last window, which decides the end of the
+# batch, the most expensive inputs still go first.
+#
+# Timeline records when each worker was busy, for the report: makespan (first start to last finish) and the idle
+# time of each worker, to compare the orders.
+
+import os
+import threading
+
+
+ORDERS = ["fifo", "largest-first"]
+
+# cost model (ms): fixed cost per file, plus per MB, per curve point and per Camera Raw key
+COST_FIXED = 1.5
+COST_PER_MB = 4.0
+COST_PER_POINT = 0.0025
+COST_PER_KEY = 0.002
+
+# bytes of a file scanned for the estimate
+PREFIX_BYTES = 65536
+
+# number of inputs ordered together
+defaultWindow = 1000
+
+
+# ----------------------------
+
+
+# estimated cost (ms) of converting a file. Unreadable files get the fixed cost (they fail quickly)
+
+
+def estimateCost(path):
+    try:
+        with open(path, 'rb') as inf:
+            size = os.fstat(inf.fileno()).st_size
+            data = inf.read(PREFIX_BYTES)
+    except (IOError, OSError):
+        return COST_FIXED
+    return costOf(data, size)
+
+
+# estimated cost (ms) of converting data: the whole input, or the first part of an input of the given size
+
+
+def costOf(data, size=None):
+    if size is None:
+        size = len(data)
+    scale = float(size) / len(data) if len(data) > 0 else 0.0
+    return (COST_FIXED + COST_PER_MB * size / 1048576.0 +
+            scale * (COST_PER_POINT * data.count(b"<rdf:li") + COST_PER_KEY * data.count(b"crs:")))
+
+
+# order the (input file, output file) pairs, with their estimated costs, for dispatch. Returns the list of items
+
+
+def orderItems(items, costs, order="largest-first"):
+    if order == "largest-first":
+        # stable: inputs of equal cost stay in the order they were found
+        ranked = sorted(range(len(items)), key=lambda i: -costs[i])
+        return [items[i] for i in ranked]
+    return list(items)
+
+
+# estimated makespan (ms) of running the costs, in order, on a number of workers that each take the next item when
+# they are free. Used to compare orders before running the batch
+
+
+def simulate(costs, workers):
+    free = [0.0] * max(1, workers)
+    assign(free, costs)
+    return max(free)
+
+
+# adds the costs, in order, to the workers' finishing times (free)
+
+
+def assign(free, costs):
+    for cost in costs:
+        i = free.index(min(free))
+        free[i] += cost
+
+
+class WindowedOrder(object):
+    '''
+        Orders a stream of items for dispatch, window items at a time. cost(item) estimates the cost of an item.
+        estimates holds the estimated makespan (ms) of each order for the items so far
+    '''
+
+    def __init__(self, order, workers, cost, window=defaultWindow):
+        self.order = order
+        self.cost = cost
+        self.window = max(1, window)
+        self.free = dict((o, [0.0] * max(1, workers)) for o in ORDERS)
+        self.estimates = dict((o, 0.0) for o in ORDERS)
+
+    def items(self, items):
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= self.window:
+                for ordered in self.orderBatch(batch):
+                    yield ordered
+                batch = []
+        for ordered in self.orderBatch(batch):
+            yield ordered
+
+    def orderBatch(self, batch):
+        costs = [self.cost(item) for item in batch]
+        assign(self.free["fifo"], costs)
+        assign(self.free["largest-first"], sorted(costs, reverse=True))
+        for o in ORDERS:
+            self.estimates[o] = max(self.free[o])
+        return orderItems(batch, costs, self.order)
+
+
+# ----------------------------
+
+
+class Timeline(object):
+    '''
+        Records the busy periods of each worker (by worker slot: a replacement worker takes over the slot of the one
+        it replaced) and reports the makespan and the idle time of each worker
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.busy = {}  # worker -> list of (start, end)
+
+    def record(self, worker, start, end):
+        with self.lock:
+            self.busy.setdefault(worker, []).append((start, end))
+
+    def report(self):
+        with self.lock:
+            busy = dict((worker, list(periods)) for worker, periods in self.busy.items())
+        if len(busy) == 0:
+            return { "makespan": 0.0, "workers": [] }
+        start = min(s for periods in busy.values() for s, e in periods)
+        end = max(e for periods in busy.values() for s, e in periods)
+        makespan = end - start
+        workers = []
+        for worker, periods in sorted(busy.items()):
+            total = sum(e - s for s, e in periods)
+            finished = max(e for s, e in periods)
+            workers.append({ "worker": worker, "items": len(periods), "busy": total, "idle": makespan - total,
+                             # idle time at the end, waiting for the other workers to finish
+                             "tail": end - finished })
+        return { "makespan": makespan, "workers": workers }
+
+
+def printReport(report, order, out=None):
+    lines = []
+    totalIdle = sum(w["idle"] for w in report["workers"])
+    lines.append("Schedule: " + order + "  Makespan: " + ("%.3f" % report["makespan"]) + "s  Idle: " + ("%.3f" % totalIdle) +
+                 "s over " + str(len(report["workers"])) + " workers")
+    lines.append("%-10s %8s %10s %10s %10s" % ("worker", "items", "busy(s)", "idle(s)", "tail(s)"))
+    for w in report["workers"]:
+        lines.append("%-10s %8d %10.3f %10.3f %10.3f" % (w["worker"], w["items"], w["busy"], w["idle"], w["tail"]))
+    text = "\n".join(lines)
+    if out is None:
+        print(text)
+    else:
+        out.write(text + "\n")
@@ -0,0 +1,472 @@
+#! /usr/bin/python
+
+# Script to generate a fused GPU kernel from a converted (JSON) preset.
+#
+# Each entry in the "filters" list normally becomes a separate Core Image pass on the device. Most of the colour
+# filters are purely per-pixel though, so a run of them can be done in a single pass. This script finds the runs of
+# per-pixel filters in the chain (order is preserved - filters are never moved across a spatial filter such as
+# sharpening or grain) and generates one kernel for each run, with the preset's parameters baked in as constants:
+#   CIExposureAdjust, WhiteBalanceFilter, SaturationFilter, CIToneCurve, RGBChannelToneCurve, MultiBandHSV,
+#   SplitToningFilter
+# Output is either GLSL (ES 3.0) fragment shaders, one per kernel (with --output, <name>.presetKernel<n>.<ext> if there is
+# more than one), or a Metal file with all the Core Image kernels. The constants of each kernel are named after it.
+#
+# The filter parameters are first turned into a list of simple 'steps' (e.g. the white balance and exposure become an
+# RGB multiplier, curves become 256 entry lookup tables). Both the code generators and the numpy reference
+# implementation (referenceApply) work from the same steps, so the reference can be used to check the output of the
+# generated kernel, e.g. by rendering the colour cube from --expected on the device and comparing.
+#
+# Usage: python shaderGen.py <preset JSON> [--target glsl|metal] [--output file] [--expected file]
+
+import os.path
+import json
+import argparse
+import math
+
+import numpy as np
+from scipy.interpolate import PchipInterpolator
+
+
+# the per-pixel filters that can be fused
+FUSABLE_FILTERS = [ "CIExposureAdjust", "WhiteBalanceFilter", "SaturationFilter", "CIToneCurve", "RGBChannelToneCurve",
+                    "MultiBandHSV", "SplitToningFilter" ]
+
+# Rec. 709 luminance weights
+LUMA = [0.2126, 0.7152, 0.0722]
+
+# MultiBandHSV bands: parameter name and band centre (hue, 0..1)
+HSV_BANDS = [ ("inputRedShift", 0.0), ("inputOrangeShift", 30.0/360.0), ("inputYellowShift", 60.0/360.0),
+              ("inputGreenShift", 120.0/360.0), ("inputAquaShift", 180.0/360.0), ("inputBlueShift", 240.0/360.0),
+              ("inputPurpleShift", 270.0/360.0), ("inputMagentaShift", 300.0/360.0) ]
+
+# number of entries in the curve lookup tables
+LUT_SIZE = 256
+
+
+# ----------------------------
+
+
+def main():
+
+    # parse the command line args
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="the name of the input (converted) JSON preset")
+    parser.add_argument("--target", choices=["glsl", "metal"], default="metal", help="the kernel language to generate")
+    parser.add_argument("--output", help="write the kernel source to this file (default: print it)")
+    parser.add_argument("--expected", help="write the reference output for a 17x17x17 colour cube to this (JSON) file")
+    args = parser.parse_args()
+
+    with open(args.input, 'r') as inf:
+        preset = json.load(inf)
+
+    passes = splitPasses(preset["filters"])
+    kernels = []
+    expected = []
+    for kind, filters in passes:
+        if kind == "fused":
+            name = "presetKernel" + str(len(kernels))
+            steps = kernelSteps(filters)
+            kernels.append(kernelCode(steps, name, args.target, [f["key"] for f in filters]))
+            expected.append({ "kernel": name, "output": referenceChart(steps).tolist() })
+            print("Pass: " + name + " (fused: " + ", ".join(f["key"] for f in filters) + ")")
+        else:
+            print("Pass: " + filters[0]["key"])
+
+    # all the Metal kernels go in one file, each GLSL kernel is a shader of its own
+    if args.target == "metal" or len(kernels) < 2:
+        sources = [(args.output, generateSource(kernels, args.target))] if len(kernels) > 0 else []
+    else:
+        sources = [(kernelFile(args.output, kernel["name"]), generateSource([kernel], args.target)) for kernel in kernels]
+    for path, source in sources:
+        if path is not None:
+            with open(path, 'w') as outf:
+                outf.write(source)
+            print("\nSaved to: " + path)
+        else:
+            print("\n" + source)
+
+    if args.expected is not None:
+        with open(args.expected, 'w') as outf:
+            json.dump({ "input": referenceCube().tolist(), "kernels": expected }, outf)
+
+
+# the file for one of several kernels: <output name>.<kernel name><extension>, e.g. preset.presetKernel1.frag
+
+
+def kernelFile(output, name):
+    if output is None:
+        return None
+    root, ext = os.path.splitext(output)
+    return root + "." + name + ext
+
+
+# ----------------------------
+
+
+# split a filter chain into passes: ("fused", [filters]) for each run of fusable filters, ("filter", [filter]) otherwise
+
+
+def splitPasses(filters):
+    passes = []
+    run = []
+    for f in filters:
+        if f["key"] in FUSABLE_FILTERS:
+            run.append(f)
+        else:
+            if len(run) > 0:
+                passes.append(("fused", run))
+                run = []
+            passes.append(("filter", [f]))
+    if len(run) > 0:
+        passes.append(("fused", run))
+    return passes
+
+
+def getParameters(f):
+    return dict((p["key"], p["val"]) for p in f["parameters"])
+
+
+# ----------------------------
+
+
+# turn a list of (fusable) filters into kernel steps. Consecutive RGB multipliers are folded into one
+
+
+def kernelSteps(filters):
+    steps = []
+    for f in filters:
+        params = getParameters(f)
+        key = f["key"]
+
+        if key == "CIExposureAdjust":
+            k = math.pow(2.0, params["inputEV"])
+            step = { "op": "multiply", "k": [k, k, k] }
+        elif key == "WhiteBalanceFilter":
+            step = { "op": "multiply", "k": whiteBalanceMultiplier(params["inputTemperature"], params["inputTint"]) }
+        elif key == "SaturationFilter":
+            step = { "op": "saturation", "s": params["inputSaturation"] }
+        elif key == "CIToneCurve":
+            points = [params["inputPoint" + str(i)] for i in range(5)]
+            step = { "op": "curve", "lut": curveLUT([p[0] for p in points], [p[1] for p in points]) }
+        elif key == "RGBChannelToneCurve":
+            step = { "op": "rgbCurves", "luts": [ curveLUT(params["inputRedXvalues"], params["inputRedYvalues"]),
+                                                  curveLUT(params["inputGreenXvalues"], params["inputGreenYvalues"]),
+                                                  curveLUT(params["inputBlueXvalues"], params["inputBlueYvalues"]) ] }
+        elif key == "MultiBandHSV":
+            step = { "op": "hsvBands", "shifts": [list(params[name]) for name, centre in HSV_BANDS] }
+        elif key == "SplitToningFilter":
+            step = { "op": "splitToning",
+                     "shadow": toningChroma(params["inputShadowHue"]), "shadowAmount": params["inputShadowSaturation"],
+                     "highlight": toningChroma(params["inputHighlightHue"]), "highlightAmount": params["inputHighlightSaturation"] }
+        else:
+            raise ValueError("filter cannot be fused: " + key)
+
+        if step["op"] == "multiply" and len(steps) > 0 and steps[-1]["op"] == "multiply":
+            steps[-1]["k"] = [a * b for a, b in zip(steps[-1]["k"], step["k"])]
+        else:
+            steps.append(step)
+    return steps
+
+
+# builds a lookup table (LUT_SIZE entries, 0..1) for a curve through the supplied points (monotone cubic interpolation)
+
+
+def curveLUT(xs, ys):
+    unique = {}
+    for x, y in zip(xs, ys):
+        unique[float(x)] = float(y)
+    x = sorted(unique.keys())
+    y = [unique[v] for v in x]
+    grid = np.linspace(0.0, 1.0, LUT_SIZE)
+    if len(x) < 2:
+        lut = grid
+    elif len(x) == 2:
+        lut = np.interp(grid, x, y)
+    else:
+        # flat outside the defined range, like the Core Image curve
+        lut = PchipInterpolator(x, y, extrapolate=False)(np.clip(grid, x[0], x[-1]))
+    return [float(v) for v in np.clip(lut, 0.0, 1.0)]
+
+
+# RGB multiplier for a white balance setting (temperature in K, tint -100..+100), normalised to keep the luminance.
+# Uses an approximation of the black body colour (Tanner Helland), relative to 6500K
+
+
+def whiteBalanceMultiplier(temperature, tint):
+    source = blackBody(temperature)
+    target = blackBody(6500.0)
+    k = [t / s for t, s in zip(target, source)]
+    k[1] = k[1] * (1.0 - tint / 250.0) # +ve tint is magenta
+    luma = sum(w * v for w, v in zip(LUMA, k))
+    return [v / luma for v in k]
+
+
+def blackBody(temperature):
+    t = min(max(temperature, 1000.0), 40000.0) / 100.0
+    if t <= 66.0:
+        r = 255.0
+        g = 99.4708025861 * math.log(t) - 161.1195681661
+    else:
+        r = 329.698727446 * math.pow(t - 60.0, -0.1332047592)
+        g = 288.1221695283 * math.pow(t - 60.0, -0.0755148492)
+    if t >= 66.0:
+        b = 255.0
+    elif t <= 19.0:
+        b = 0.0
+    else:
+        b = 138.5177312231 * math.log(t - 10.0) - 305.0447927307
+    return [min(max(v, 1.0), 255.0) / 255.0 for v in (r, g, b)]
+
+
+# the chroma (colour minus its luminance) of a fully saturated hue (-1..+1 of the full circle). Adding it to a pixel
+# tints the pixel without changing its luminance
+
+
+def toningChroma(hue):
+    rgb = hsvToRGB(np.array([[hue % 1.0, 1.0, 1.0]]))[0]
+    luma = float(np.dot(rgb, LUMA))
+    return [float(v) - luma for v in rgb]
+
+
+# ----------------------------
+
+
+# generate the source file for a list of steps (one kernel). target is "glsl" or "metal"
+
+
+def generateKernel(steps, name, target, filterNames=None):
+    return generateSource([kernelCode(steps, name, target, filterNames)], target)
+
+
+# the code of one kernel, to be put in a source file by generateSource: { "name", "filters", "decls" (its constants and
+# functions, named after the kernel), "helpers" (the shared functions it uses), "body" (statements operating on 'c', a
+# vec3 of 0..1 RGB) }
+
+
+def kernelCode(steps, name, target, filterNames=None):
+    v3 = "float3" if target == "metal" else "vec3"
+
+    decls = []
+    body = []
+    helpers = set()
+    lutCount = [0]
+
+    def lut(values):
+        index = lutCount[0]
+        lutCount[0] += 1
+        table = name + "_LUT" + str(index)
+        items = ", ".join(fmt(v) for v in values)
+        if target == "metal":
+            decls.append("constant float " + table + "[" + str(LUT_SIZE) + "] = { " + items + " };")
+        else:
+            decls.append("const float " + table + "[" + str(LUT_SIZE) + "] = float[" + str(LUT_SIZE) + "](" + items + ");")
+        fn = name + "_lut" + str(index)
+        decls.append("float " + fn + "(float x) {\n"
+                     "    float p = clamp(x, 0.0, 1.0) * " + fmt(LUT_SIZE - 1) + ";\n"
+                     "    int i = int(min(floor(p), " + fmt(LUT_SIZE - 2) + "));\n"
+                     "    return mix(" + table + "[i], " + table + "[i + 1], p - float(i));\n"
+                     "}")
+        return fn
+
+    def vec(values):
+        return v3 + "(" + ", ".join(fmt(v) for v in values) + ")"
+
+    for step in steps:
+        op = step["op"]
+        if op == "multiply":
+            body.append("c = c * " + vec(step["k"]) + ";")
+        elif op == "saturation":
+            body.append("c = mix(" + v3 + "(dot(c, " + vec(LUMA) + ")), c, " + fmt(step["s"]) + ");")
+        elif op == "curve":
+            fn = lut(step["lut"])
+            body.append("c = " + v3 + "(" + fn + "(c.r), " + fn + "(c.g), " + fn + "(c.b));")
+        elif op == "rgbCurves":
+            fns = [lut(values) for values in step["luts"]]
+            body.append("c = " + v3 + "(" + fns[0] + "(c.r), " + fns[1] + "(c.g), " + fns[2] + "(c.b));")
+        elif op == "hsvBands":
+            helpers.add("hsv")
+            body.append("{")
+            body.append("    " + v3 + " hsv = rgb2hsv(clamp(c, 0.0, 1.0));")
+            body.append("    " + v3 + " shift = " + vec([0.0, 0.0, 0.0]) + ";")
+            # blend the shifts of the 2 bands either side of the hue
+            for i in range(len(HSV_BANDS)):
+                c0 = HSV_BANDS[i][1]
+                c1 = HSV_BANDS[i+1][1] if (i+1) < len(HSV_BANDS) else 1.0
+                s0 = step["shifts"][i]
+                s1 = step["shifts"][(i+1) % len(HSV_BANDS)]
+                body.append("    shift += (step(" + fmt(c0) + ", hsv.x) - step(" + fmt(c1) + ", hsv.x)) * mix(" + vec(s0) + ", " + vec(s1) +
+                            ", (hsv.x - " + fmt(c0) + ") * " + fmt(1.0 / (c1 - c0)) + ");")
+            # greys have no hue, so fade the adjustment out as saturation drops
+            body.append("    shift = mix(" + vec([0.0, 1.0, 1.0]) + ", shift, hsv.y);")
+            body.append("    hsv = " + v3 + "(fract(hsv.x + shift.x), clamp(hsv.y * shift.y, 0.0, 1.0), hsv.z * shift.z);")
+            body.append("    c = hsv2rgb(hsv);")
+            body.append("}")
+        elif op == "splitToning":
+            body.append("{")
+            body.append("    float l = clamp(dot(c, " + vec(LUMA) + "), 0.0, 1.0);")
+            body.append("    c = c + " + vec(step["shadow"]) + " * ((1.0 - l) * " + fmt(step["shadowAmount"]) + ") + " +
+                        vec(step["highlight"]) + " * (l * " + fmt(step["highlightAmount"]) + ");")
+            body.append("}")
+
+    return { "name": name, "filters": filterNames, "decls": decls, "helpers": helpers, "body": body }
+
+
+# the source file for kernels (from kernelCode). The shared helpers are declared once. A GLSL fragment shader has a
+# single entry point (main), so it holds one kernel: generate a shader for each pass
+
+
+def generateSource(kernels, target):
+    if target != "metal" and len(kernels) != 1:
+        raise ValueError("a GLSL shader holds exactly one kernel, not " + str(len(kernels)))
+    v3, v4 = ("float3", "float4") if target == "metal" else ("vec3", "vec4")
+    helpers = set()
+    for kernel in kernels:
+        helpers.update(kernel["helpers"])
+
+    lines = ["// Generated by shaderGen.py"]
+    if target == "metal":
+        lines += [ "#include <metal_stdlib>", "#include <CoreImage/CoreImage.h>", "using namespace metal;", "" ]
+    else:
+        lines += [ "#version 300 es", "precision highp float;", "", "uniform sampler2D inputImage;", "in vec2 texCoord;",
+                   "out vec4 fragColor;", "" ]
+    if "hsv" in helpers:
+        lines.append(hsvHelpers(v3, v4) + "\n")
+
+    for kernel in kernels:
+        comment = "// " + kernel["name"]
+        if kernel["filters"] is not None:
+            comment += ". Fused filters: " + ", ".join(kernel["filters"])
+        lines.append(comment)
+        lines += [d + "\n" for d in kernel["decls"]]
+        if target == "metal":
+            lines.append("extern \"C\" float4 " + kernel["name"] + "(coreimage::sample_t s) {")
+            lines.append("    float3 c = s.rgb;")
+            lines += ["    " + b for b in kernel["body"]]
+            lines.append("    return float4(c, s.a);")
+        else:
+            lines.append("void main() {")
+            lines.append("    vec4 px = texture(inputImage, texCoord);")
+            lines.append("    vec3 c = px.rgb;")
+            lines += ["    " + b for b in kernel["body"]]
+            lines.append("    fragColor = vec4(c, px.a);")
+        lines.append("}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+# branchless RGB <-> HSV conversions (all components 0..1)
+
+
+def hsvHelpers(v3, v4):
+    return ("" + v3 + " rgb2hsv(" + v3 + " c) {\n"
+            "    " + v4 + " K = " + v4 + "(0.0, -1.0 / 3.0, 2.0 / 3.0, -1.0);\n"
+            "    " + v4 + " p = mix(" + v4 + "(c.bg, K.wz), " + v4 + "(c.gb, K.xy), step(c.b, c.g));\n"
+            "    " + v4 + " q = mix(" + v4 + "(p.xyw, c.r), " + v4 + "(c.r, p.yzx), step(p.x, c.r));\n"
+            "    float d = q.x - min(q.w, q.y);\n"
+            "    float e = 1.0e-10;\n"
+            "    return " + v3 + "(abs(q.z + (q.w - q.y) / (6.0 * d + e)), d / (q.x + e), q.x);\n"
+            "}\n\n"
+            "" + v3 + " hsv2rgb(" + v3 + " c) {\n"
+            "    " + v4 + " K = " + v4 + "(1.0, 2.0 / 3.0, 1.0 / 3.0, 3.0);\n"
+            "    " + v3 + " p = abs(fract(c.xxx + K.xyz) * 6.0 - K.www);\n"
+            "    return c.z * mix(K.xxx, clamp(p - K.xxx, 0.0, 1.0), c.y);\n"
+            "}")
+
+
+# format a float literal that is valid in GLSL and Metal (always has a decimal point)
+
+
+def fmt(value):
+    text = "%.8f" % float(value)
+    text = text.rstrip("0")
+    if text.endswith("."):
+        text += "0"
+    return text
+
+
+# ----------------------------
+
+
+# numpy reference implementation of the kernel steps. rgb is an array of shape (..., 3), values 0..1
+
+
+def referenceApply(steps, rgb):
+    c = np.array(rgb, dtype=np.float64)
+    grid = np.linspace(0.0, 1.0, LUT_SIZE)
+    for step in steps:
+        op = step["op"]
+        if op == "multiply":
+            c = c * np.array(step["k"])
+        elif op == "saturation":
+            l = np.dot(c, LUMA)[..., np.newaxis]
+            c = l + (c - l) * step["s"]
+        elif op == "curve":
+            c = np.interp(np.clip(c, 0.0, 1.0), grid, step["lut"])
+        elif op == "rgbCurves":
+            c = np.stack([np.interp(np.clip(c[..., i], 0.0, 1.0), grid, step["luts"][i]) for i in range(3)], axis=-1)
+        elif op == "hsvBands":
+            hsv = rgbToHSV(np.clip(c, 0.0, 1.0))
+            shift = bandShift(hsv[..., 0], np.array(step["shifts"]))
+            weight = hsv[..., 1:2]
+            shift = np.array([0.0, 1.0, 1.0]) * (1.0 - weight) + shift * weight
+            hsv = np.stack([np.mod(hsv[..., 0] + shift[..., 0], 1.0),
+                            np.clip(hsv[..., 1] * shift[..., 1], 0.0, 1.0),
+                            hsv[..., 2] * shift[..., 2]], axis=-1)
+            c = hsvToRGB(hsv)
+        elif op == "splitToning":
+            l = np.clip(np.dot(c, LUMA), 0.0, 1.0)[..., np.newaxis]
+            c = (c + np.array(step["shadow"]) * ((1.0 - l) * step["shadowAmount"]) +
+                 np.array(step["highlight"]) * (l * step["highlightAmount"]))
+    return c
+
+
+# interpolated band shift for each hue (0..1)
+
+
+def bandShift(hue, shifts):
+    centres = np.array([centre for name, centre in HSV_BANDS] + [1.0])
+    index = np.clip(np.searchsorted(centres, hue, side='right') - 1, 0, len(HSV_BANDS) - 1)
+    t = ((hue - centres[index]) / (centres[index + 1] - centres[index]))[..., np.newaxis]
+    return shifts[index] * (1.0 - t) + shifts[(index + 1) % len(HSV_BANDS)] * t
+
+
+def rgbToHSV(rgb):
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    v = np.max(rgb, axis=-1)
+    d = v - np.min(rgb, axis=-1)
+    s = np.where(v > 0.0, d / np.where(v > 0.0, v, 1.0), 0.0)
+    dd = np.where(d > 0.0, d, 1.0)
+    h = np.where(v == r, (g - b) / dd, np.where(v == g, 2.0 + (b - r) / dd, 4.0 + (r - g) / dd))
+    h = np.where(d > 0.0, np.mod(h / 6.0, 1.0), 0.0)
+    return np.stack([h, s, v], axis=-1)
+
+
+def hsvToRGB(hsv):
+    h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    k = np.stack([np.mod(5.0 + h * 6.0, 6.0), np.mod(3.0 + h * 6.0, 6.0), np.mod(1.0 + h * 6.0, 6.0)], axis=-1)
+    f = np.clip(np.minimum(k, 4.0 - k), 0.0, 1.0)
+    return v[..., np.newaxis] * (1.0 - s[..., np.newaxis] * f)
+
+
+# ----------------------------
+
+
+# the colour cube used to check a kernel (RGB values 0..1), and the expected output for it
+
+
+def referenceCube(size=17):
+    axis = np.linspace(0.0, 1.0, size)
+    r, g, b = np.meshgrid(axis, axis, axis, indexing='ij')
+    return np.stack([r, g, b], axis=-1).reshape(-1, 3)
+
+
+def referenceChart(steps, size=17):
+    return referenceApply(steps, referenceCube(size))
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#! /usr/bin/python
+
+# Deterministic sharding of batch conversions across several processes/machines, and merging of the shard outputs.
+#
+# batchConvert.py --shard i/N converts the inputs that hash to shard i (0 <= i < N) into <output>/shard-i-of-N/.
+# The hash is either of the file content (default - identical presets always land in the same shard, but every shard
+# reads every file) or of the path relative to the input directory (cheaper on network storage, as only the selected
+# files are read). Either way the assignment does not depend on the machine, mount point or listing order.
+#
+# Each shard writes a manifest (manifest.json) when it finishes. mergeShards.py combines the shard outputs into one
+# tree and checks the manifests for gaps (missing shards, failed inputs, inputs not assigned to any shard) and for
+# duplicates (the same input converted by more than one shard). Inputs that the prefilter skipped (--prefilter skip)
+# are listed apart, as finished without an output.
+
+import os, os.path
+import errno
+import json
+import hashlib
+import shutil
+
+import atomicWriter
+import canonicalJson
+import costModel
+
+
+MANIFEST_NAME = "manifest.json"
+
+# names in the shard directories that are not conversion outputs
+SHARD_FILES = [ MANIFEST_NAME, ".batch-journal.jsonl" ]
+
+
+# ----------------------------
+
+
+# parse a shard specification "i/N". Returns (i, N)
+
+
+def parseShard(spec):
+    try:
+        index, count = [int(v) for v in spec.split("/")]
+    except ValueError:
+        raise ValueError("invalid shard '" + spec + "', expected i/N")
+    if count < 1 or index < 0 or index >= count:
+        raise ValueError("invalid shard '" + spec + "', need 0 <= i < N")
+    return index, count
+
+
+def shardDirectory(outdir, index, count):
+    return os.path.join(outdir, "shard-" + str(index) + "-of-" + str(count))
+
+
+# the shard that a (hex) hash belongs to
+
+
+def shardOf(hexHash, count):
+    return int(hexHash[:16], 16) % count
+
+
+def pathHash(infile, indir):
+    # relative, with '/' separators, so that it is the same on every machine
+    rel = os.path.relpath(infile, indir).replace(os.sep, "/")
+    return hashlib.sha1(rel.encode('utf-8')).hexdigest()
+
+
+# ----------------------------
+
+
+# write the manifest of a shard, built from its journal (which only holds the inputs assigned to the shard).
+# inputs is the total number of inputs seen by the shard, used by the merge to check that nothing was missed.
+# quarantined are the inputs that crashed or hung the shard's workers (listed apart from the failed ones), filtered the
+# inputs skipped by the prefilter (no output)
+
+
+def writeManifest(shardDir, index, count, key, indir, inputs, journal, quarantined=()):
+    converted = {}
+    filtered = []
+    failed = []
+    quarantined = set(os.path.relpath(infile, indir).replace(os.sep, "/") for infile in quarantined)
+    for infile, entry in journal.entries.items():
+        rel = os.path.relpath(infile, indir).replace(os.sep, "/")
+        if entry["status"] == "done":
+            converted[rel] = entry.get("hash")
+        elif entry["status"] == "filtered":
+            filtered.append(rel)
+        elif rel not in quarantined:
+            failed.append(rel)
+
+    manifest = { "shard": index, "shards": count, "key": key, "inputs": inputs,
+                 "converted": converted, "filtered": sorted(filtered), "failed": sorted(failed),
+                 "quarantined": sorted(quarantined - set(converted)) }
+    atomicWriter.writeAtomic(os.path.join(shardDir, MANIFEST_NAME), json.dumps(manifest, indent=1, sort_keys=True))
+    return manifest
+
+
+# ----------------------------
+
+
+# check the shard manifests in outdir and merge the shard outputs into mergedir (moved, or copied if copy is set).
+# Returns a report (dict) listing any problems found
+
+
+def mergeShards(outdir, mergedir, copy=False):
+    report = { "shards": 0, "merged": 0, "filtered": [], "missingShards": [], "failed": [], "quarantined": [],
+               "duplicates": [], "missingOutputs": [], "unassigned": 0, "errors": [] }
+
+    manifests = {}
+    count = None
+    for name in sorted(os.listdir(outdir)):
+        path = os.path.join(outdir, name, MANIFEST_NAME)
+        if name.startswith("shard-") and os.path.isfile(path):
+            with open(path, 'r') as inf:
+                manifest = json.load(inf)
+            if count is None:
+                count = manifest["shards"]
+                key = manifest["key"]
+            elif manifest["shards"] != count or manifest["key"] != key:
+                report["errors"].append(name + ": shard settings do not match the other shards")
+                continue
+            manifests[manifest["shard"]] = (os.path.join(outdir, name), manifest)
+
+    if count is None:
+        report["errors"].append("no shard manifests found in " + outdir)
+        return report
+
+    report["shards"] = len(manifests)
+    report["missingShards"] = [i for i in range(count) if i not in manifests]
+
+    # every shard lists the same inputs, so the number of inputs should agree, and add up to the assigned inputs
+    totals = set(m["inputs"] for d, m in manifests.values())
+    if len(totals) > 1:
+        report["errors"].append("shards saw different numbers of inputs: " + str(sorted(totals)))
+    if len(report["missingShards"]) == 0 and len(totals) == 1:
+        assigned = sum(len(m["converted"]) + len(m.get("filtered", [])) + len(m["failed"]) + len(m.get("quarantined", []))
+                       for d, m in manifests.values())
+        report["unassigned"] = max(0, totals.pop() - assigned)
+
+    owner = {}
+    for index in sorted(manifests.keys()):
+        shardDir, manifest = manifests[index]
+        for rel in manifest["failed"]:
+            report["failed"].append(rel)
+        for rel in manifest.get("quarantined", []):
+            report["quarantined"].append(rel)
+        for rel in manifest.get("filtered", []):
+            report["filtered"].append(rel)
+        for rel in sorted(manifest["converted"].keys()):
+            if rel in owner:
+                report["duplicates"].append((rel, owner[rel], index))
+                continue
+            owner[rel] = index
+            out = os.path.splitext(rel)[0] + ".json"
+            src = os.path.join(shardDir, out)
+            if not os.path.isfile(src):
+                # already moved by an earlier (interrupted) merge, or lost
+                if not os.path.isfile(os.path.join(mergedir, out)):
+                    report["missingOutputs"].append(rel)
+                continue
+            # the preview-lite variant and the ETag files (canonical output) go first, so the preset is never without them
+            lite = costModel.liteFile(out)
+            if os.path.isfile(os.path.join(shardDir, lite)):
+                if os.path.isfile(canonicalJson.hashFile(os.path.join(shardDir, lite))):
+                    mergeFile(canonicalJson.hashFile(os.path.join(shardDir, lite)), canonicalJson.hashFile(os.path.join(mergedir, lite)), copy)
+                mergeFile(os.path.join(shardDir, lite), os.path.join(mergedir, lite), copy)
+            if os.path.isfile(canonicalJson.hashFile(src)):
+                mergeFile(canonicalJson.hashFile(src), canonicalJson.hashFile(os.path.join(mergedir, out)), copy)
+            mergeFile(src, os.path.join(mergedir, out), copy)
+            report["merged"] += 1
+
+    return report
+
+
+def mergeFile(src, dst, copy):
+    directory = os.path.dirname(dst)
+    if len(directory) > 0:
+        atomicWriter.mkdir_p(directory)
+    if not copy:
+        try:
+            os.replace(src, dst)
+            return
+        except OSError as exc:
+            # different file systems, fall back to copying
+            if exc.errno != errno.EXDEV:
+                raise
+    tmp = atomicWriter.tempName(dst, 0)
+    shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+
+
+# True if the merge report shows any gaps or duplicates
+
+
+def hasProblems(report):
+    return (len(report["missingShards"]) > 0 or len(report["failed"]) > 0 or len(report["quarantined"]) > 0 or
+            len(report["duplicates"]) > 0 or
+            len(report["missingOutputs"]) > 0 or report["unassigned"] > 0 or len(report["errors"]) > 0)
@@ -0,0 +1,189 @@
+#! /usr/bin/python
+
+# Soak run of the converter: converts a large number of synthetic presets in one process and checks that
+#   - memory stays flat: the resident set size (RSS) after the warm-up may not grow by more than --max-growth MB
+#   - every conversion is isolated: at intervals, the current preset is converted again straight after a different
+#     ('poison') preset, and the output must be identical to the first conversion
+#
+# The synthetic presets are variations of a template XMP (default: XMP/sample.xmp): numeric settings get random
+# values, a random subset of them is zeroed, the tone curves get random points (or are left out) and the greyscale
+# flag is set at random, so consecutive presets use different stages. Generation is seeded, so runs are repeatable.
+#
+# Usage: python soakConvert.py [--count 1000000] [--lifecycle fresh|pooled] [--template XMP/sample.xmp]
+# Exits with 1 if memory grew or an output depended on the previous preset.
+
+import os, os.path
+import re
+import sys
+import time
+import random
+import argparse
+
+import convertXMPToJson as converter
+import metrics
+
+
+NUMBER_ATTRIBUTE = re.compile(r'(crs:[A-Za-z0-9]+)="([+-]?[0-9]+(?:\.[0-9]+)?)"')
+CURVE = re.compile(r'(<crs:(ToneCurve[A-Za-z0-9]*)>\s*<rdf:Seq>)(.*?)(</rdf:Seq>\s*</crs:\2>)', re.DOTALL)
+GRAYSCALE = re.compile(r'crs:ConvertToGrayscale="(True|False)"')
+
+# settings that are not adjustments, left as they are
+FIXED_KEYS = [ "crs:Version", "crs:ProcessVersion", "crs:ToneCurveName", "crs:ToneCurveName2012" ]
+
+
+# ----------------------------
+
+
+def main():
+
+    # parse the command line args
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=1000000, help="number of presets to convert")
+    parser.add_argument("--lifecycle", choices=["fresh", "pooled"], default=converter.lifecycle,
+                        help="create new metadata/state objects for each preset, or reset and reuse them")
+    parser.add_argument("--template", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "XMP", "sample.xmp"),
+                        help="the XMP file that the synthetic presets are based on")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the synthetic presets")
+    parser.add_argument("--warmup", type=int, default=2000, help="conversions before the baseline RSS is taken")
+    parser.add_argument("--max-growth", type=float, default=16.0, help="max. growth (MB) of the RSS after the warm-up")
+    parser.add_argument("--check-every", type=int, default=1000, help="check isolation every N conversions")
+    parser.add_argument("--report-every", type=int, default=10000, help="print progress every N conversions")
+    args = parser.parse_args()
+
+    converter.lifecycle = args.lifecycle
+    with open(args.template, 'r') as inf:
+        template = inf.read()
+
+    result = soak(template, args.count, args.seed, args.warmup, args.check_every, args.report_every)
+
+    growth = (result["finalRSS"] - result["baselineRSS"]) / 1048576.0
+    peakGrowth = (result["peakRSS"] - result["baselineRSS"]) / 1048576.0
+    print("Converted " + str(result["count"]) + " presets in " + ("%.1f" % result["elapsed"]) + "s (" +
+          ("%.0f" % (result["count"] / max(result["elapsed"], 1e-9))) + "/s), lifecycle: " + args.lifecycle)
+    print("RSS: baseline " + mb(result["baselineRSS"]) + ", peak " + mb(result["peakRSS"]) + " (+" + ("%.1f" % peakGrowth) +
+          " MB), final " + mb(result["finalRSS"]) + " (+" + ("%.1f" % growth) + " MB)")
+    print("Isolation checks: " + str(result["checks"]) + ", failed: " + str(len(result["leaks"])))
+    for n in result["leaks"][:10]:
+        print("LEAK: output of preset " + str(n) + " depends on the previous preset")
+    for n, e in result["errors"][:10]:
+        print("ERROR: preset " + str(n) + ": " + e)
+
+    failed = False
+    if peakGrowth > args.max_growth:
+        print("FAIL: RSS grew by " + ("%.1f" % peakGrowth) + " MB after the warm-up (max. " + str(args.max_growth) + " MB)")
+        failed = True
+    if len(result["leaks"]) > 0 or len(result["errors"]) > 0:
+        print("FAIL: " + str(len(result["leaks"])) + " isolation failures, " + str(len(result["errors"])) + " errors")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+def mb(value):
+    return ("%.1f" % (value / 1048576.0)) + " MB"
+
+
+# ----------------------------
+
+
+# a synthetic preset: the template with random settings
+
+
+def synthesize(template, rng):
+
+    def number(match):
+        key, value = match.group(1), match.group(2)
+        if key in FIXED_KEYS:
+            return match.group(0)
+        if rng.random() < 0.5:
+            return key + '="0"'
+        v = float(value)
+        if abs(v) > 100.0:
+            # e.g. Temperature
+            new = int(v * rng.uniform(0.5, 2.0))
+        elif "." in value:
+            new = round(rng.uniform(-2.0, 2.0), 2)
+        else:
+            new = rng.randint(-100, 100)
+        return key + '="' + ("+" + str(new) if new > 0 else str(new)) + '"'
+
+    def curve(match):
+        if rng.random() < 0.3:
+            return ""
+        n = rng.randint(2, 8)
+        xs = sorted(set([0, 255] + [rng.randint(1, 254) for i in range(n - 2)]))
+        ys = sorted(rng.randint(0, 255) for x in xs)
+        items = "".join("\n     <rdf:li>" + str(x) + ", " + str(y) + "</rdf:li>" for x, y in zip(xs, ys))
+        return match.group(1) + items + "\n    " + match.group(4)
+
+    text = NUMBER_ATTRIBUTE.sub(number, template)
+    text = CURVE.sub(curve, text)
+    return GRAYSCALE.sub('crs:ConvertToGrayscale="' + ("True" if rng.random() < 0.2 else "False") + '"', text)
+
+
+def convert(data, n):
+    return converter.convertPresetData(data, "soak-" + str(n) + ".xmp", "soak-" + str(n) + ".json")
+
+
+# ----------------------------
+
+
+# run the soak. Returns the results: counts, RSS (baseline after the warm-up, peak, final), isolation failures, errors
+
+
+def soak(template, count, seed=1, warmup=2000, checkEvery=1000, reportEvery=10000):
+    rng = random.Random(seed)
+    # the 'poison' preset converted before each isolation check, with every setting changed
+    poisonRng = random.Random(seed + 1)
+    poison = synthesize(template, poisonRng).replace('crs:ConvertToGrayscale="False"', 'crs:ConvertToGrayscale="True"').encode('utf-8')
+
+    result = { "count": 0, "checks": 0, "leaks": [], "errors": [], "baselineRSS": None, "peakRSS": 0, "finalRSS": 0 }
+    console = sys.stdout
+    start = time.time()
+    # the converter is very chatty
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        for n in range(count):
+            data = synthesize(template, rng).encode('utf-8')
+            try:
+                preset = convert(data, n)
+            except Exception as e:
+                result["errors"].append((n, str(e)))
+                preset = None
+
+            if preset is not None and checkEvery > 0 and n % checkEvery == 0:
+                convert(poison, -1)
+                result["checks"] += 1
+                if convert(data, n) != preset:
+                    result["leaks"].append(n)
+
+            result["count"] = n + 1
+            # (also if the conversion failed, so that a failure at the end of the warm-up doesn't lose the baseline)
+            if result["baselineRSS"] is None and n + 1 >= min(warmup, count):
+                result["baselineRSS"] = metrics.residentMemory()
+            if (n + 1) % 100 == 0 and n + 1 > warmup:
+                result["peakRSS"] = max(result["peakRSS"], metrics.residentMemory())
+            if reportEvery > 0 and (n + 1) % reportEvery == 0:
+                console.write(str(n + 1) + " converted, " + ("%.0f" % ((n + 1) / (time.time() - start))) + "/s, RSS " +
+                              mb(metrics.residentMemory()) + "\n")
+                console.flush()
+    finally:
+        sys.stdout.close()
+        sys.stdout = console
+
+    result["elapsed"] = time.time() - start
+    result["finalRSS"] = metrics.residentMemory()
+    if result["baselineRSS"] is None:
+        # nothing converted
+        result["baselineRSS"] = result["finalRSS"]
+    result["peakRSS"] = max(result["peakRSS"], result["finalRSS"], result["baselineRSS"])
+    return result
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
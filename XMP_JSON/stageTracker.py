@@ -0,0 +1,152 @@
+#! /usr/bin/python
+
+# Dependency tracking for the conversion stages (the process*/add* functions of convertXMPToJson.py), used to only
+# reconvert the presets affected by a change to the converter.
+#
+# - KeyRecorder wraps the parsed XMP and records which crs keys each stage read (keys that are not in the preset are
+#   not recorded), and which stages added effects to the preset. A stage that did neither made no difference to the
+#   preset, so a change to that stage does not affect it.
+# - functionVersion() gives the version of a stage: a hash of its code, including the constants and module level
+#   settings it uses (e.g. hueWidth) and the helper functions it calls. Tweaking a mapping therefore changes the
+#   version without anyone having to remember to bump a number. Comments and formatting do not.
+#   classVersion() does the same for the methods of a class (e.g. the preset state), valueVersion() for settings.
+#
+# The batch journal stores the versions of the stages that affected each preset, see batchConvert.py
+
+import hashlib
+import json
+import types
+
+
+# ----------------------------
+
+
+class KeyRecorder(object):
+    '''
+        Wraps an XMPMeta (or xmpStream.StreamedXMP) object and records the keys read by the current stage.
+        Set stage to the name of the stage before running it
+    '''
+
+    def __init__(self, xmp):
+        self.xmp = xmp
+        self.stage = None
+        self.keys = {}        # stage -> set of keys read
+        self.emitted = set()  # stages that added effects
+
+    def record(self, key):
+        self.keys.setdefault(self.stage, set()).add(key)
+
+    def does_property_exist(self, ns, key):
+        found = self.xmp.does_property_exist(ns, key)
+        if found:
+            self.record(key)
+        return found
+
+    def get_property(self, ns, key):
+        self.record(key)
+        return self.xmp.get_property(ns, key)
+
+    def get_property_float(self, ns, key):
+        self.record(key)
+        return self.xmp.get_property_float(ns, key)
+
+    def get_property_bool(self, ns, key):
+        self.record(key)
+        return self.xmp.get_property_bool(ns, key)
+
+    def get_localized_text(self, ns, key, genericLang, specificLang):
+        self.record(key)
+        return self.xmp.get_localized_text(ns, key, genericLang, specificLang)
+
+    def count_array_items(self, ns, key):
+        count = self.xmp.count_array_items(ns, key)
+        if count > 0:
+            self.record(key)
+        return count
+
+    def get_array_item(self, ns, key, index):
+        self.record(key)
+        return self.xmp.get_array_item(ns, key, index)
+
+    # the stages that made a difference to the preset
+    def usedStages(self):
+        return set(self.keys.keys()) | self.emitted
+
+
+class KeyProbe(KeyRecorder):
+    '''
+        KeyRecorder that records every key the current stage looks for, whether it exists or not. Run over empty
+        metadata, it gives the keys that the stages consume (see prefilter.py)
+    '''
+
+    def does_property_exist(self, ns, key):
+        self.record(key)
+        return self.xmp.does_property_exist(ns, key)
+
+    def count_array_items(self, ns, key):
+        self.record(key)
+        return self.xmp.count_array_items(ns, key)
+
+
+# ----------------------------
+
+
+# version (hex hash) of a function. namespace is the module globals, exclude lists the (per preset) state variables,
+# whose values are not part of the version
+
+
+def functionVersion(func, namespace, exclude=()):
+    h = hashlib.sha1()
+    addCode(h, func.__code__, namespace, set(exclude), set([func.__name__]))
+    return h.hexdigest()[:16]
+
+
+def addCode(h, code, namespace, exclude, seen):
+    h.update(code.co_code)
+    h.update(repr((code.co_names, code.co_varnames)).encode('utf-8'))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            # nested function, comprehension etc.
+            addCode(h, const, namespace, exclude, seen)
+        elif isinstance(const, frozenset):
+            # e.g. 'x in {...}', the order depends on the (randomised) string hashes
+            h.update(repr(sorted(const, key=repr)).encode('utf-8'))
+        else:
+            h.update(repr(const).encode('utf-8'))
+
+    for name in code.co_names:
+        if name in exclude or name in seen or name not in namespace:
+            continue
+        value = namespace[name]
+        if isinstance(value, types.FunctionType):
+            # a helper from the same module
+            if value.__module__ == namespace.get("__name__"):
+                seen.add(name)
+                addCode(h, value.__code__, namespace, exclude, seen)
+        elif isinstance(value, (bool, int, float, str, list, tuple, dict)):
+            seen.add(name)
+            h.update((name + "=" + json.dumps(value, sort_keys=True, default=repr)).encode('utf-8'))
+        elif hasattr(value, "tolist") and not callable(value):
+            # numpy arrays
+            seen.add(name)
+            h.update((name + "=" + json.dumps(value.tolist())).encode('utf-8'))
+
+
+# version (hex hash) of a class: the code of its methods, with the constants and helpers they use from namespace
+
+
+def classVersion(cls, namespace, exclude=()):
+    h = hashlib.sha1()
+    seen = set()
+    for name, value in sorted(vars(cls).items()):
+        if isinstance(value, types.FunctionType):
+            h.update(name.encode('utf-8'))
+            addCode(h, value.__code__, namespace, set(exclude), seen)
+    return h.hexdigest()[:16]
+
+
+# version (hex hash) of a JSON-able value, e.g. settings or a list of versions
+
+
+def valueVersion(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=repr).encode('utf-8')).hexdigest()[:16]
@@ -0,0 +1,6 @@
+# The scripts in XMP_JSON import each other as top level modules, so the tests do the same
+
+import os, os.path
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,164 @@
+# End to end runs of batchConvert.py, in a separate process each (the batch settings are module globals)
+
+import os, os.path
+import subprocess
+import sys
+import json
+
+import pytest
+
+pytest.importorskip("libxmp")
+pytest.importorskip("scipy")
+
+import catalogReader
+import goldenCompare
+
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE = os.path.join(HERE, "XMP", "sample.xmp")
+SAMPLE_JSON = os.path.join(HERE, "json", "sample.json")
+
+
+def runBatch(*args):
+    result = subprocess.run([sys.executable, os.path.join(HERE, "batchConvert.py")] + [str(a) for a in args],
+                            cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    return result.returncode, result.stdout
+
+
+def loadJson(path):
+    with open(str(path), 'r') as inf:
+        return json.load(inf)
+
+
+def parameter(preset, filterKey, key):
+    return next(p["val"] for f in preset["filters"] if f["key"] == filterKey for p in f["parameters"] if p["key"] == key)
+
+
+# a copy of the sample preset in directory, with a different exposure
+def brighterSample(directory):
+    with open(SAMPLE, 'r') as inf:
+        text = inf.read()
+    assert 'crs:Exposure2012="-0.40"' in text
+    os.makedirs(str(directory))
+    path = os.path.join(str(directory), "bright.xmp")
+    with open(path, 'w') as outf:
+        outf.write(text.replace('crs:Exposure2012="-0.40"', 'crs:Exposure2012="+1.25"'))
+    return path
+
+
+# ----------------------------
+
+
+def test_catalog_fixture(tmp_path):
+    catalog = str(tmp_path / "test.lrcat")
+    catalogReader.writeFixture(catalog, [SAMPLE, brighterSample(tmp_path / "edits")])
+
+    inputs = list(catalogReader.findInputs(catalog, "out"))
+    assert [outfile for source, outfile, text in inputs] == [os.path.join("out", "XMP", "sample.json"),
+                                                              os.path.join("out", "edits", "bright.json")]
+    settings = [catalogReader.parseSettings(text) for source, outfile, text in inputs]
+    assert [s["Exposure2012"] for s in settings] == [-0.4, 1.25]
+    assert len(settings[0]["ToneCurvePV2012"]) % 2 == 0
+
+    out = tmp_path / "out"
+    code, output = runBatch(catalog, out)
+    assert code == 0, output
+
+    # the same develop settings as the sidecar: the same preset
+    sample = loadJson(out / "XMP" / "sample.json")
+    assert goldenCompare.diffPresets(loadJson(SAMPLE_JSON), sample) == []
+    bright = loadJson(out / "edits" / "bright.json")
+    assert parameter(bright, "CIExposureAdjust", "inputEV") == pytest.approx(1.25)
+    assert parameter(sample, "CIExposureAdjust", "inputEV") == pytest.approx(-0.4)
+
+    # finished: the second run converts nothing
+    code, output = runBatch(catalog, out)
+    assert code == 0 and "skipped 2 finished inputs" in output, output
+
+
+# a sidecar without any Camera Raw settings, in directory
+def plainSidecar(directory):
+    path = os.path.join(str(directory), "plain.xmp")
+    with open(path, 'w') as outf:
+        outf.write('<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+                   '<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/" dc:format="image/dng"/>'
+                   '</rdf:RDF></x:xmpmeta>\n')
+    return path
+
+
+def journalStatus(path):
+    status = {}
+    with open(str(path), 'r') as inf:
+        for line in inf:
+            record = json.loads(line)
+            status[os.path.basename(record["input"])] = record["status"]
+    return status
+
+
+def test_prefilter_skip(tmp_path):
+    indir = tmp_path / "in"
+    indir.mkdir()
+    with open(SAMPLE, 'r') as inf, open(str(indir / "sample.xmp"), 'w') as outf:
+        outf.write(inf.read())
+    plainSidecar(indir)
+
+    out = tmp_path / "out"
+    code, output = runBatch(indir, out, "--prefilter", "skip", "--shard", "0/1")
+    assert code == 0, output
+    shardDir = out / "shard-0-of-1"
+    assert journalStatus(shardDir / ".batch-journal.jsonl") == { "sample.xmp": "done", "plain.xmp": "filtered" }
+    assert not (shardDir / "plain.json").exists()
+    manifest = loadJson(shardDir / "manifest.json")
+    assert list(manifest["converted"].keys()) == ["sample.xmp"] and manifest["filtered"] == ["plain.xmp"]
+
+    # the merge knows that the skipped input has no output
+    merged = subprocess.run([sys.executable, os.path.join(HERE, "mergeShards.py"), str(out), str(tmp_path / "merged"), "--copy"],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    assert merged.returncode == 0, merged.stdout
+    assert "GAP" not in merged.stdout and "Skipped 1 inputs" in merged.stdout
+    assert os.listdir(str(tmp_path / "merged")) == ["sample.json"]
+
+    code, output = runBatch(indir, out, "--prefilter", "skip", "--shard", "0/1")
+    assert code == 0 and "skipped 2 finished inputs" in output, output
+    # without the prefilter, the skipped input is converted after all
+    code, output = runBatch(indir, out, "--prefilter", "off", "--shard", "0/1")
+    assert code == 0 and "skipped 1 finished inputs" in output, output
+    assert (shardDir / "plain.json").exists()
+
+
+def test_unreadable_without_prefilter(tmp_path):
+    indir = tmp_path / "in"
+    indir.mkdir()
+    plainSidecar(indir)
+    out = tmp_path / "out"
+    # a cached listing of the input directory with a subdirectory that is gone: listed as unreadable
+    old = 1000000000
+    os.utime(str(indir), (old, old))
+    cache = str(tmp_path / "cache.jsonl")
+    with open(cache, 'w') as outf:
+        outf.write(json.dumps({ "root": str(indir) }) + "\n")
+        outf.write(json.dumps({ "dir": "", "mtime": os.stat(str(indir)).st_mtime_ns, "dirs": ["gone"],
+                                "files": [["plain.xmp", os.path.getsize(str(indir / "plain.xmp")), old]] }) + "\n")
+
+    code, output = runBatch(indir, out, "--prefilter", "off", "--discovery-cache", cache)
+    assert code == 0, output
+    assert "Prefilter" not in output
+    assert "UNREADABLE: gone: " in output
+
+
+def test_missing_output_is_reconverted(tmp_path):
+    indir = tmp_path / "in"
+    indir.mkdir()
+    with open(SAMPLE, 'r') as inf, open(str(indir / "sample.xmp"), 'w') as outf:
+        outf.write(inf.read())
+    brighterSample(indir / "more")
+
+    out = tmp_path / "out"
+    code, output = runBatch(indir, out)
+    assert code == 0, output
+    os.remove(str(out / "more" / "bright.json"))
+
+    code, output = runBatch(indir, out)
+    assert code == 0, output
+    assert "skipped 1 finished inputs" in output and "Reconverted 1 finished inputs whose output is missing" in output
+    assert (out / "more" / "bright.json").exists()
@@ -0,0 +1,205 @@
+# Fuzz tests for reading and fitting tone curves (getCurvePoints, cleanCurvePoints, downsampleCurve, fitCurve).
+#
+# The curves are generated from seeded random numbers (so failures can be reproduced from the seed), with the
+# worst cases a preset can contain: huge sequences, duplicate and unsorted points, malformed items and values out of
+# range. Every cleaned curve has to be something the spline fit accepts, and every fit has to stay within its range.
+#
+# Run from XMP_JSON: python -m pytest tests
+
+import math
+import random
+
+import pytest
+
+pytest.importorskip("libxmp")
+pytest.importorskip("scipy")
+
+import convertXMPToJson as converter
+
+
+SEEDS = range(50)
+
+# malformed curve items, as found in (hand edited or broken) presets
+JUNK_ITEMS = [ "", ",", "1", "1,2,3", "a, b", "12, x", "nan, 10", "10, inf", "-inf, 0", "1e999, 5", "  ", None, 17 ]
+
+
+class FakeXMP(object):
+    '''
+        The two calls getCurvePoints makes, over a list of curve items. Counts the items read
+    '''
+
+    def __init__(self, items):
+        self.items = items
+        self.reads = 0
+
+    def count_array_items(self, ns, key):
+        return len(self.items)
+
+    def get_array_item(self, ns, key, index):
+        self.reads += 1
+        return self.items[index - 1]
+
+
+@pytest.fixture(autouse=True)
+def quiet(capsys):
+    # the converter prints a warning for every bad curve
+    yield
+    capsys.readouterr()
+
+
+# ----------------------------
+
+
+# a random curve point, mostly within 0..255, sometimes outside it
+def randomPoint(rng):
+    if rng.random() < 0.1:
+        return [rng.uniform(-1000.0, 1000.0), rng.uniform(-1000.0, 1000.0)]
+    return [rng.choice([float(rng.randint(0, 255)), rng.uniform(0.0, 255.0)]), rng.uniform(0.0, 255.0)]
+
+
+# a random list of curve points: unsorted, with duplicate x values
+def randomPoints(rng, count):
+    points = [randomPoint(rng) for i in range(count)]
+    for i in range(rng.randint(0, count // 2)):
+        point = rng.choice(points)
+        points.append([point[0], rng.uniform(0.0, 255.0)])
+    rng.shuffle(points)
+    return points
+
+
+# random curve items ("x, y" strings), with junk mixed in
+def randomItems(rng, count):
+    items = []
+    for i in range(count):
+        if rng.random() < 0.2:
+            items.append(rng.choice(JUNK_ITEMS))
+        else:
+            x, y = randomPoint(rng)
+            items.append(rng.choice(["%s, %s", "%s,%s", " %s ,  %s "]) % (x, y))
+    return items
+
+
+def checkCleaned(points):
+    assert len(points) <= converter.maxCurvePoints
+    for x, y in points:
+        assert math.isfinite(x) and math.isfinite(y)
+        assert 0.0 <= x <= 255.0 and 0.0 <= y <= 255.0
+    xs = [p[0] for p in points]
+    assert all(a < b for a, b in zip(xs, xs[1:])), "x values must be strictly increasing"
+
+
+# ----------------------------
+
+
+@pytest.mark.parametrize("item", JUNK_ITEMS)
+def test_parseCurvePoint_rejects_junk(item):
+    assert converter.parseCurvePoint(item) is None
+
+
+def test_parseCurvePoint_clamps():
+    assert converter.parseCurvePoint("-10, 300") == [0.0, 255.0]
+    assert converter.parseCurvePoint(" 64 ,128 ") == [64.0, 128.0]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_cleanCurvePoints_small(seed):
+    rng = random.Random(seed)
+    points = [[converter.clamp(x, 0.0, 255.0), converter.clamp(y, 0.0, 255.0)] for x, y in randomPoints(rng, rng.randint(0, 20))]
+    cleaned = converter.cleanCurvePoints(points)
+    checkCleaned(cleaned)
+
+    # not downsampled: one point per x value, the last one wins
+    last = {}
+    for x, y in points:
+        last[x] = y
+    assert cleaned == [[x, last[x]] for x in sorted(last.keys())]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_cleanCurvePoints_huge(seed):
+    rng = random.Random(seed)
+    points = [[converter.clamp(x, 0.0, 255.0), converter.clamp(y, 0.0, 255.0)] for x, y in randomPoints(rng, rng.randint(100, 5000))]
+    cleaned = converter.cleanCurvePoints(points)
+    checkCleaned(cleaned)
+    # the end points of the curve are kept
+    xs = [p[0] for p in points]
+    assert cleaned[0][0] == min(xs) and cleaned[-1][0] == max(xs)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_downsampleCurve(seed):
+    rng = random.Random(seed)
+    count = rng.randint(3, 3000)
+    xs = sorted(rng.sample(range(0, 256000), count))
+    points = [[x / 1000.0, rng.uniform(0.0, 255.0)] for x in xs]
+    maxPoints = rng.randint(2, 64)
+
+    reduced = converter.downsampleCurve(points, rng.choice([0.0, 0.5, 10.0]), maxPoints)
+    assert 2 <= len(reduced) <= maxPoints
+    assert reduced[0] == points[0] and reduced[-1] == points[-1]
+    # a subset of the original points, in order
+    original = set((x, y) for x, y in points)
+    assert all((x, y) in original for x, y in reduced)
+    assert all(a[0] < b[0] for a, b in zip(reduced, reduced[1:]))
+
+
+def test_downsampleCurve_zero_tolerance():
+    points = [[float(x), float(x % 7)] for x in range(256)]
+    reduced = converter.downsampleCurve(points, 0.0, 10)
+    assert 2 <= len(reduced) <= 10
+
+
+def test_downsampleCurve_limits(monkeypatch):
+    points = [[float(x), float(x % 7)] for x in range(256)]
+    with pytest.raises(ValueError):
+        converter.downsampleCurve(points, 0.5, 1)
+    # the tolerance never gets large enough: only the end points are left
+    monkeypatch.setattr(converter, "maxCurveDoublings", 2)
+    assert converter.downsampleCurve(points, 0.5, 3) == [[0.0, 0.0], [255.0, 3.0]]
+
+
+def test_downsampleCurve_straight_line():
+    points = [[float(x), float(x)] for x in range(256)]
+    assert converter.downsampleCurve(points, 0.5, 32) == [[0.0, 0.0], [255.0, 255.0]]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_getCurvePoints(seed):
+    rng = random.Random(seed)
+    count = rng.choice([0, 1, 2, rng.randint(3, 50), rng.randint(1000, 20000)])
+    fake = FakeXMP(randomItems(rng, count))
+    converter.xmp = fake
+
+    points = converter.getCurvePoints("ToneCurvePV2012")
+    checkCleaned(points)
+    # long sequences are sampled, not read in full
+    assert fake.reads <= converter.maxCurveItems + 1
+
+
+def test_getCurvePoints_only_junk():
+    converter.xmp = FakeXMP(JUNK_ITEMS * 10)
+    assert converter.getCurvePoints("ToneCurvePV2012") == []
+
+
+def test_getCurvePoints_duplicates_and_unsorted():
+    converter.xmp = FakeXMP(["255, 255", "0, 0", "128, 100", "64, 32", "128, 140", "0, 10"])
+    assert converter.getCurvePoints("ToneCurvePV2012") == [[0.0, 10.0], [64.0, 32.0], [128.0, 140.0], [255.0, 255.0]]
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("scale", [1.0, 100.0])
+def test_fitCurve(seed, scale):
+    rng = random.Random(seed)
+    points = converter.cleanCurvePoints([[converter.clamp(x, 0.0, 255.0), converter.clamp(y, 0.0, 255.0)]
+                                         for x, y in randomPoints(rng, rng.randint(3, 500))])
+    if len(points) < 3:
+        # linear, not fitted (see processToneCurve)
+        return
+    xcurve = [scale * i / 255.0 for i in sorted(rng.sample(range(256), rng.randint(1, 16)))]
+
+    ycurve = converter.fitCurve(points, scale, xcurve)
+    assert len(ycurve) == len(xcurve)
+    for y in ycurve:
+        assert math.isfinite(y) and 0.0 <= y <= scale
+    # memoised: the same fit again
+    assert converter.fitCurve(points, scale, xcurve) == ycurve
@@ -0,0 +1,37 @@
+# Tests for the input discovery (discovery.py) and its directory cache
+
+import os, os.path
+
+import discovery
+
+
+OLD = 1000000000
+
+
+def scan(root, cache):
+    found = discovery.Discovery(root, ".xmp", 2, cache)
+    files = sorted(found.scan())
+    return files, found.summary()
+
+
+def test_cached_listing_reports_current_files(tmp_path):
+    root = tmp_path / "in"
+    (root / "sub").mkdir(parents=True)
+    (root / "a.xmp").write_text("a")
+    (root / "sub" / "b.xmp").write_text("b")
+    (root / "sub" / "c.txt").write_text("c")
+    for directory in [root / "sub", root]:
+        os.utime(str(directory), (OLD, OLD))
+    cache = str(tmp_path / "cache.jsonl")
+
+    files, summary = scan(str(root), cache)
+    assert [os.path.relpath(path, str(root)) for path, size, mtime in files] == ["a.xmp", os.path.join("sub", "b.xmp")]
+    assert summary["cached"] == 0
+
+    # rewritten in place: the directory's mtime does not change, the cached listing is used, with the new size
+    (root / "sub" / "b.xmp").write_text("rewritten")
+    os.utime(str(root / "sub" / "b.xmp"), (OLD + 60, OLD + 60))
+    os.utime(str(root / "sub"), (OLD, OLD))
+    files, summary = scan(str(root), cache)
+    assert summary["cached"] == 2
+    assert files[1] == (str(root / "sub" / "b.xmp"), len("rewritten"), OLD + 60)
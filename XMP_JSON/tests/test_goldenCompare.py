@@ -0,0 +1,86 @@
+# Tests for the golden-output regression harness (goldenCompare.py), including a run against the reference output in
+# the repo (XMP/ -> json/)
+
+import os, os.path
+import json
+
+import pytest
+
+pytest.importorskip("libxmp")
+pytest.importorskip("scipy")
+
+import goldenCompare
+
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+XMP_DIR = os.path.join(HERE, "XMP")
+JSON_DIR = os.path.join(HERE, "json")
+
+
+def compare(indir, golden, stream=False):
+    return goldenCompare.compareGoldens(goldenCompare.findInputs(indir), indir, golden, HERE, 1, stream)
+
+
+# ----------------------------
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_reference_outputs(stream):
+    # the stored output has a different key (output path): not a change
+    report = compare(XMP_DIR, JSON_DIR, stream)
+    assert report["files"] == {}
+    assert report["summary"]["same"] == len(goldenCompare.findInputs(XMP_DIR)) > 0
+
+
+def test_update_then_detect_changes(tmp_path):
+    golden = str(tmp_path / "golden")
+    files = goldenCompare.findInputs(XMP_DIR)
+    timing = goldenCompare.updateGoldens(files, XMP_DIR, golden, HERE, 1, False)
+    assert timing["files"] == len(files) and timing["failed"] == []
+    assert compare(XMP_DIR, golden)["summary"]["same"] == len(files)
+
+    path = goldenCompare.goldenPath(golden, files[0])
+    with open(path, 'r') as inf:
+        preset = json.load(inf)
+    parameter = next(p for f in preset["filters"] for p in f["parameters"] if isinstance(p["val"], float))
+
+    # within the tolerance
+    parameter["val"] += 1e-9
+    with open(path, 'w') as outf:
+        json.dump(preset, outf)
+    assert compare(XMP_DIR, golden)["summary"]["withinTolerance"] == 1
+
+    # beyond it
+    parameter["val"] += 0.5
+    with open(path, 'w') as outf:
+        json.dump(preset, outf)
+    report = compare(XMP_DIR, golden)
+    assert report["summary"]["changed"] == 1
+    changes = report["files"][files[0]]["changes"]
+    assert [c["change"] for c in changes] == ["parameter changed"]
+    assert changes[0]["parameter"] == parameter["key"]
+    assert changes[0]["delta"] == pytest.approx(-0.5, abs=1e-6)
+
+    os.remove(path)
+    assert compare(XMP_DIR, golden)["summary"]["missing"] == 1
+
+
+def test_diffPresets():
+    def preset(key, filters, **fields):
+        p = { "key": key, "info": { "name": "x" }, "filters": filters }
+        p.update(fields)
+        return p
+
+    exposure = { "key": "CIExposureAdjust", "parameters": [ { "key": "inputEV", "val": 0.5, "type": "CIAttributeTypeScalar" } ] }
+    grain = { "key": "FilmGrainFilter", "parameters": [] }
+
+    assert goldenCompare.diffPresets(preset("a.json", [exposure]), preset("out/a.json", [exposure])) == []
+
+    changes = goldenCompare.diffPresets(preset("a", [exposure]), preset("a", [exposure, grain, grain]))
+    assert [(c["change"], c["filter"]) for c in changes] == [("filter added", "FilmGrainFilter"), ("filter added", "FilmGrainFilter#2")]
+
+    changes = goldenCompare.diffPresets(preset("a", [exposure, grain]), preset("a", [grain, exposure]))
+    assert [c["change"] for c in changes] == ["filter moved"]
+
+    changes = goldenCompare.diffPresets(preset("a", [], cost={ "perPixel": 3.0 }), preset("a", [], cost={ "perPixel": 4.0 }))
+    assert [c["change"] for c in changes] == ["cost changed"]
@@ -0,0 +1,25 @@
+# Tests for the staged pipeline (pipeline.py)
+
+import threading
+
+import pytest
+
+import pipeline
+
+
+def test_failing_input_finishes_the_fed_items():
+    done = []
+
+    def items():
+        for i in range(3):
+            yield i
+        raise IOError("input gone")
+
+    stages = [ pipeline.Stage("double", lambda item: 2 * item, 2, 1),
+               pipeline.Stage("collect", done.append, 1, 1) ]
+    before = threading.active_count()
+    with pytest.raises(IOError):
+        pipeline.Pipeline(stages).run(items())
+    # the items fed before the error went through every stage, and the workers have stopped
+    assert sorted(done) == [0, 2, 4]
+    assert threading.active_count() == before
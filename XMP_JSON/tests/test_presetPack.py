@@ -0,0 +1,73 @@
+# Round trips of presets through a pack (presetPack.py)
+
+import os, os.path
+import copy
+import json
+
+import canonicalJson
+import costModel
+import presetPack
+
+
+SAMPLE_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "json", "sample.json")
+
+
+def writePreset(path, preset):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as outf:
+        json.dump(preset, outf)
+
+
+# a group of variants of the sample preset below indir, with their preview-lite and other target variants
+def writeGroup(indir):
+    with open(SAMPLE_JSON, 'r') as inf:
+        sample = json.load(inf)
+    presets = {}
+    for i in range(4):
+        preset = copy.deepcopy(sample)
+        preset["key"] = "look-" + str(i) + ".json"
+        preset["filters"][0]["parameters"][0]["val"] = 0.25 * i
+        if i % 2 == 1:
+            preset["cost"] = { "perPixel": 3.5 + i, "passes": 2, "overBudget": True }
+        if i == 3:
+            del preset["filters"][1]
+        rel = "sub/look-" + str(i) + ".json" if i == 2 else "look-" + str(i) + ".json"
+        writePreset(os.path.join(indir, *rel.split("/")), preset)
+        presets[rel] = preset
+    writePreset(os.path.join(indir, costModel.liteFile("look-1.json")), { "key": "lite", "info": {}, "filters": [] })
+    writePreset(os.path.join(indir, "look-0.webgl.json"), { "key": "webgl", "info": {}, "filters": [] })
+    return presets
+
+
+# ----------------------------
+
+
+def test_round_trip(tmp_path):
+    presets = writeGroup(str(tmp_path))
+    groups = presetPack.loadPresets(str(tmp_path))
+    assert list(groups.keys()) == ["CREATIVE COLOUR PRESETS"]
+    # the variants are not packed
+    assert sorted(rel for rel, preset, size in groups["CREATIVE COLOUR PRESETS"]) == sorted(presets.keys())
+
+    for base in presetPack.BASES:
+        pack = presetPack.encodePack("CREATIVE COLOUR PRESETS", groups["CREATIVE COLOUR PRESETS"], base)
+        decoder = presetPack.Pack(json.loads(canonicalJson.dumps(pack)))
+        assert sorted(decoder.paths()) == sorted(presets.keys())
+        for rel, preset in presets.items():
+            assert decoder.preset(rel) == canonicalJson.canonicalize(preset)
+
+
+def test_decodeFile(tmp_path):
+    presets = writeGroup(str(tmp_path / "in"))
+    groups = presetPack.loadPresets(str(tmp_path / "in"))
+    pack = presetPack.encodePack("CREATIVE COLOUR PRESETS", groups["CREATIVE COLOUR PRESETS"])
+    path = str(tmp_path / presetPack.packName("CREATIVE COLOUR PRESETS"))
+    with open(path, 'w') as outf:
+        outf.write(canonicalJson.dumps(pack))
+
+    assert presetPack.decodeFile(path, str(tmp_path / "out")) == len(presets)
+    for rel, preset in presets.items():
+        with open(os.path.join(str(tmp_path / "out"), *rel.split("/")), 'r') as inf:
+            assert json.load(inf) == canonicalJson.canonicalize(preset)
@@ -0,0 +1,20 @@
+# Tests for finding the presets to render (previewRender.py)
+
+import os, os.path
+
+import pytest
+
+pytest.importorskip("scipy")
+pytest.importorskip("PIL")
+
+import previewRender
+
+
+def test_findPresets_skips_variants_and_manifests(tmp_path):
+    shard = tmp_path / "shard-0-of-2"
+    shard.mkdir()
+    for name in ["a.json", "a.lite.json", "a.webgl.json", "group.pack.json", "manifest.json", ".batch-journal.jsonl",
+                 "a.json.etag"]:
+        (shard / name).write_text("{}")
+    (tmp_path / "b.json").write_text("{}")
+    assert previewRender.findPresets(str(tmp_path)) == [str(tmp_path / "b.json"), str(shard / "a.json")]
@@ -0,0 +1,40 @@
+# Tests for the cost estimates and the windowed ordering of the inputs (scheduler.py)
+
+import itertools
+
+import scheduler
+
+
+def test_estimateCost_reads_a_prefix(tmp_path):
+    body = b"<rdf:li>0, 0</rdf:li>" * 20000
+    path = tmp_path / "big.xmp"
+    path.write_bytes(body)
+    estimate = scheduler.estimateCost(str(path))
+    assert len(body) > scheduler.PREFIX_BYTES
+    # the counts in the prefix are scaled up to the whole file
+    assert abs(estimate - scheduler.costOf(body)) < 0.01 * estimate
+    assert scheduler.estimateCost(str(tmp_path / "missing.xmp")) == scheduler.COST_FIXED
+
+
+def test_windowed_order_streams():
+    pulled = []
+
+    def stream():
+        for i in itertools.count():
+            pulled.append(i)
+            yield i
+
+    ordering = scheduler.WindowedOrder("largest-first", 2, float, window=4)
+    items = ordering.items(stream())
+    # the first window is ordered without reading further
+    assert [next(items) for i in range(4)] == [3, 2, 1, 0]
+    assert len(pulled) == 4
+    assert next(items) == 7
+
+
+def test_windowed_order_estimates():
+    costs = [1.0, 5.0, 2.0, 8.0, 3.0]
+    ordering = scheduler.WindowedOrder("fifo", 2, float, window=2)
+    assert list(ordering.items(costs)) == costs
+    assert ordering.estimates["fifo"] == scheduler.simulate(costs, 2)
+    assert ordering.estimates["largest-first"] <= ordering.estimates["fifo"]
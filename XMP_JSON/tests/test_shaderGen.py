@@ -0,0 +1,53 @@
+# Tests for the generated kernel sources (shaderGen.py): several fused passes in one preset
+
+import os, os.path
+import re
+import json
+
+import pytest
+
+pytest.importorskip("scipy")
+
+import shaderGen
+
+
+SAMPLE_JSON = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "json", "sample.json")
+
+
+# two fused runs, both with curves and HSV bands, either side of a spatial filter
+@pytest.fixture
+def kernels():
+    with open(SAMPLE_JSON, 'r') as inf:
+        filters = dict((f["key"], f) for f in json.load(inf)["filters"])
+    chain = [filters[key] for key in ["CIToneCurve", "MultiBandHSV", "CISharpenLuminance", "RGBChannelToneCurve", "MultiBandHSV"]]
+    passes = [filters for kind, filters in shaderGen.splitPasses(chain) if kind == "fused"]
+    assert len(passes) == 2
+    return lambda target: [shaderGen.kernelCode(shaderGen.kernelSteps(run), "presetKernel" + str(i), target)
+                           for i, run in enumerate(passes)]
+
+
+def test_metal_kernels_in_one_file(kernels):
+    source = shaderGen.generateSource(kernels("metal"), "metal")
+    tables = re.findall(r'constant float (\w+)\[', source)
+    functions = re.findall(r'^(?:float|float3) (\w+)\(', source, re.MULTILINE)
+    # one table for the tone curve, three for the RGB curves
+    assert len(tables) == 4 and len(set(tables)) == len(tables)
+    assert sorted(functions) == sorted(set(functions))
+    assert functions.count("rgb2hsv") == 1 and functions.count("hsv2rgb") == 1
+    assert source.count("#include <metal_stdlib>") == 1
+    assert [name for name in re.findall(r'extern "C" float4 (\w+)\(', source)] == ["presetKernel0", "presetKernel1"]
+
+
+def test_glsl_shader_per_kernel(kernels):
+    code = kernels("glsl")
+    with pytest.raises(ValueError):
+        shaderGen.generateSource(code, "glsl")
+    for kernel in code:
+        source = shaderGen.generateSource([kernel], "glsl")
+        assert source.count("#version") == 1 and source.count("void main()") == 1
+        assert source.count("uniform sampler2D inputImage;") == 1
+
+
+def test_kernelFile():
+    assert shaderGen.kernelFile("out/preset.frag", "presetKernel1") == "out/preset.presetKernel1.frag"
+    assert shaderGen.kernelFile(None, "presetKernel1") is None
@@ -0,0 +1,58 @@
+# Short soak runs (soakConvert.py): every conversion must be isolated from the one before it, with either lifecycle
+
+import os, os.path
+import random
+
+import pytest
+
+pytest.importorskip("libxmp")
+pytest.importorskip("scipy")
+
+import convertXMPToJson as converter
+import soakConvert
+
+
+TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "XMP", "sample.xmp")
+
+
+@pytest.fixture
+def template():
+    with open(TEMPLATE, 'r') as inf:
+        return inf.read()
+
+
+# ----------------------------
+
+
+@pytest.mark.parametrize("lifecycle", ["fresh", "pooled"])
+def test_soak(template, lifecycle, monkeypatch):
+    monkeypatch.setattr(converter, "lifecycle", lifecycle)
+    result = soakConvert.soak(template, 200, seed=3, warmup=50, checkEvery=10, reportEvery=0)
+    assert result["count"] == 200
+    assert result["errors"] == []
+    assert result["checks"] == 20
+    assert result["leaks"] == []
+    assert 0 < result["baselineRSS"] <= result["peakRSS"]
+
+
+def test_synthesize_is_seeded(template):
+    first = [soakConvert.synthesize(template, random.Random(7)) for i in range(2)]
+    assert first[0] == first[1]
+    assert soakConvert.synthesize(template, random.Random(8)) != first[0]
+
+
+def test_baseline_when_warmup_conversion_fails(template, monkeypatch):
+    convert = soakConvert.convert
+
+    def failing(data, n):
+        if n == 9:
+            raise ValueError("broken preset")
+        return convert(data, n)
+
+    monkeypatch.setattr(soakConvert, "convert", failing)
+    result = soakConvert.soak(template, 20, warmup=10, checkEvery=0, reportEvery=0)
+    assert result["errors"] == [(9, "broken preset")]
+    assert result["count"] == 20
+    assert result["baselineRSS"] > 0
+    # growth is measured from the baseline, not from 0
+    assert result["peakRSS"] - result["baselineRSS"] < result["baselineRSS"]
@@ -0,0 +1,52 @@
+# Tests for the supervised worker processes (workerPool.py). The task functions are started in spawned processes, so
+# they are module level functions here
+
+import os
+import multiprocessing
+
+import pytest
+
+import workerPool
+
+
+def whereAmI(value):
+    return (value, os.getpid(), workerPool.workerSlot, multiprocessing.current_process().name != "MainProcess")
+
+
+def crash(value):
+    os._exit(3)
+
+
+@pytest.fixture
+def pool():
+    pools = []
+
+    def make(func, **kwargs):
+        pools.append(workerPool.WorkerPool(func, 2, timeout=30.0, **kwargs))
+        return pools[-1]
+    yield make
+    for p in pools:
+        p.shutdown()
+
+
+# ----------------------------
+
+
+def test_slots_survive_recycling(pool):
+    p = pool(whereAmI, maxTasks=2)
+    assert p.context.get_start_method() == workerPool.START_METHOD
+    results = [p.run(i) for i in range(6)]
+    assert [value for value, pid, slot, child in results] == list(range(6))
+    assert all(child and pid != os.getpid() for value, pid, slot, child in results)
+    # recycled every 2 tasks: new processes, in the same 2 slots
+    assert set(slot for value, pid, slot, child in results) == {0, 1}
+    assert len(set(pid for value, pid, slot, child in results)) == 4
+    assert p.summary()["recycled"] == 2
+
+
+def test_crash_is_quarantined(pool):
+    p = pool(crash)
+    with pytest.raises(workerPool.WorkerFailure):
+        p.run("bad input")
+    assert [key for key, reason in p.quarantine] == ["bad input"]
+    assert p.summary()["crashes"] == 2
@@ -0,0 +1,219 @@
+#! /usr/bin/python
+
+# Supervised pool of worker processes, used for the conversions of batchConvert.py --processes N.
+#
+# libxmp/exempi is native code: a corrupt sidecar can crash (e.g. segfault) or hang the process that parses it. In a
+# concurrent.futures pool a dead worker breaks the whole pool, and a hung one holds up the batch forever. Here each
+# worker is supervised separately:
+#   - every task has a wall-clock timeout, after which the worker is killed
+#   - a worker that dies or is killed is replaced by a new one, and the task is retried once on the new worker
+#   - a task that crashes or times out again is quarantined (recorded with the reason) and fails with WorkerFailure,
+#     so one bad input costs one retry, not the batch
+#   - workers are recycled (replaced) after a number of tasks, or once their RSS passes a limit, so that slow leaks in
+#     native code cannot build up
+# Exceptions raised by the task function itself are passed back to the caller as usual (no retry).
+# The metrics recorded by a task in the worker (see metrics.py) are sent back with its result and merged into the
+# parent's registry, so that they are reported by the parent.
+#
+# run() is called from the caller's threads (e.g. the pipeline's converter threads) and blocks until the task is done.
+# The workers are started with "spawn" rather than fork: the parent runs threads (the pipeline, directory scans), and a
+# forked child could inherit a lock held by one of them. So func and initializer have to be importable (module level)
+# functions, and the worker's settings have to be passed to it by the initializer.
+
+import os
+import time
+import threading
+import queue
+import multiprocessing
+
+import metrics
+
+
+# how the worker processes are started (see multiprocessing.get_context)
+START_METHOD = "spawn"
+
+# the slot of this process in its pool (set in the worker processes): workers that replace each other share a slot
+workerSlot = None
+
+
+class WorkerFailure(Exception):
+    '''
+        A task crashed or hung its worker process (and did so again when retried)
+    '''
+    pass
+
+
+# ----------------------------
+
+
+# main loop of a worker process: receives the task arguments, returns (ok, result or exception, RSS, metrics recorded)
+
+
+def workerMain(conn, func, initializer, initargs, slot):
+    global workerSlot
+    workerSlot = slot
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            break
+        if args is None:
+            break
+        try:
+            reply = (True, func(*args))
+        except Exception as e:
+            reply = (False, e)
+        delta = metrics.registry.drain()
+        try:
+            conn.send(reply + (metrics.residentMemory(), delta))
+        except Exception as e:
+            # e.g. an exception that cannot be pickled
+            conn.send((False, RuntimeError(type(e).__name__ + ": " + str(e)), metrics.residentMemory(), delta))
+
+
+class Worker(object):
+    '''
+        A worker process (in a slot of the pool) and the parent's end of its pipe
+    '''
+
+    def __init__(self, context, func, initializer, initargs, slot):
+        self.slot = slot
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=workerMain, args=(child, func, initializer, initargs, slot))
+        self.process.daemon = True
+        self.process.start()
+        child.close()
+        self.tasks = 0
+        self.rss = 0
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except (IOError, OSError):
+                pass
+        self.process.join(5.0)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+# ----------------------------
+
+
+class WorkerPool(object):
+    '''
+        Runs func(*args) in a pool of supervised worker processes. timeout is the wall-clock limit per task (secs, None:
+        no limit), maxTasks/maxRSS (MB) the limits after which a worker is recycled (None: no limit). context is the
+        multiprocessing context the workers are started with (default: START_METHOD)
+    '''
+
+    def __init__(self, func, workers, initializer=None, initargs=(), timeout=60.0, maxTasks=1000, maxRSS=None, retries=1,
+                 context=None):
+        self.context = context if context is not None else multiprocessing.get_context(START_METHOD)
+        self.func = func
+        self.initializer = initializer
+        self.initargs = initargs
+        self.timeout = timeout
+        self.maxTasks = maxTasks
+        self.maxRSS = maxRSS
+        self.retries = retries
+
+        self.lock = threading.Lock()
+        self.stats = { "tasks": 0, "crashes": 0, "timeouts": 0, "restarts": 0, "recycled": 0 }
+        self.quarantine = []  # list of (key, reason)
+
+        self.idle = queue.Queue()
+        self.workers = []
+        for i in range(max(1, workers)):
+            self.release(self.startWorker(i))
+
+    def startWorker(self, slot):
+        worker = Worker(self.context, self.func, self.initializer, self.initargs, slot)
+        with self.lock:
+            self.workers.append(worker)
+        return worker
+
+    def replace(self, worker, kill):
+        with self.lock:
+            self.workers.remove(worker)
+        worker.stop(kill)
+        return self.startWorker(worker.slot)
+
+    def release(self, worker):
+        self.idle.put(worker)
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    # ----------------------------
+
+    # run a task and return its result. key identifies the task in the quarantine list (default: the first argument)
+
+    def run(self, *args, **kwargs):
+        key = kwargs.get("key", args[0] if len(args) > 0 else None)
+        reasons = []
+        for attempt in range(self.retries + 1):
+            worker = self.idle.get()
+            try:
+                ok, value, rss, delta = self.send(worker, args)
+            except WorkerFailure as e:
+                reasons.append(str(e))
+                self.count("restarts")
+                self.release(self.replace(worker, kill=True))
+                continue
+
+            metrics.registry.merge(delta)
+            worker.tasks += 1
+            worker.rss = rss
+            self.count("tasks")
+            if ((self.maxTasks is not None and worker.tasks >= self.maxTasks) or
+                    (self.maxRSS is not None and rss > self.maxRSS * 1048576)):
+                self.count("recycled")
+                worker = self.replace(worker, kill=False)
+            self.release(worker)
+            if not ok:
+                raise value
+            return value
+
+        with self.lock:
+            self.quarantine.append((key, "; ".join(reasons)))
+        raise WorkerFailure("quarantined after " + str(len(reasons)) + " attempts: " + "; ".join(reasons))
+
+    def send(self, worker, args):
+        try:
+            worker.conn.send(args)
+            if not worker.conn.poll(self.timeout):
+                self.count("timeouts")
+                raise WorkerFailure("timed out after " + str(self.timeout) + "s (worker " + str(worker.pid) + ")")
+            return worker.conn.recv()
+        except (EOFError, IOError, OSError):
+            # the worker died
+            worker.process.join(1.0)
+            self.count("crashes")
+            raise WorkerFailure("worker " + str(worker.pid) + " died (exit code " + str(worker.process.exitcode) + ")")
+
+    # ----------------------------
+
+    def shutdown(self):
+        with self.lock:
+            workers = list(self.workers)
+            self.workers = []
+        for worker in workers:
+            worker.stop()
+
+    def summary(self):
+        with self.lock:
+            summary = dict(self.stats)
+            summary["quarantined"] = len(self.quarantine)
+        return summary
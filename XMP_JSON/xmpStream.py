@@ -0,0 +1,236 @@
+#! /usr/bin/python
+
+# Incremental (streaming) reader for XMP sidecars/presets.
+#
+# Sidecars exported from Lightroom can carry large xmpMM:History, photoshop:DocumentAncestors and thumbnail blocks,
+# none of which are used by the converter. Rather than reading the whole file and building a full XMP tree (libxmp),
+# this reader streams the file through expat and only keeps:
+#   - crs: attributes of the top-level rdf:Description elements
+#   - simple crs: property elements and crs: language alternatives (Name, Group etc.)
+#   - crs:ToneCurve* sequences
+# Everything else is skipped as it is parsed, without being buffered, so memory use does not depend on the sidecar size.
+#
+# The returned object provides the subset of the XMPMeta API used by convertXMPToJson.py, so it can be used in place of xmp
+
+import xml.parsers.expat
+
+
+XMP_NS_CAMERA_RAW = "http://ns.adobe.com/camera-raw-settings/1.0/"
+XMP_NS_RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+XMP_NS_XML = "http://www.w3.org/XML/1998/namespace"
+
+# expat reports namespaced names as "<namespace><separator><local name>"
+NS_SEPARATOR = " "
+
+RDF_RDF = XMP_NS_RDF + NS_SEPARATOR + "RDF"
+RDF_DESCRIPTION = XMP_NS_RDF + NS_SEPARATOR + "Description"
+RDF_LI = XMP_NS_RDF + NS_SEPARATOR + "li"
+RDF_SEQ = XMP_NS_RDF + NS_SEPARATOR + "Seq"
+RDF_BAG = XMP_NS_RDF + NS_SEPARATOR + "Bag"
+RDF_ALT = XMP_NS_RDF + NS_SEPARATOR + "Alt"
+XML_LANG = XMP_NS_XML + NS_SEPARATOR + "lang"
+
+# limit on the text kept for any single value, so that a bogus (huge) crs: value cannot blow up memory
+maxValueLength = 65536
+
+# size of the chunks read from the file
+chunkSize = 65536
+
+
+# ----------------------------
+
+
+class StreamedXMP(object):
+    '''
+        Camera Raw properties extracted from an XMP file. Mimics the (read-only) XMPMeta calls used by the converter.
+        Only the camera raw namespace is supported, other namespaces are reported as missing.
+    '''
+
+    def __init__(self):
+        self.properties = {} # name -> string value
+        self.arrays = {}     # name -> list of item strings
+
+    def does_property_exist(self, schema_ns, prop_name):
+        if schema_ns != XMP_NS_CAMERA_RAW:
+            return False
+        return (prop_name in self.properties) or (prop_name in self.arrays)
+
+    def get_property(self, schema_ns, prop_name):
+        if schema_ns != XMP_NS_CAMERA_RAW or prop_name not in self.properties:
+            return None
+        return self.properties[prop_name]
+
+    def get_property_float(self, schema_ns, prop_name):
+        return float(self.get_property(schema_ns, prop_name))
+
+    def get_property_bool(self, schema_ns, prop_name):
+        return self.get_property(schema_ns, prop_name).strip().lower() in ("true", "1")
+
+    def get_localized_text(self, schema_ns, alt_text_name, generic_lang, specific_lang):
+        return self.get_property(schema_ns, alt_text_name)
+
+    def count_array_items(self, schema_ns, array_name):
+        if schema_ns != XMP_NS_CAMERA_RAW or array_name not in self.arrays:
+            return 0
+        return len(self.arrays[array_name])
+
+    def get_array_item(self, schema_ns, array_name, item_index):
+        # Note: XMP array indexes start at 1
+        return self.arrays[array_name][item_index-1]
+
+
+# ----------------------------
+
+
+class _StreamHandler(object):
+    '''
+        expat callbacks. Tracks just enough state to know where we are in the RDF structure:
+            rdf:RDF > rdf:Description > crs:Property [ > rdf:Seq/Bag/Alt > rdf:li ]
+        Any other subtree is skipped by counting its depth.
+    '''
+
+    def __init__(self, result):
+        self.result = result
+        self.skipDepth = 0      # >0 while inside a skipped subtree
+        self.path = []          # stack of the (kept) open elements
+        self.propName = None    # name of the crs property being read
+        self.container = None   # rdf container type of the property being read (if any)
+        self.text = []          # character data of the current value
+        self.textLength = 0
+        self.collect = False    # True if character data of the current element is wanted
+
+    def start(self, name, attrs):
+        if self.skipDepth > 0:
+            self.skipDepth += 1
+            return
+
+        parent = self.path[-1] if self.path else None
+        keep = False
+
+        if name == RDF_DESCRIPTION and parent == RDF_RDF:
+            # top level description: camera raw settings are usually stored as attributes
+            for key, value in attrs.items():
+                ns, _, local = key.rpartition(NS_SEPARATOR)
+                if ns == XMP_NS_CAMERA_RAW and local not in self.result.properties:
+                    self.result.properties[local] = value[:maxValueLength]
+            keep = True
+
+        elif parent == RDF_DESCRIPTION and len(self.path) >= 2 and self.path[-2] == RDF_RDF:
+            # property element. Only simple values and containers are kept, structs (attributes) are skipped
+            ns, _, local = name.rpartition(NS_SEPARATOR)
+            if ns == XMP_NS_CAMERA_RAW and not self.hasValueAttributes(attrs):
+                self.propName = local
+                self.container = None
+                self.startValue()
+                keep = True
+
+        elif self.propName is not None and parent is not None and parent.endswith(NS_SEPARATOR + self.propName) and self.container is None:
+            # container inside a property. Only ToneCurve sequences and language alternatives are needed
+            self.collect = False
+            if (name == RDF_SEQ or name == RDF_BAG) and self.propName.startswith("ToneCurve"):
+                self.container = name
+                self.result.arrays[self.propName] = []
+                keep = True
+            elif name == RDF_ALT:
+                self.container = name
+                keep = True
+            else:
+                self.propName = None
+
+        elif name == RDF_LI and self.container is not None and parent == self.container:
+            if not self.hasValueAttributes(attrs):
+                self.startValue()
+                keep = True
+
+        elif name == RDF_RDF or parent is None:
+            # x:xmpmeta wrapper (or a bare rdf:RDF)
+            keep = True
+
+        if keep:
+            self.path.append(name)
+        else:
+            self.skipDepth = 1
+
+    def end(self, name):
+        if self.skipDepth > 0:
+            self.skipDepth -= 1
+            return
+
+        self.path.pop()
+
+        if name == RDF_LI and self.collect:
+            value = "".join(self.text)
+            if self.container == RDF_ALT:
+                # keep the first alternative (x-default)
+                if self.propName not in self.result.properties:
+                    self.result.properties[self.propName] = value
+            else:
+                self.result.arrays[self.propName].append(value)
+            self.collect = False
+
+        elif self.propName is not None and name.endswith(NS_SEPARATOR + self.propName) and self.path and self.path[-1] == RDF_DESCRIPTION:
+            if self.collect and self.container is None and self.propName not in self.result.properties:
+                self.result.properties[self.propName] = "".join(self.text).strip()
+            self.propName = None
+            self.container = None
+            self.collect = False
+
+    def data(self, text):
+        if self.skipDepth == 0 and self.collect and self.textLength < maxValueLength:
+            text = text[:(maxValueLength - self.textLength)]
+            self.text.append(text)
+            self.textLength += len(text)
+
+    def startValue(self):
+        self.text = []
+        self.textLength = 0
+        self.collect = True
+
+    # True if an element carries attributes other than xml:lang (i.e. it is a struct or resource, not a simple value)
+    def hasValueAttributes(self, attrs):
+        for key in attrs.keys():
+            if key != XML_LANG:
+                return True
+        return False
+
+
+# ----------------------------
+
+
+# stream an XMP file and return the Camera Raw settings as a StreamedXMP object
+
+
+def parseFile(f):
+    result = StreamedXMP()
+    parser = createParser(result)
+
+    with open(f, 'rb') as inf:
+        while True:
+            chunk = inf.read(chunkSize)
+            if not chunk:
+                break
+            parser.Parse(chunk, False)
+        parser.Parse(b"", True)
+
+    return result
+
+
+# same thing, for XMP data that has already been read (bytes)
+
+
+def parseData(data):
+    result = StreamedXMP()
+    parser = createParser(result)
+    parser.Parse(data, True)
+    return result
+
+
+def createParser(result):
+    handler = _StreamHandler(result)
+
+    parser = xml.parsers.expat.ParserCreate(namespace_separator=NS_SEPARATOR)
+    parser.StartElementHandler = handler.start
+    parser.EndElementHandler = handler.end
+    parser.CharacterDataHandler = handler.data
+    parser.buffer_text = False
+    return parser